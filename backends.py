@@ -0,0 +1,157 @@
+'''
+Backends
+========
+
+Registry of the decoder backends a :class:`~vkeyboard.VKeyboard` can use.
+
+A backend is a name bound to a factory returning a new decoder, an object
+with the interface of :class:`~decoder.Decoder`, usually a subclass
+overriding some of its candidate searches::
+
+    class FastDecoder(Decoder):
+        def candidate_matches(self, gesture, prev_word, cancelled=None):
+            ...
+
+    register_backend('fast', FastDecoder)
+    keyboard.decoder_backend = 'fast'
+
+The built-in backends are 'default', the :class:`~decoder.Decoder` whose
+gesture search follows :data:`~vkeyboard.VKeyboard.gesture_search`, and
+'templates' and 'beam', which always use the exhaustive template scan and
+the beam search.
+
+A keyboard can also run a shadow backend, see
+:data:`~vkeyboard.VKeyboard.shadow_backend`: every gesture is decoded a
+second time in the background, and a :class:`ShadowComparison` records
+the latency and ranking of both decodings in :class:`ShadowStats`. The
+shadow results are never shown.
+'''
+
+__all__ = ('register_backend', 'create_decoder', 'backend_names',
+           'ShadowComparison', 'ShadowStats')
+
+from threading import Lock
+from time import time
+
+from decoder import Decoder
+from profiler import StageStats
+
+_backends = {}
+
+
+def register_backend(name, factory):
+    '''Make `factory`, a callable returning a new decoder, available as the
+    backend `name`.
+    '''
+    _backends[name] = factory
+
+
+def create_decoder(name):
+    '''Return a new decoder of the backend `name`. Raise a ValueError if
+    there is no such backend.
+    '''
+    factory = _backends.get(name)
+    if factory is None:
+        raise ValueError('unknown decoder backend <%s>' % name)
+    return factory()
+
+
+def backend_names():
+    return sorted(_backends)
+
+
+class TemplateDecoder(Decoder):
+    '''Decoder always scanning all the templates, without time budget.'''
+
+    def candidate_matches(self, gesture, prev_word, cancelled=None):
+        return self.anytime_matches(gesture, prev_word, None, cancelled)[0]
+
+
+class BeamDecoder(Decoder):
+    '''Decoder always using the beam search.'''
+
+    def candidate_matches(self, gesture, prev_word, cancelled=None):
+        return self.beam_matches(gesture, prev_word, cancelled)
+
+
+register_backend('default', Decoder)
+register_backend('templates', TemplateDecoder)
+register_backend('beam', BeamDecoder)
+
+
+class ShadowStats(object):
+    '''Comparison of a primary and a shadow backend over the gestures
+    decoded by both.
+
+    :data:`gestures` counts the compared gestures, :data:`top1_changed` and
+    :data:`ranking_changed` those whose first candidate and top candidates
+    differ. :data:`primary` and :data:`shadow` are the
+    :class:`~profiler.StageStats` of their decoding times.
+    '''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.gestures = 0
+            self.top1_changed = 0
+            self.ranking_changed = 0
+            self.primary = StageStats()
+            self.shadow = StageStats()
+
+    def add(self, primary, shadow, primary_time, shadow_time):
+        with self.lock:
+            self.gestures += 1
+            self.top1_changed += primary[:1] != shadow[:1]
+            self.ranking_changed += primary != shadow
+            self.primary.add(primary_time)
+            self.shadow.add(shadow_time)
+
+    def as_dict(self):
+        with self.lock:
+            return {'gestures': self.gestures,
+                    'top1_changed': self.top1_changed,
+                    'ranking_changed': self.ranking_changed,
+                    'primary': self.primary.as_dict(),
+                    'shadow': self.shadow.as_dict()}
+
+
+class ShadowComparison(object):
+    '''Results of one gesture decoded by the primary and the shadow
+    backends. The decoding functions are wrapped with :meth:`timed`; once
+    both returned, the comparison is added to `stats` and passed to
+    `report`, from the thread of the decoding that finished last.
+
+    :data:`rankings` and :data:`times` map 'primary' and 'shadow' to the
+    `top` first candidate words and the decoding time.
+    '''
+
+    def __init__(self, stats, report=None, top=6):
+        self.stats = stats
+        self.report = report
+        self.top = top
+        self.lock = Lock()
+        self.rankings = {}
+        self.times = {}
+
+    def timed(self, role, func):
+        '''Return `func` recording its result and duration as `role`.'''
+        def wrapper(*largs, **kwargs):
+            start = time()
+            matches = func(*largs, **kwargs)
+            self._record(role, matches, time() - start)
+            return matches
+        return wrapper
+
+    def _record(self, role, matches, elapsed):
+        with self.lock:
+            self.rankings[role] = [w for w, p in matches[:self.top]]
+            self.times[role] = elapsed
+            if len(self.rankings) < 2:
+                return
+        self.stats.add(self.rankings['primary'], self.rankings['shadow'],
+                       self.times['primary'], self.times['shadow'])
+        if self.report is not None:
+            self.report(self)
@@ -0,0 +1,149 @@
+'''
+Beam search
+===========
+
+Gesture decoding by walking the lexicon trie along the gesture, selectable
+instead of the template scan with :data:`~decoder.Decoder.gesture_search`.
+
+The normalized gesture is compared to the key centers once: for every key,
+the points where the gesture passes closest to it, within reach of the key,
+are the only points a letter on that key can be aligned to. The search
+starts from the letters whose key is near the first point of the gesture
+and extends each prefix with the letters of its trie children, aligning the
+next letter to the next pass of the gesture near its key. A child whose key
+the gesture doesn't pass near after the current point is pruned with its
+whole subtree.
+
+The cost of a prefix is the sum of the distances between the gesture
+points consumed so far and the key path of the prefix. Only the
+:data:`BeamSearch.beam_width` prefixes with the lowest mean cost per point
+are kept at each depth, so the work grows with the number of plausible
+prefixes rather than with the size of the lexicon.
+
+A word is a candidate when its last key is within
+:data:`~decoder.Decoder.end_window` keys of the end of the gesture and the
+gesture length is within the :data:`~decoder.Decoder.min_length_ratio` and
+:data:`~decoder.Decoder.max_length_ratio` of its key path length, like in
+the template scan. A prefix whose key path is already too long for the
+gesture is pruned. A candidate is scored like the template scan, from the
+mean distance of the gesture points to its key path and its n-gram
+probability.
+'''
+
+__all__ = ('BeamSearch', )
+
+from bisect import bisect_right
+from math import exp, hypot
+
+
+def segment_distance(point, a, b):
+    '''Return the distance between `point` and the segment [`a`, `b`].'''
+    px, py = point
+    ax, ay = a
+    dx, dy = b[0] - ax, b[1] - ay
+    length = dx * dx + dy * dy
+    t = 0. if length == 0 else max(0., min(1., ((px - ax) * dx + (py - ay) * dy) / length))
+    x, y = ax + t * dx, ay + t * dy
+    return ((px - x) ** 2 + (py - y) ** 2) ** 0.5
+
+
+class BeamSearch(object):
+    '''Trie-guided gesture search.
+
+    :Parameters:
+        `beam_width`: int
+            Number of prefixes kept at each depth.
+        `reach`: float
+            How close to a key, in key sizes, the gesture must pass for a
+            letter to be aligned there.
+    '''
+
+    def __init__(self, beam_width=32, reach=1.):
+        self.beam_width = beam_width
+        self.reach = reach
+
+    def passes(self, decoder, points):
+        '''Return a dict of letter to the (indices of the points where the
+        gesture passes closest to its key, distances of all the points to the
+        key center).
+        '''
+        max_dx = decoder.key_width * self.reach
+        max_dy = decoder.key_height * self.reach
+        last = len(points) - 1
+        passes = {}
+        for c, (cx, cy) in decoder.key_centers.items():
+            d = [((x - cx) ** 2 + (y - cy) ** 2) ** 0.5 for x, y in points]
+            indices = [j for j, (x, y) in enumerate(points)
+                       if abs(x - cx) <= max_dx and abs(y - cy) <= max_dy and
+                       (j == 0 or d[j] <= d[j - 1]) and
+                       (j == last or d[j] < d[j + 1])]
+            if indices:
+                passes[c] = (indices, d)
+        return passes
+
+    def matches(self, decoder, gesture, prev_word, cancelled=None):
+        '''Return the ranked (word, probability) candidates of `gesture`.'''
+        if decoder.templates is None:
+            return []
+        points = decoder.normalize(gesture)
+        n = len(points)
+        centers = decoder.key_centers
+        passes = self.passes(decoder, points)
+        ex, ey = points[-1]
+        max_dx = decoder.key_width * decoder.end_window
+        max_dy = decoder.key_height * decoder.end_window
+        gest_length = decoder.val_dist(gesture)[1]
+        min_length = gest_length / decoder.max_length_ratio
+        max_length = gest_length / decoder.min_length_ratio
+
+        # states are (cost, index of the last aligned point, letter, node,
+        # key path length)
+        beam = []
+        for c in decoder.start_letters(points[0]):
+            if c in passes:
+                for node in decoder.words.nodes(c):
+                    beam.append((passes[c][1][0], 0, c, node, 0.))
+
+        found = {}
+        while beam:
+            if cancelled is not None and cancelled.is_set():
+                break
+            extended = []
+            for cost, i, c, node, length in beam:
+                # a word ending on a key near the end of the gesture is a
+                # candidate, the remaining points are aligned to that key
+                if node.word is not None and min_length <= length:
+                    cx, cy = centers[c]
+                    if abs(cx - ex) <= max_dx and abs(cy - ey) <= max_dy:
+                        total = cost + sum(passes[c][1][i + 1:])
+                        if total < found.get(node.word, total + 1):
+                            found[node.word] = total
+                a = centers[c]
+                for m, child in node.children.items():
+                    if m not in passes:
+                        continue
+                    indices, d = passes[m]
+                    b = centers[m]
+                    if b == a:
+                        # same key, the letter is aligned to the same point
+                        extended.append((cost, i, m, child, length))
+                        continue
+                    child_length = length + hypot(b[0] - a[0], b[1] - a[1])
+                    if child_length > max_length:
+                        continue
+                    k = bisect_right(indices, i)
+                    if k == len(indices):
+                        continue
+                    j = indices[k]
+                    extended.append((
+                        cost + d[j] + sum(segment_distance(points[p], a, b)
+                                          for p in xrange(i + 1, j)),
+                        j, m, child, child_length))
+            extended.sort(key=lambda state: state[0] / (state[1] + 1))
+            beam = extended[:self.beam_width]
+
+        weight = decoder.distance_weight
+        candidates = [(word, exp(-weight * total / n) *
+                       decoder.get_ngram_probability(word, prev_word))
+                      for word, total in found.items()]
+        return decoder.rank_candidates(candidates)
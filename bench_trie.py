@@ -0,0 +1,183 @@
+#!/usr/bin/python
+'''
+Trie benchmark
+==============
+
+Micro-benchmarks of the :class:`~trie.Trie` operations on the shipped
+`1grams` corpus: building the trie, `__getitem__`, `__iter__`,
+`iter_prefix`, `search_correction` and `search_prediction`, for query
+lengths 1 to 10 and edit costs 0 to 2::
+
+    # record a baseline
+    python bench_trie.py --save trie_baseline.json
+    # later, fail if an operation got slower than the baseline
+    python bench_trie.py --baseline trie_baseline.json
+
+Timings are the best of `--repeat` runs of the mean time per call, in
+seconds. The queries are prefixes of words drawn with a fixed seed, so two
+runs time the same calls. Peak memory is the growth of the process maximum
+resident set size while building the trie, in KB.
+
+With `--baseline`, the run exits with status 1 if any timing or the peak
+memory exceeds its baseline by more than `--threshold` (a fraction).
+'''
+
+import argparse
+import json
+import random
+import resource
+import sys
+from time import time
+
+import trie
+
+lengths = range(1, 11)
+costs = (0, 1, 2)
+
+
+def read_words(unigrams_fn):
+    '''Return the lowercased alphabetic words of a unigram file, as the
+    :class:`~lexicon.Lexicon` keeps them.
+    '''
+    words = set()
+    with open(unigrams_fn) as unigrams:
+        for line in unigrams:
+            w = line[:-1].split('\t', 1)[0]
+            if w.isalpha():
+                words.add(w.lower())
+    return sorted(words)
+
+
+def measure(func, queries, repeat):
+    '''Return the best over `repeat` runs of the mean time of `func(query)`
+    for each of `queries`.
+    '''
+    best = None
+    for i in xrange(repeat):
+        start = time()
+        for query in queries:
+            func(query)
+        elapsed = (time() - start) / max(len(queries), 1)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def make_queries(words, samples, seed=0):
+    # `samples` prefixes of each length, of words at least that long
+    rnd = random.Random(seed)
+    queries = {}
+    for length in lengths:
+        candidates = [w for w in words if len(w) >= length]
+        queries[length] = [w[:length] for w in
+                           rnd.sample(candidates, min(samples, len(candidates)))]
+    return queries
+
+
+def build(words):
+    t = trie.Trie()
+    for i, word in enumerate(words):
+        t[word] = i
+    return t
+
+
+def run(args):
+    words = read_words(args.unigrams)
+    results = {'words': len(words)}
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time()
+    words_trie = build(words)
+    insert = time() - start
+    results['peak_memory'] = \
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+    if args.repeat > 1:
+        insert = min(insert, measure(build, [words], args.repeat - 1))
+    results['insert'] = insert / len(words)
+
+    results['iter'] = measure(lambda t: sum(1 for w in t), [words_trie],
+                              args.repeat)
+
+    queries = make_queries(words, args.samples)
+    for length in lengths:
+        q = queries[length]
+        results['getitem/%d' % length] = measure(
+            words_trie.__getitem__, q, args.repeat)
+        results['iter_prefix/%d' % length] = measure(
+            lambda p: sum(1 for w in words_trie.iter_prefix(p)), q,
+            args.repeat)
+        for cost in costs:
+            results['search_correction/%d/%d' % (length, cost)] = measure(
+                lambda w: words_trie.search_correction(w, cost), q,
+                args.repeat)
+            results['search_prediction/%d/%d' % (length, cost)] = measure(
+                lambda w: words_trie.search_prediction(w, cost), q,
+                args.repeat)
+    return results
+
+
+def compare(results, baseline, threshold):
+    '''Return the (name, baseline, result) of the measures that regressed by
+    more than `threshold`.
+    '''
+    regressions = []
+    for name in sorted(baseline):
+        if name == 'words' or name not in results:
+            continue
+        if results[name] > baseline[name] * (1. + threshold):
+            regressions.append((name, baseline[name], results[name]))
+    return regressions
+
+
+def report(results, baseline=None):
+    for name in sorted(results):
+        if name == 'words':
+            continue
+        unit = 'KB' if name == 'peak_memory' else 'us'
+        value = results[name] if unit == 'KB' else results[name] * 1e6
+        line = '%-28s %12.1f %s' % (name, value, unit)
+        if baseline and baseline.get(name):
+            line += '  %+6.1f%%' % ((results[name] / float(baseline[name]) -
+                                     1.) * 100)
+        print(line)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the trie operations on the word corpus.')
+    parser.add_argument('--unigrams', default='1grams')
+    parser.add_argument('--samples', type=int, default=20,
+        help='number of queries per query length')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-o', '--output',
+        help='write the results to this JSON file')
+    parser.add_argument('--save', metavar='BASELINE',
+        help='write the results as the baseline file BASELINE')
+    parser.add_argument('--baseline',
+        help='compare the results with this baseline file')
+    parser.add_argument('--threshold', type=float, default=.25,
+        help='largest accepted slowdown over the baseline, as a fraction')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as fd:
+            baseline = json.load(fd)
+    report(results, baseline)
+    for fn in (args.output, args.save):
+        if fn:
+            with open(fn, 'w') as fd:
+                json.dump(results, fd, indent=1, sort_keys=True)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after in regressions:
+            print('regression: %s %.3g -> %.3g' % (name, before, after))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,152 @@
+#!/usr/bin/python
+'''
+Bigrams
+=======
+
+Corpus bigram model read from a precompiled, memory-mapped `2grams` file.
+
+The file is compiled once from a text file of tab separated `first word`,
+`second word` and `count` lines (or `first second` and `count`)::
+
+    python bigrams.py 2grams.txt 2grams
+
+Words are identified by the CRC32 of their lowercased UTF-8 encoding, so
+all records are fixed-width integers, sorted for binary search. The rare
+hash collisions merge the counts of the colliding words.
+
+File format, little-endian::
+
+    <4s magic> <B version> <I contexts> <I records>
+    <contexts * (<I first word hash> <I total count> <I first record>
+                 <I records>)>
+    <records * (<I second word hash> <I count>)>
+
+A lookup is one binary search in the contexts, cached for consecutive
+lookups with the same previous word, and one in the records of that context.
+Nothing is loaded in memory besides the pages the OS maps in.
+'''
+
+__all__ = ('BigramModel', 'build_bigrams', 'word_hash')
+
+import mmap
+import sys
+from struct import Struct
+from zlib import crc32
+
+MAGIC = b'VKBG'
+VERSION = 1
+
+_header = Struct('<4sBII')
+_context = Struct('<IIII')
+_record = Struct('<II')
+
+
+def word_hash(word):
+    return crc32(word.lower().encode('utf-8')) & 0xffffffff
+
+
+def build_bigrams(text_fn, fn):
+    '''Compile the text bigram counts `text_fn` into the binary file `fn`.'''
+    counts = {}
+    with open(text_fn) as fd:
+        for line in fd:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 2:
+                fields = fields[0].split(' ', 1) + fields[1:]
+            if len(fields) != 3:
+                continue
+            w1, w2, c = fields
+            key = (word_hash(w1.decode('utf-8')), word_hash(w2.decode('utf-8')))
+            counts[key] = counts.get(key, 0) + int(c)
+
+    contexts = []
+    records = []
+    for (h1, h2) in sorted(counts):
+        count = min(counts[(h1, h2)], 0xffffffff)
+        if not contexts or contexts[-1][0] != h1:
+            contexts.append([h1, 0, len(records), 0])
+        context = contexts[-1]
+        context[1] = min(context[1] + count, 0xffffffff)
+        context[3] += 1
+        records.append((h2, count))
+
+    with open(fn, 'wb') as fd:
+        fd.write(_header.pack(MAGIC, VERSION, len(contexts), len(records)))
+        for context in contexts:
+            fd.write(_context.pack(*context))
+        for record in records:
+            fd.write(_record.pack(*record))
+
+
+def _search(data, offset, lo, hi, struct, key):
+    # binary search of the record whose first field is key, in [lo, hi)
+    unpack_from = struct.unpack_from
+    size = struct.size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        k = unpack_from(data, offset + mid * size)[0]
+        if k < key:
+            lo = mid + 1
+        elif k > key:
+            hi = mid
+        else:
+            return unpack_from(data, offset + mid * size)
+    return None
+
+
+class BigramModel(object):
+    '''Memory-mapped view of a file written by :func:`build_bigrams`.'''
+
+    def __init__(self, fn):
+        self.fd = open(fn, 'rb')
+        self.data = data = mmap.mmap(self.fd.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+        magic, version, self.contexts, self.records = \
+            _header.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a version %d bigram file' %
+                             (fn, VERSION))
+        self.contexts_offset = _header.size
+        self.records_offset = self.contexts_offset + \
+            self.contexts * _context.size
+        self._last_context = (None, None)
+
+    def context(self, prev_word):
+        '''Return the (hash, total count, first record, records) of the
+        bigrams starting with `prev_word`, or None.
+        '''
+        last_word, context = self._last_context
+        if last_word == prev_word:
+            return context
+        context = _search(self.data, self.contexts_offset, 0, self.contexts,
+                          _context, word_hash(prev_word))
+        self._last_context = (prev_word, context)
+        return context
+
+    def count(self, word, prev_word):
+        '''Return the corpus count of `prev_word` followed by `word`.'''
+        context = self.context(prev_word)
+        if context is None:
+            return 0
+        h1, total, first, records = context
+        record = _search(self.data, self.records_offset, first,
+                         first + records, _record, word_hash(word))
+        return 0 if record is None else record[1]
+
+    def probability(self, word, prev_word):
+        '''Return the maximum likelihood estimate of P(word | prev_word), 0
+        if `prev_word` was never seen.
+        '''
+        context = self.context(prev_word)
+        if context is None:
+            return 0.
+        h1, total, first, records = context
+        record = _search(self.data, self.records_offset, first,
+                         first + records, _record, word_hash(word))
+        return 0. if record is None else record[1] / float(total)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('usage: %s <bigram counts> <output>' % sys.argv[0])
+    build_bigrams(*sys.argv[1:])
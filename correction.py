@@ -0,0 +1,122 @@
+'''
+Correction
+==========
+
+Typo correction of tapped words, for
+:meth:`~decoder.Decoder.candidate_corrections` and the autocorrection of a
+word when it is committed.
+
+A :class:`ProximityCorrector` walks the lexicon trie with a weighted edit
+distance: substituting a letter with the letter of a neighbouring key costs
+:data:`ProximityCorrector.near_cost`, less than any other edit, since
+hitting the next key is the most common typing error. Swapping two
+adjacent letters, the other common one, costs as much. An insertion, a
+deletion or another substitution costs 1. The search is bounded by a maximum
+cost, which prunes the trie walk, and by an optional deadline, so it can run
+on the UI thread between two keystrokes::
+
+    corrector = ProximityCorrector(key_centers, key_width, key_height)
+    corrections = corrector.corrections(words, u'thw', time() + .004)
+    # [(u'the', .5), (u'thaw', 1.), ...], or None past the deadline
+
+The first letter of a word is assumed to be typed right or on a neighbour
+key, which keeps a sharded lexicon to the shards of those letters. With a
+deadline, the search gives up rather than wait for a shard that isn't
+resident, see :meth:`~shards.ShardedTrie.is_resident`.
+'''
+
+__all__ = ('ProximityCorrector', )
+
+from time import time
+
+
+class ProximityCorrector(object):
+    '''Weighted edit distance search over a :class:`~trie.Trie`.
+
+    :Parameters:
+        `key_centers`: dict
+            Letter to key center, in layout units.
+        `key_width`, `key_height`: float
+            Size of a key, in layout units.
+        `near`: float
+            Distance, in keys, under which two keys are neighbours.
+        `near_cost`: float
+            Cost of substituting a letter with the letter of a neighbour key,
+            and of swapping two adjacent letters. Every other edit costs 1.
+        `max_cost`: float
+            Largest cost of a correction.
+    '''
+
+    def __init__(self, key_centers, key_width, key_height, near=1.5,
+                 near_cost=.5, max_cost=1.):
+        self.near_cost = near_cost
+        self.max_cost = max_cost
+        # substitution costs between neighbour keys, the others cost 1
+        self.costs = costs = {}
+        for a, (ax, ay) in key_centers.items():
+            for b, (bx, by) in key_centers.items():
+                if a != b and ((ax - bx) / key_width) ** 2 + \
+                        ((ay - by) / key_height) ** 2 <= near * near:
+                    costs[(a, b)] = near_cost
+        self.neighbours = {}
+        for a, b in costs:
+            self.neighbours.setdefault(a, []).append(b)
+
+    def corrections(self, words, word, deadline=None):
+        '''Return the (word, cost) of the words of the trie `words` within
+        :data:`max_cost` of `word`, or None if the `deadline` time passed
+        before the search was over.
+        '''
+        if not word:
+            return []
+        word = word.lower()
+        max_cost = self.max_cost
+        costs = self.costs
+        n = len(word)
+        results = {}
+        first = word[0]
+        letters = [first] + self.neighbours.get(first, [])
+        if n > 1 and word[1] not in letters:
+            letters.append(word[1])
+        if deadline is not None:
+            # building a shard takes longer than any budget
+            is_resident = getattr(words, 'is_resident', None)
+            if is_resident is not None and \
+                    not all(is_resident(letter) for letter in letters):
+                return None
+        near_cost = self.near_cost
+        # substitution costs of a trie letter against each letter of word
+        substitutions = {}
+        row = [float(i) for i in xrange(n + 1)]
+        stack = [(node, letter, row, None, None) for letter in letters
+                 for node in words.nodes(letter)]
+        visited = 0
+        while stack:
+            node, letter, previous, parent_letter, grandparent = stack.pop()
+            visited += 1
+            if deadline is not None and not visited & 15 and \
+                    time() >= deadline:
+                return None
+            substitution = substitutions.get(letter)
+            if substitution is None:
+                substitution = substitutions[letter] = [
+                    0. if c == letter else costs.get((c, letter), 1.)
+                    for c in word]
+            current = [previous[0] + 1]
+            for i in xrange(1, n + 1):
+                cost = min(current[i - 1] + 1, previous[i] + 1,
+                           previous[i - 1] + substitution[i - 1])
+                # swapped letters
+                if i > 1 and grandparent is not None and \
+                        word[i - 1] == parent_letter and \
+                        word[i - 2] == letter:
+                    cost = min(cost, grandparent[i - 2] + near_cost)
+                current.append(cost)
+            if node.word is not None and current[n] <= max_cost:
+                if current[n] < results.get(node.word, max_cost + 1):
+                    results[node.word] = current[n]
+            if min(current) <= max_cost:
+                for child_letter, child in node.children.items():
+                    stack.append((child, child_letter, current, letter,
+                                  previous))
+        return list(results.items())
@@ -0,0 +1,641 @@
+'''
+Decoder
+=======
+
+The word decoder behind the :class:`~vkeyboard.VKeyboard`: the lexicon, the
+gesture templates, the user n-gram model and the candidate searches for
+gestures, predictions, corrections and guesses.
+
+The decoder doesn't depend on Kivy, so it can be driven without a display,
+for example by the offline replay tool. Gestures are given in layout units,
+that is relative layout coordinates multiplied by :data:`template_size`.
+
+Before scoring, a gesture is normalized to :data:`~keypaths.sample_count`
+points evenly spaced by arc length. The word templates are resampled to the
+same number of points once, the first time they are scored, so scoring a
+word is a comparison of two fixed size point lists.
+'''
+
+__all__ = ('Decoder', 'sample_n', 'template_size', 'default_time_budget',
+           'default_tuning', 'default_cluster_recall',
+           'default_autocorrect_budget', 'default_autocorrect_confidence',
+           'default_autocorrect_margin', 'read_tuning', 'write_tuning')
+
+from heapq import heapify, heappop, heapreplace
+from math import exp
+from time import time
+try:
+    from ConfigParser import RawConfigParser
+except ImportError:
+    from configparser import RawConfigParser
+
+import trie
+from beam import BeamSearch
+from correction import ProximityCorrector
+from gesturecache import GestureCache
+from keypaths import quantum, sample_count, sample_n
+from lexicon import UserTemplates, get_lexicon, get_sharded_lexicon, \
+    get_bigrams, get_templates, get_shape_index
+from shapeindex import geometry_key
+
+# size of the reference keyboard the gesture templates are expressed in.
+# Gestures are mapped into this space before decoding, so templates never
+# need to be rebuilt when the keyboard is resized or scaled.
+template_size = (700., 200.)
+
+# time budget of an anytime gesture search, one frame at 60 fps, and the
+# number of candidates it scores past the budget when it has fewer
+default_time_budget = .016
+anytime_min_candidates = 3
+
+# time budget of the autocorrection of a committed word, half a frame at
+# 60 fps, the share of the correction scores the best correction needs to
+# replace the word, and how many times the score of the word itself it needs.
+# A word missing from the lexicon scores like a word of corpus probability
+# unknown_word_probability, rarer than most words of the lexicon.
+default_autocorrect_budget = .008
+default_autocorrect_confidence = .8
+default_autocorrect_margin = 100.
+unknown_word_probability = 1e-7
+
+# recall of the 'clusters' gesture search, relative to the template scan,
+# see shapeindex.py
+default_cluster_recall = .95
+
+# pruning and scoring parameters of the gesture searches, see tune.py:
+# - start_window, end_window: how far, in keys, the first and last key of a
+#   word can be from the start and end of the gesture,
+# - min_length_ratio, max_length_ratio: the accepted range of the gesture
+#   length over the key path length of a word,
+# - distance_weight: a word scores exp(-distance_weight * d) times its
+#   n-gram probability, d being the mean distance of the gesture to its
+#   template.
+default_tuning = {'start_window': 1., 'end_window': 1.,
+                  'min_length_ratio': .8, 'max_length_ratio': 1.4,
+                  'distance_weight': .5}
+
+
+def read_tuning(fn, layout_id):
+    '''Return the tuning dict of `layout_id` in the config file `fn`, one
+    section per layout. Empty if the file or the section doesn't exist.
+    '''
+    config = RawConfigParser()
+    config.read(fn)
+    if not config.has_section(layout_id):
+        return {}
+    return dict((name, config.getfloat(layout_id, name))
+                for name in default_tuning
+                if config.has_option(layout_id, name))
+
+
+def write_tuning(fn, layout_id, tuning):
+    '''Store the tuning dict of `layout_id` in the config file `fn`, keeping
+    the sections of the other layouts.
+    '''
+    config = RawConfigParser()
+    config.read(fn)
+    if not config.has_section(layout_id):
+        config.add_section(layout_id)
+    for name in sorted(tuning):
+        config.set(layout_id, name, repr(tuning[name]))
+    with open(fn, 'w') as fd:
+        config.write(fd)
+
+
+class Decoder(object):
+    '''Decode gestures and typed prefixes into ranked word candidates.
+
+    Every candidate search returns a list of (word, probability) tuples,
+    best first. `prev_word` is the word before the cursor, used by the
+    n-gram model.
+    '''
+
+    def __init__(self):
+        self.lexicon = None
+        self.templates = None
+        self.bigrams = None
+        self.words = trie.Trie()
+        self.key_centers = {}
+        self.key_width = self.key_height = 0.
+
+        self.user_nograms = 1
+        self.user_unigrams = {'the':1}
+        self.user_bigrams = {}
+        self.gesture_cache = GestureCache()
+        self.set_tuning({})
+        # anytime decoding: when enabled, candidate_matches stops scoring
+        # after time_budget seconds. The counters track how many searches
+        # ran with a budget and how many of them ran out of time.
+        self.anytime = False
+        self.time_budget = default_time_budget
+        self.anytime_searches = 0
+        self.anytime_incomplete = 0
+        # gesture search used by candidate_matches: 'templates' scans the
+        # templates of the words that fit the gesture, 'beam' walks the trie
+        # along the gesture, see the beam module, 'clusters' scores the
+        # nearest clusters of the shape index, see the shapeindex module
+        self.gesture_search = 'templates'
+        self.beam = BeamSearch()
+        self.shape_index = None
+        self.cluster_recall = default_cluster_recall
+        # corrections of tapped words, see the correction module. The
+        # counters track the autocorrections and how many of them ran out of
+        # time.
+        self.corrector = None
+        self.autocorrections = 0
+        self.autocorrect_timeouts = 0
+
+    def set_layout(self, layout_geometry):
+        '''Compute the key centers used by the gesture templates, and attach
+        to the shared templates of the loaded lexicon for that geometry.
+
+        Centers and key sizes are taken from the relative `KEY_CENTERS` and
+        `LINE_HINT_<row>` geometry of :func:`~layouts.layout_hints` and
+        expressed in layout units, so they don't depend on the current size or
+        scale of the keyboard.
+        '''
+        tw, th = template_size
+        w_hint, h_hint = layout_geometry['LINE_HINT_3'][1][1]
+        self.key_width, self.key_height = w_hint * tw, h_hint * th
+        self.key_centers = dict(
+            (c, (x * tw, y * th))
+            for c, (x, y) in layout_geometry['KEY_CENTERS'].items())
+        self.corrector = ProximityCorrector(self.key_centers, self.key_width,
+                                            self.key_height)
+
+        self.gesture_cache.clear()
+        if self.shape_index is not None and \
+                self.shape_index.geometry != geometry_key(self.key_centers):
+            self.shape_index = None
+        if self.lexicon is not None:
+            self._attach_templates()
+
+    def set_tuning(self, tuning):
+        '''Set the pruning and scoring parameters from the dict `tuning`,
+        the parameters it doesn't hold being reset to
+        :data:`default_tuning`.
+        '''
+        for name, value in default_tuning.items():
+            setattr(self, name, float(tuning.get(name, value)))
+        self.gesture_cache.clear()
+
+    def load_lexicon(self, lexicon):
+        '''Attach to the lexicon files of a layout, a (shards, nograms,
+        unigrams, bigrams) tuple returned by :func:`~layouts.layout_lexicon`,
+        replacing the current lexicon.
+        '''
+        shards, nograms, unigrams, bigrams = lexicon
+        self.unload_words()
+        if shards is not None:
+            self.load_shards(shards)
+        elif unigrams is not None:
+            self.load_words(nograms, unigrams)
+        if bigrams is not None:
+            self.load_bigrams(bigrams)
+
+    def unload_words(self):
+        '''Detach from the lexicon, its templates and the bigram model.
+        They are released once no other decoder uses them, see
+        :mod:`lexicon`.
+        '''
+        self.lexicon = None
+        self.templates = None
+        self.bigrams = None
+        self.words = trie.Trie()
+        self.gesture_cache.clear()
+
+    def load_words(self, nograms_fn, unigrams_fn):
+        '''Attach to the shared lexicon read from a total word count file
+        and a file of tab separated word and count lines, see
+        :func:`~lexicon.get_lexicon`.
+        '''
+        self.lexicon = get_lexicon(nograms_fn, unigrams_fn)
+        self._attach_templates()
+
+    def load_shards(self, fn, max_shards=None):
+        '''Attach to the shared disk-backed lexicon compiled into `fn` by
+        :func:`~shards.build_shards`, keeping at most `max_shards` shards in
+        memory, by default one per key and a few more, see
+        :class:`~shards.ShardedLexicon`.
+        '''
+        self.lexicon = get_sharded_lexicon(fn, max_shards)
+        self._attach_templates()
+
+    def load_shape_index(self, fn):
+        '''Attach to the shared :class:`~shapeindex.ShapeIndex` of the file
+        `fn`, used by the 'clusters' gesture search. Raise a ValueError if it
+        was built for another key geometry.
+        '''
+        index = get_shape_index(fn)
+        if index.geometry != geometry_key(self.key_centers):
+            raise ValueError('%s was built for another key geometry' % fn)
+        self.shape_index = index
+        self.gesture_cache.clear()
+
+    def unload_shape_index(self):
+        self.shape_index = None
+        self.gesture_cache.clear()
+
+    def load_bigrams(self, fn):
+        '''Attach to the shared corpus bigram model compiled into `fn` by
+        :func:`~bigrams.build_bigrams`.
+        '''
+        self.bigrams = get_bigrams(fn)
+
+    def _attach_templates(self):
+        # the words of the user n-gram model missing from the shared lexicon
+        # are learned again for the new templates
+        self.templates = UserTemplates(
+            get_templates(self.lexicon, self.key_centers),
+            set(w.lower() for w in self.user_unigrams))
+        self.words = self.templates.words
+
+    def learn(self, cur_word, prev_word):
+        '''Update the user n-gram model after `cur_word` was committed, and
+        add it to the :data:`templates` if it wasn't known yet. The lexicon is
+        shared with the other decoders, the learned words are not, see
+        :class:`~lexicon.UserTemplates`.
+
+        The word counts are part of the score of every candidate, so the
+        :data:`gesture_cache` is cleared.
+        '''
+        self.user_nograms += 1
+        if self.templates is not None:
+            self.templates.add_word(cur_word.lower())
+        self.user_unigrams[cur_word] = self.user_unigrams.get(cur_word, 0) + 1
+        if prev_word != '':
+            self.user_bigrams[(prev_word, cur_word)] = self.user_bigrams.get((prev_word, cur_word), 0) + 1
+        self.gesture_cache.clear()
+
+    def forget(self, cur_word, prev_word):
+        '''Undo a :meth:`learn` of `cur_word` after `prev_word`, when the
+        committed word is taken back. A word added to the :data:`templates`
+        stays there.
+        '''
+        self.user_nograms = max(self.user_nograms - 1, 1)
+        count = self.user_unigrams.get(cur_word, 0) - 1
+        if count > 0:
+            self.user_unigrams[cur_word] = count
+        else:
+            self.user_unigrams.pop(cur_word, None)
+        if prev_word != '':
+            bigram = (prev_word, cur_word)
+            count = self.user_bigrams.get(bigram, 0) - 1
+            if count > 0:
+                self.user_bigrams[bigram] = count
+            else:
+                self.user_bigrams.pop(bigram, None)
+        self.gesture_cache.clear()
+
+    def copy_user_model(self, decoder):
+        '''Take over the user n-gram model of `decoder`, when it is replaced
+        by this one.
+        '''
+        self.user_nograms = decoder.user_nograms
+        self.user_unigrams = dict(decoder.user_unigrams)
+        self.user_bigrams = dict(decoder.user_bigrams)
+        if self.templates is not None:
+            for word in self.user_unigrams:
+                self.templates.add_word(word.lower())
+        self.gesture_cache.clear()
+
+    def val_dist(self, path):
+        tot = 0.0
+        for i in xrange(1, len(path)):
+            tot += ((path[i][0]-path[i-1][0])**2 + (path[i][1]-path[i-1][1])**2)**0.5
+        return (path, tot)
+
+    def get_ngram_probability(self, word, prev_word):
+        nogram = self.user_nograms
+        bigram = self.user_bigrams.get((prev_word, word), 0)
+        unigram1 = self.user_unigrams.get(prev_word, 0)
+        unigram2 = self.user_unigrams.get(word, 0)
+        p = 0.4 * (bigram + 1) / (unigram1 + len(self.user_unigrams)) + 0.1 * (unigram2 + 1) / (nogram + len(self.user_unigrams))
+        p = p + 0.5 * self.corpus_probability(word, prev_word)
+        return p
+
+    def corpus_probability(self, word, prev_word):
+        '''Return the probability of `word` in the corpus, after `prev_word`
+        if there is a bigram model, 0 if it isn't in the lexicon.
+        '''
+        frequency = self.templates.frequency(word)
+        if self.bigrams is not None and prev_word:
+            frequency = 0.5 * frequency + 0.5 * self.bigrams.probability(word, prev_word)
+        return frequency
+
+    def prune_matches(self, gesture, gest_length, cancelled=None, words=None):
+        '''Return the words whose template starts and ends near the start
+        and end of the gesture and has a compatible path length, see
+        :data:`default_tuning`. The words are looked up in the trie `words`,
+        by default :data:`words`.
+        '''
+        if self.templates is None:
+            return []
+        template = self.templates.template
+        gx, gy = gesture[-1]
+        # the templates are quantized, widen the window by the quantization
+        # error so that no word on its edge is pruned
+        max_dx = self.key_width * self.end_window + quantum
+        max_dy = self.key_height * self.end_window + quantum
+        min_ratio, max_ratio = self.min_length_ratio, self.max_length_ratio
+        if words is None:
+            words = self.words
+        matches = []
+        i = 0
+        for letter in self.start_letters(gesture[0]):
+            for word in words.iter_prefix(letter):
+                i += 1
+                if cancelled is not None and not i & 1023 and cancelled.is_set():
+                    return []
+                entry = template(word)
+                if entry is None:
+                    continue
+                paths, index = entry
+                x, y = paths.end(index)
+                if abs(x - gx) > max_dx or abs(y - gy) > max_dy:
+                    continue
+                length = paths.lengths[index]
+                if not min_ratio*length <= gest_length <= max_ratio*length:
+                    continue
+                matches.append(word)
+        return matches
+
+    def frequent_matches(self, gesture, gest_length, deadline, orders=None,
+                         minimum=0):
+        '''Yield the words of :meth:`prune_matches`, most frequent first,
+        until the `deadline` time, but at least `minimum` words if there are
+        as many. `orders` are the :meth:`~lexicon.TemplateStore.by_frequency`
+        orders of the start letters of the gesture, looked up if not given.
+        '''
+        if self.templates is None:
+            return
+        if orders is None:
+            orders = [self.templates.by_frequency(letter)
+                      for letter in self.start_letters(gesture[0])]
+        template = self.templates.template
+        gx, gy = gesture[-1]
+        max_dx = self.key_width * self.end_window + quantum
+        max_dy = self.key_height * self.end_window + quantum
+        min_ratio, max_ratio = self.min_length_ratio, self.max_length_ratio
+        # merge the words of each start letter, sorted by frequency
+        heap = []
+        for k, (words, frequencies) in enumerate(orders):
+            if words:
+                heap.append((-frequencies[0], 0, k, words, frequencies))
+        heapify(heap)
+        i = found = 0
+        while heap:
+            f, pos, k, words, frequencies = heap[0]
+            word = words[pos]
+            pos += 1
+            if pos < len(words):
+                heapreplace(heap, (-frequencies[pos], pos, k, words, frequencies))
+            else:
+                heappop(heap)
+            i += 1
+            if not i & 255 and found >= minimum and time() >= deadline:
+                return
+            paths, index = template(word)
+            x, y = paths.end(index)
+            if abs(x - gx) > max_dx or abs(y - gy) > max_dy:
+                continue
+            length = paths.lengths[index]
+            if not min_ratio*length <= gest_length <= max_ratio*length:
+                continue
+            found += 1
+            yield word
+
+    def start_letters(self, point):
+        '''Return the letters whose key center is within
+        :data:`start_window` keys of `point`, the only possible first letters
+        of a gesture starting there.
+        '''
+        x, y = point
+        max_dx = self.key_width * self.start_window
+        max_dy = self.key_height * self.start_window
+        return [c for c, (kx, ky) in self.key_centers.items()
+                if abs(kx - x) <= max_dx and abs(ky - y) <= max_dy]
+
+    def rank_candidates(self, candidates):
+        '''Sort (word, probability) candidates in place, best first.'''
+        candidates.sort(key=lambda x: x[1], reverse=True)
+        return candidates
+
+    # All the candidate searches accept a `cancelled` event, set from another
+    # thread when the result is no longer needed. The longer searches poll it
+    # and return early, with an empty or partial result.
+
+    def candidate_matches(self, gesture, prev_word, cancelled=None):
+        if self.gesture_search == 'beam':
+            return self.beam_matches(gesture, prev_word, cancelled)
+        if self.gesture_search == 'clusters' and self.shape_index is not None:
+            return self.cluster_matches(gesture, prev_word, cancelled)
+        time_budget = self.time_budget if self.anytime else None
+        return self.anytime_matches(gesture, prev_word, time_budget,
+                                    cancelled)[0]
+
+    def anytime_matches(self, gesture, prev_word, time_budget=None,
+                        cancelled=None):
+        '''Return the ranked candidates of `gesture` and whether every
+        candidate was scored.
+
+        With a `time_budget`, in seconds, the lexicon is scanned in
+        descending corpus frequency, the prior of the words without context,
+        and the search stops once the budget is spent, returning the best
+        candidates found so far, at least :data:`anytime_min_candidates` if
+        the gesture has as many. The budget starts once the frequency orders
+        of the start letters are ready. Incomplete results are not cached.
+        '''
+        cache = self.gesture_cache
+        key = (prev_word, self.gesture_signature(gesture), 'templates')
+        cached = cache.get(key)
+        if cached is not None:
+            return list(cached), True
+        candidates = []
+        gest_length = self.val_dist(gesture)[1]
+        points = self.normalize(gesture)
+        if time_budget is None:
+            deadline = None
+            words = self.prune_matches(gesture, gest_length, cancelled)
+        else:
+            orders = [self.templates.by_frequency(letter)
+                      for letter in self.start_letters(gesture[0])] \
+                if self.templates is not None else []
+            deadline = time() + time_budget
+            words = self.frequent_matches(gesture, gest_length, deadline,
+                                          orders, anytime_min_candidates)
+        for word in words:
+            if cancelled is not None and cancelled.is_set():
+                return self.rank_candidates(candidates), False
+            if deadline is not None and \
+                    len(candidates) >= anytime_min_candidates and \
+                    time() >= deadline:
+                break
+            p = exp(-self.distance_weight * self.gesture_distance(points, word)) * self.get_ngram_probability(word, prev_word)
+            candidates.append((word, p))
+        # a search that stopped at the deadline is incomplete, even if it
+        # happened to be over
+        complete = deadline is None or time() < deadline
+        candidates = self.rank_candidates(candidates)
+        if deadline is not None:
+            self.anytime_searches += 1
+            if not complete:
+                self.anytime_incomplete += 1
+        if complete and (cancelled is None or not cancelled.is_set()):
+            cache.put(key, tuple(candidates))
+        return candidates, complete
+
+    def beam_matches(self, gesture, prev_word, cancelled=None):
+        '''Return the ranked candidates of `gesture` found by the trie
+        guided :class:`~beam.BeamSearch` :data:`beam`.
+        '''
+        cache = self.gesture_cache
+        key = (prev_word, self.gesture_signature(gesture), 'beam')
+        cached = cache.get(key)
+        if cached is not None:
+            return list(cached)
+        candidates = self.beam.matches(self, gesture, prev_word, cancelled)
+        if cancelled is None or not cancelled.is_set():
+            cache.put(key, tuple(candidates))
+        return candidates
+
+    def cluster_matches(self, gesture, prev_word, cancelled=None,
+                        probe=None):
+        '''Return the ranked candidates of `gesture` among the words of the
+        `probe` nearest clusters of the :data:`shape_index`. By default,
+        `probe` is the smallest one whose measured recall reaches
+        :data:`cluster_recall`. The learned words aren't in the shared index,
+        they are all scored if they fit the gesture.
+        '''
+        if probe is None:
+            probe = self.shape_index.probe_for(self.cluster_recall)
+        cache = self.gesture_cache
+        key = (prev_word, self.gesture_signature(gesture),
+               'clusters/%s' % probe)
+        cached = cache.get(key)
+        if cached is not None:
+            return list(cached)
+        if self.templates is None:
+            return []
+        points = self.normalize(gesture)
+        gest_length = self.val_dist(gesture)[1]
+        words = self.shape_index.matches(self, points, gest_length, probe)
+        words.extend(self.prune_matches(gesture, gest_length, cancelled,
+                                        self.templates.learned))
+        candidates = []
+        for i, word in enumerate(words):
+            if cancelled is not None and not i & 255 and cancelled.is_set():
+                return self.rank_candidates(candidates)
+            p = exp(-self.distance_weight * self.gesture_distance(points, word)) * self.get_ngram_probability(word, prev_word)
+            candidates.append((word, p))
+        candidates = self.rank_candidates(candidates)
+        if cancelled is None or not cancelled.is_set():
+            cache.put(key, tuple(candidates))
+        return candidates
+
+    def gesture_signature(self, gesture, n=16):
+        '''Return the signature of `gesture` in the :data:`gesture_cache`
+        keys: the gesture resampled to `n` points, snapped to a grid of half a key.
+        '''
+        gw = self.key_width * 0.5
+        gh = self.key_height * 0.5
+        return tuple((int(x // gw), int(y // gh)) for x, y in sample_n(gesture, n))
+
+    def candidate_predictions(self, word, prev_word, cancelled=None):
+        candidates = [(w, 0.001**d * self.get_ngram_probability(w, prev_word)) for (w, d) in self.search_prediction(word, 2)]
+        return self.rank_candidates(candidates)
+
+    # The lexicon searches go through these methods rather than being called
+    # on the shared :data:`words` directly, so that a profiler instruments
+    # them on this decoder only.
+
+    def search_prediction(self, word, max_cost):
+        '''Return the (word, cost) of the words starting within `max_cost`
+        edits of `word`.
+        '''
+        return self.words.search_prediction(word, max_cost)
+
+    def search_correction(self, word, deadline=None):
+        '''Return the (word, cost) of the :meth:`candidate_corrections` of
+        `word`, or None if the `deadline` time passed first.
+        '''
+        return self.corrector.corrections(self.words, word, deadline)
+
+    def candidate_corrections(self, word, prev_word, cancelled=None,
+                              time_budget=None):
+        '''Return the ranked corrections of the tapped `word`, the words
+        within a small key proximity aware edit distance of it, see
+        :class:`~correction.ProximityCorrector`. With a `time_budget`, in
+        seconds, return None if the search didn't finish in time.
+        '''
+        if self.corrector is None or self.templates is None:
+            return []
+        deadline = None if time_budget is None else time() + time_budget
+        corrections = self.search_correction(word, deadline)
+        if corrections is None:
+            return None
+        candidates = [(w, 0.001**d * self.get_ngram_probability(w, prev_word)) for (w, d) in corrections]
+        return self.rank_candidates(candidates)
+
+    def autocorrect(self, word, prev_word,
+                    time_budget=default_autocorrect_budget,
+                    confidence=default_autocorrect_confidence,
+                    margin=default_autocorrect_margin):
+        '''Return the correction replacing the tapped `word` when it is
+        committed, or None to keep it.
+
+        A word the user committed before is kept. Otherwise each correction
+        of :meth:`search_correction` scores its :meth:`corpus_probability`
+        times 0.001 ** cost, and the best one replaces the word when it
+        scores `margin` times the :meth:`corpus_probability` of the word
+        itself, at least :data:`unknown_word_probability`, and its share of
+        the scores of all the corrections and the word reaches `confidence`.
+        The search must finish within `time_budget` seconds.
+        '''
+        if self.corrector is None or self.templates is None or \
+                word in self.user_unigrams or \
+                word.lower() in self.user_unigrams:
+            return None
+        self.autocorrections += 1
+        corrections = self.search_correction(word, time() + time_budget)
+        if corrections is None:
+            self.autocorrect_timeouts += 1
+            return None
+        word = word.lower()
+        own = max(self.corpus_probability(word, prev_word),
+                  unknown_word_probability)
+        scored = [(w, 0.001**d * self.corpus_probability(w, prev_word))
+                  for w, d in corrections if w != word]
+        if not scored:
+            return None
+        best, score = max(scored, key=lambda x: x[1])
+        total = own + sum(p for w, p in scored)
+        if score < margin * own or score < confidence * total:
+            return None
+        return best
+
+    def candidate_guesses(self, prev_word, cancelled=None):
+        candidates = []
+        words = self.templates.guess_words() if self.templates else self.words
+        for i, w in enumerate(words):
+            if cancelled is not None and not i & 1023 and cancelled.is_set():
+                break
+            candidates.append((w, self.get_ngram_probability(w, prev_word)))
+        return self.rank_candidates(candidates)
+
+    def word_sample_n(self, word, n):
+        paths, index = self.templates.template(word)
+        return sample_n(paths.path(index), n)
+
+    def normalize(self, gesture):
+        '''Resample `gesture` to the number of points of the templates.'''
+        return sample_n(gesture, sample_count)
+
+    def gesture_distance(self, gesture, word):
+        '''Return the mean distance between the points of the normalized
+        `gesture` and of the template of `word`.
+        '''
+        paths, index = self.templates.template(word)
+        template = paths.samples(index)
+        n = len(template)
+        return sum(((x1-x2)**2 + (y1-y2)**2)**0.5 for ((x1, y1), (x2, y2)) in zip(gesture, template)) / n
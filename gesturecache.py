@@ -0,0 +1,68 @@
+'''
+Gesture cache
+=============
+
+Users swipe the same frequent words over and over. The :class:`GestureCache`
+keeps the ranked candidates of recent gestures, keyed by a coarse signature
+of the gesture and the previous word, so that a near-identical gesture is
+answered without searching the lexicon again.
+
+The signature is computed by :meth:`~decoder.Decoder.gesture_signature`: the
+gesture is resampled to a few points by arc length and each point is snapped
+to a grid of half a key.
+
+The rankings depend on the user n-gram model, so the decoder clears its
+cache whenever it learns a word, see :meth:`~decoder.Decoder.learn`.
+'''
+
+__all__ = ('GestureCache', )
+
+from collections import OrderedDict
+from threading import Lock
+
+
+class GestureCache(object):
+    '''Least recently used cache of at most `capacity` gesture results.
+
+    Keys are (previous word, signature, search) tuples. :data:`hits` and
+    :data:`misses` count the lookups since the creation of the cache.
+    '''
+
+    def __init__(self, capacity=128):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            entries = self.entries
+            entries.pop(key, None)
+            entries[key] = value
+            while len(entries) > self.capacity:
+                entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / float(lookups) if lookups else 0.
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hit_rate, 'size': len(self.entries),
+                'capacity': self.capacity}
@@ -0,0 +1,115 @@
+'''
+Gesture log
+===========
+
+Compact binary log of the gestures decoded by the
+:class:`~vkeyboard.VKeyboard`, used to reproduce field cases offline with
+the :mod:`replay` tool.
+
+A log starts with the `VKGL` magic and a format version byte, followed by
+one record per gesture::
+
+    <d time> <f width> <f height> <H points> <B layout> <B prev> <B chosen>
+    <layout id> <previous word> <chosen candidate>
+    <points * 2 int16>
+
+All values are little-endian. Strings are UTF-8 encoded and prefixed by
+their length in the header. Points are in widget coordinates, quantized to a
+quarter of a pixel.
+'''
+
+__all__ = ('GestureRecorder', 'GestureRecord', 'read_gestures')
+
+from collections import namedtuple
+from os.path import getsize, exists
+from struct import Struct, pack, unpack
+from time import time
+
+MAGIC = b'VKGL'
+VERSION = 1
+
+_header = Struct('<4sB')
+_record = Struct('<dffHBBB')
+_quantum = 4.
+
+GestureRecord = namedtuple('GestureRecord',
+    ('time', 'layout', 'size', 'prev_word', 'chosen', 'points'))
+
+
+def _encode(text):
+    return text.encode('utf-8')[:255]
+
+
+def _quantize(v):
+    return max(-32768, min(32767, int(round(v * _quantum))))
+
+
+class GestureRecorder(object):
+    '''Append gestures to the log file `fn`.
+
+    A gesture is kept pending until the next one is added, or the recorder
+    is flushed, so that a suggestion picked after the gesture can still be
+    recorded as the chosen candidate with :meth:`choose`.
+    '''
+
+    def __init__(self, fn):
+        is_new = not exists(fn) or getsize(fn) == 0
+        self.fd = open(fn, 'ab')
+        if is_new:
+            self.fd.write(_header.pack(MAGIC, VERSION))
+        self.pending = None
+
+    def add(self, points, layout, size, prev_word, chosen):
+        '''Record a gesture. `points` is the list of (x, y) widget
+        coordinates and `size` the (width, height) of the keyboard.
+        '''
+        self.flush()
+        self.pending = [time(), layout, size, prev_word, chosen, points]
+
+    def choose(self, word):
+        '''Replace the chosen candidate of the pending gesture.'''
+        if self.pending is not None:
+            self.pending[4] = word
+
+    def flush(self):
+        if self.pending is None:
+            return
+        t, layout, size, prev_word, chosen, points = self.pending
+        self.pending = None
+        layout, prev_word, chosen = map(_encode, (layout, prev_word, chosen))
+        points = points[:65535]
+        coords = []
+        for x, y in points:
+            coords.append(_quantize(x))
+            coords.append(_quantize(y))
+        fd = self.fd
+        fd.write(_record.pack(t, size[0], size[1], len(points),
+                              len(layout), len(prev_word), len(chosen)))
+        fd.write(layout + prev_word + chosen)
+        fd.write(pack('<%dh' % len(coords), *coords))
+        fd.flush()
+
+    def close(self):
+        self.flush()
+        self.fd.close()
+
+
+def read_gestures(fn):
+    '''Iterate over the :class:`GestureRecord` entries of the log `fn`.'''
+    with open(fn, 'rb') as fd:
+        magic, version = _header.unpack(fd.read(_header.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a version %d gesture log' %
+                             (fn, VERSION))
+        while True:
+            data = fd.read(_record.size)
+            if len(data) < _record.size:
+                return
+            t, width, height, n, nl, np, nc = _record.unpack(data)
+            strings = fd.read(nl + np + nc)
+            coords = unpack('<%dh' % (n * 2), fd.read(n * 4))
+            points = [(coords[i] / _quantum, coords[i + 1] / _quantum)
+                      for i in xrange(0, len(coords), 2)]
+            yield GestureRecord(t, strings[:nl].decode('utf-8'), (width, height),
+                                strings[nl:nl + np].decode('utf-8'),
+                                strings[nl + np:].decode('utf-8'), points)
@@ -0,0 +1,175 @@
+'''
+Key paths
+=========
+
+Compact storage for the gesture templates of a lexicon.
+
+A template is the path through the key centers of a word, its length, the
+word frequency, and the path resampled to :data:`sample_count` points evenly
+spaced by arc length, which is what gestures are compared to. The resampled
+path is computed the first time it is needed, so that building the templates
+of a large lexicon only stores the key paths. Instead of a
+tuple of point tuples per word, a :class:`KeyPaths` stores all the templates
+column-wise in flat :mod:`array` columns, the points quantized to int16 fixed
+point. Words refer to their template by its index::
+
+    paths = KeyPaths()
+    i = paths.append([(10., 20.), (30., 20.)], 20., 0.001)
+    paths.path(i), paths.samples(i), paths.lengths[i], paths.frequencies[i]
+
+Appending a template is amortized constant time, so the words a decoder
+learns are added to columns of their own as they come.
+'''
+
+__all__ = ('KeyPaths', 'quantum', 'sample_count', 'sample_n', 'path_length')
+
+from array import array
+from math import hypot
+
+# fixed point scale of the stored coordinates: points are in layout units
+# (from 0 to 700 x 200, see decoder.template_size) and rounded to 1/8 unit.
+scale = 8.
+# bound on the rounding error of a difference of two stored coordinates
+quantum = 1. / scale
+
+# number of points of the resampled templates, and of the normalized
+# gestures compared to them
+sample_count = 32
+
+# number of templates whose resampled paths are allocated together, the first
+# time one of them is resampled
+chunk_size = 8
+
+
+def sample_n(path, n):
+    '''Resample the polyline `path` to `n` points evenly spaced by arc
+    length.
+    '''
+    cum_length = [0.0]
+    for i in xrange(1, len(path)):
+        cum_length.append(cum_length[-1] + ((path[i][0]-path[i-1][0])**2 + (path[i][1]-path[i-1][1])**2)**0.5)
+    total = cum_length[-1]
+    last = len(path) - 1
+    points = []
+    append = points.append
+    # the sample positions increase, so the segment of each one is found by
+    # walking forward from the segment of the previous one
+    i = 0
+    j = -1
+    d = float(n - 1)
+    for k in xrange(n):
+        L = min(k * total / d, total)
+        while i < last and cum_length[i+1] < L:
+            i += 1
+        if i != j or i >= last:
+            j = i - 1 if i >= last else i
+            x0, y0 = path[j]
+            x1, y1 = path[j+1]
+            c0 = cum_length[j]
+            c = cum_length[j+1] - c0
+        if c == 0:
+            append((x0, y0))
+        else:
+            p = (L - c0) / c
+            append((x0 + p * (x1 - x0), y0 + p * (y1 - y0)))
+    return points
+
+
+def path_length(path):
+    '''Return the length of the polyline `path`.'''
+    return sum(hypot(x1 - x0, y1 - y0)
+               for (x0, y0), (x1, y1) in zip(path, path[1:]))
+
+
+class KeyPaths(object):
+    '''Append-only columns of key paths.
+
+    :data:`coords` holds the quantized x, y coordinates of all the points,
+    the path of template `i` being the :data:`counts` [i] points starting at
+    point :data:`offsets` [i]. :data:`lengths` and :data:`frequencies` hold
+    the path length and the word frequency of each template.
+    :data:`resampled` holds the quantized coordinates of the paths
+    resampled to `n` points, `2 * n` values per template, in chunks of
+    :data:`chunk_size` templates mapped by their number. A chunk is
+    allocated the first time one of its templates is compared, and a
+    template is resampled by :meth:`samples` then, when its flag in
+    :data:`sampled` is set.
+    '''
+
+    def __init__(self, n=sample_count):
+        self.n = n
+        self.resampled = {}
+        self.sampled = bytearray()
+        # quantized coordinates of the points seen so far, the key paths of a
+        # lexicon go through a few key centers only
+        self._quantized = {}
+        self.coords = array('h')
+        self.offsets = array('I')
+        self.counts = array('H')
+        self.lengths = array('f')
+        self.frequencies = array('f')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, path, length, frequency):
+        '''Add the template of the key `path`, and return its index.'''
+        index = len(self.offsets)
+        self.offsets.append(len(self.coords) // 2)
+        self.counts.append(len(path))
+        quantized = self._quantized
+        try:
+            self.coords.extend([c for point in path for c in quantized[point]])
+        except KeyError:
+            for x, y in path:
+                quantized[(x, y)] = (int(x * scale + .5), int(y * scale + .5))
+            self.coords.extend([c for point in path for c in quantized[point]])
+        self.lengths.append(length)
+        self.frequencies.append(frequency)
+        self.sampled.append(0)
+        return index
+
+    def path(self, index):
+        '''Return the key path of template `index` as a list of (x, y).'''
+        start = self.offsets[index] * 2
+        coords = self.coords[start:start + self.counts[index] * 2]
+        return [(coords[i] / scale, coords[i + 1] / scale)
+                for i in xrange(0, len(coords), 2)]
+
+    def samples(self, index):
+        '''Return the key path of template `index` resampled to `n` points,
+        as a list of (x, y).
+        '''
+        size = self.n * 2
+        chunk, start = divmod(index, chunk_size)
+        start *= size
+        coords = self.resampled.get(chunk)
+        if coords is None:
+            # setdefault is atomic, a chunk allocated meanwhile by another
+            # thread is kept
+            coords = self.resampled.setdefault(
+                chunk, array('h', [0]) * (size * chunk_size))
+        if not self.sampled[index]:
+            # several threads may resample the same template, they store the
+            # same values
+            coords[start:start + size] = array('h', [
+                int(c * scale + .5) for point
+                in sample_n(self.path(index), self.n) for c in point])
+            self.sampled[index] = 1
+        coords = coords[start:start + size]
+        return [(coords[i] / scale, coords[i + 1] / scale)
+                for i in xrange(0, len(coords), 2)]
+
+    def end(self, index):
+        '''Return the last point of the key path of template `index`.'''
+        last = (self.offsets[index] + self.counts[index] - 1) * 2
+        coords = self.coords
+        return (coords[last] / scale, coords[last + 1] / scale)
+
+    @property
+    def nbytes(self):
+        '''Size of the columns in bytes.'''
+        return sum(column.itemsize * len(column) for column in (
+            self.coords, self.offsets, self.counts, self.lengths,
+            self.frequencies) + tuple(self.resampled.values())) + \
+            len(self.sampled)
@@ -0,0 +1,252 @@
+'''
+Layouts
+=======
+
+Helpers to read keyboard layouts and compute their geometry without a
+window, shared by the :class:`~vkeyboard.VKeyboard` and the offline tools.
+See the :mod:`vkeyboard` module for a description of the layout JSON format.
+
+Parsing a layout and computing its geometry is done once: a
+:class:`LayoutCache` keeps the parsed layout, its relative geometry for every
+mode and its pixel geometry for every keyboard size it was used at, in a file
+named after a hash of the JSON content. Later runs load that file instead of
+parsing the JSON and recomputing the geometry. The files are kept in the user
+cache directory by default, see :func:`user_cache_path`.
+'''
+
+__all__ = ('read_layout', 'layout_hints', 'layout_lines', 'layout_lexicon',
+           'LayoutCache', 'user_cache_path')
+
+import marshal
+from hashlib import sha1
+from json import loads
+from os import environ, makedirs
+from os.path import join, exists, dirname, expanduser, isabs
+
+layout_modes = ('normal', 'shift', 'capslock')
+
+# lexicon files of the layouts that don't name theirs. The compiled sharded
+# lexicon is used instead of the 0grams and 1grams files when present, see
+# shards.py, and the bigrams only when present.
+default_lexicon = {'shards': 'lexicon.shards', 'nograms': '0grams',
+                   'unigrams': '1grams', 'bigrams': '2grams'}
+
+
+def user_cache_path(name):
+    '''Return the directory `name` of the keyboard in the user cache
+    directory, `$XDG_CACHE_HOME` or `~/.cache`, so that the caches don't
+    depend on the directory the keyboard is started from.
+    '''
+    base = environ.get('XDG_CACHE_HOME') or join(expanduser('~'), '.cache')
+    return join(base, 'vkeyboard', name)
+
+
+def read_layout(fn):
+    '''Parse the layout JSON file `fn` and return it as a Python object.'''
+    with open(fn, 'r') as fd:
+        return loads(fd.read())
+
+
+def layout_hints(layout, layout_mode, margin_hint):
+    '''Compute the relative geometry of `layout` in `layout_mode`.
+
+    Returns a dict holding, as fractions of the keyboard size:
+
+    * `U_HINT`: the size of a layout unit,
+    * `LINE_HINT_<row>`: a list of [(x_hint, y_hint), (w_hint, h_hint)]
+      entries for the keys of each row,
+    * `LINE_EDGES_<row>`: the right edge of each key of the row, to find
+      the key at a position with a binary search,
+    * `KEY_CENTERS`: the center of every single letter key.
+    '''
+    layout_cols = layout['cols']
+    layout_rows = layout['rows']
+    layout_geometry = {}
+    key_centers = layout_geometry['KEY_CENTERS'] = {}
+    mtop, mright, mbottom, mleft = margin_hint
+
+    # get relative EFFICIENT surface of the layout without external margins
+    el_hint = 1. - mleft - mright
+    eh_hint = 1. - mtop - mbottom
+    ex_hint = 0 + mleft
+    ey_hint = 0 + mbottom
+
+    # get relative unit surface
+    uw_hint = (1. / layout_cols) * el_hint
+    uh_hint = (1. / layout_rows) * eh_hint
+    layout_geometry['U_HINT'] = (uw_hint, uh_hint)
+
+    # calculate individual key RELATIVE surface and pos (without key margin)
+    current_y_hint = ey_hint + eh_hint
+    for line_nb in range(1, layout_rows + 1):
+        current_y_hint -= uh_hint
+        # get line_name
+        line_name = '%s_%d' % (layout_mode, line_nb)
+        line_hint = 'LINE_HINT_%d' % line_nb
+        line_edges = 'LINE_EDGES_%d' % line_nb
+        layout_geometry[line_hint] = []
+        layout_geometry[line_edges] = []
+        current_x_hint = ex_hint
+        # go through the list of keys (tuples of 4)
+        for key in layout[line_name]:
+            # calculate relative pos, size
+            layout_geometry[line_hint].append([
+                (current_x_hint, current_y_hint),
+                (key[3] * uw_hint, uh_hint)])
+            if len(key[0]) == 1 and key[0].isalpha():
+                key_centers[key[0]] = (current_x_hint + key[3] * uw_hint * 0.5,
+                                       current_y_hint + uh_hint * 0.5)
+            current_x_hint += key[3] * uw_hint
+            layout_geometry[line_edges].append(current_x_hint)
+
+    return layout_geometry
+
+
+def layout_lines(layout_geometry, layout_rows, size, key_margin):
+    '''Compute the pixel geometry of the keys from the relative geometry
+    returned by :func:`layout_hints`, for a keyboard of `size`.
+
+    Returns a dict holding a `LINE_<row>` list of ((x, y), (w, h)) entries
+    for each row.
+    '''
+    w, h = size
+    kmtop, kmright, kmbottom, kmleft = key_margin
+    lines = {}
+
+    for line_nb in range(1, layout_rows + 1):
+        llg = lines['LINE_%d' % line_nb] = []
+        llg_append = llg.append
+        for key in layout_geometry['LINE_HINT_%d' % line_nb]:
+            x_hint, y_hint = key[0]
+            w_hint, h_hint = key[1]
+            kx = x_hint * w
+            ky = y_hint * h
+            kw = w_hint * w
+            kh = h_hint * h
+
+            # now adjust, considering the key margin
+            kx = int(kx + kmleft)
+            ky = int(ky + kmbottom)
+            kw = int(kw - kmleft - kmright)
+            kh = int(kh - kmbottom - kmtop)
+
+            pos = (kx, ky)
+            size = (kw, kh)
+            llg_append((pos, size))
+
+    return lines
+
+
+def layout_lexicon(layout, layout_fn=None):
+    '''Return the lexicon files of `layout` as a (shards, nograms, unigrams,
+    bigrams) tuple, None for the files not used.
+
+    A layout names its lexicon with a `lexicon` entry holding either a
+    `shards` file or `nograms` and `unigrams` files, and optionally a
+    `bigrams` file::
+
+        "lexicon": {"nograms": "fr.0grams", "unigrams": "fr.1grams"}
+
+    Relative paths are looked up next to the layout file `layout_fn` first,
+    then in the current directory. Layouts without a `lexicon` entry use the
+    :data:`default_lexicon` files.
+    '''
+    def find(fn):
+        if fn is None:
+            return None
+        if layout_fn is not None and not isabs(fn):
+            local_fn = join(dirname(layout_fn), fn)
+            if exists(local_fn):
+                return local_fn
+        return fn
+
+    spec = layout.get('lexicon')
+    if spec is None:
+        shards, bigrams = find(default_lexicon['shards']), \
+            find(default_lexicon['bigrams'])
+        if exists(shards):
+            return (shards, None, None, bigrams if exists(bigrams) else None)
+        return (None, find(default_lexicon['nograms']),
+                find(default_lexicon['unigrams']),
+                bigrams if exists(bigrams) else None)
+    return (find(spec.get('shards')), find(spec.get('nograms')),
+            find(spec.get('unigrams')), find(spec.get('bigrams')))
+
+
+class LayoutCache(object):
+    '''Compiled layouts, in memory and in the directory `path`, by default
+    the `layouts` directory of the :func:`user_cache_path`.
+
+    An entry is a dict holding the layout JSON (`layout`, marshalled so that
+    every :meth:`layout` call returns a fresh copy), the
+    :func:`layout_hints` of each mode (`hints`) and the
+    :func:`layout_lines` computed so far (`lines`), keyed by mode, size and
+    key margin. Entries are stored in `path` under a hash of the JSON
+    content and the margin hint, so editing a layout invalidates its entry.
+
+    The cache is an optimization only: if `path` can't be written, entries
+    are simply recomputed on the next run.
+    '''
+
+    def __init__(self, path=None):
+        self.path = path or user_cache_path('layouts')
+        self.entries = {}
+
+    def get(self, fn, margin_hint):
+        '''Return the entry of the layout JSON file `fn`.'''
+        with open(fn, 'rb') as fd:
+            content = fd.read()
+        digest = sha1(content)
+        digest.update(repr(tuple(margin_hint)).encode('ascii'))
+        digest.update(str(marshal.version).encode('ascii'))
+        key = digest.hexdigest()
+        entry = self.entries.get(key)
+        if entry is not None:
+            return entry
+
+        cache_fn = join(self.path, key + '.layout')
+        try:
+            with open(cache_fn, 'rb') as fd:
+                entry = marshal.load(fd)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            entry = None
+        if entry is None:
+            layout = loads(content.decode('utf-8'))
+            entry = {'layout': marshal.dumps(layout), 'hints': {},
+                     'lines': {}}
+            for mode in layout_modes:
+                if '%s_1' % mode in layout:
+                    entry['hints'][mode] = layout_hints(layout, mode,
+                                                        margin_hint)
+            self._save(key, entry)
+        entry['key'] = key
+        self.entries[key] = entry
+        return entry
+
+    def layout(self, entry):
+        return marshal.loads(entry['layout'])
+
+    def lines(self, entry, layout_mode, size, key_margin):
+        '''Return the :func:`layout_lines` of `entry` for `layout_mode`, a
+        keyboard of `size` and `key_margin`, computing and storing them if
+        needed.
+        '''
+        key = (layout_mode, int(size[0]), int(size[1]), tuple(key_margin))
+        lines = entry['lines'].get(key)
+        if lines is None:
+            hints = entry['hints'][layout_mode]
+            layout_rows = len([k for k in hints if k.startswith('LINE_HINT_')])
+            lines = entry['lines'][key] = layout_lines(
+                hints, layout_rows, size, key_margin)
+            self._save(entry['key'], entry)
+        return lines
+
+    def _save(self, key, entry):
+        entry = dict((k, v) for k, v in entry.items() if k != 'key')
+        try:
+            if not exists(self.path):
+                makedirs(self.path)
+            with open(join(self.path, key + '.layout'), 'wb') as fd:
+                marshal.dump(entry, fd)
+        except (IOError, OSError):
+            pass
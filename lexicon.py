@@ -0,0 +1,328 @@
+'''
+Lexicon
+=======
+
+Process-wide stores for the data that doesn't change between keyboards: the
+word frequencies read from the n-gram files, the corpus bigram model, and the
+gesture templates built from the words for a given key geometry.
+
+Stores are cached by their source files and geometry, and only weakly
+referenced, so every :class:`~decoder.Decoder` using the same lexicon and
+layout attaches to the same objects and they are released with the last
+decoder using them. The last :data:`retained_templates` template stores
+requested, and their lexicons, are also kept alive, so that switching back
+to a recently used layout or language doesn't rebuild them::
+
+    lexicon = get_lexicon('0grams', '1grams')
+    templates = get_templates(lexicon, key_centers)
+
+The shared stores are never modified. The words a user commits that aren't
+in the lexicon are kept by their decoder, in a :class:`UserTemplates`
+searched together with the shared store.
+'''
+
+__all__ = ('Lexicon', 'TemplateStore', 'UserTemplates', 'UserTrie',
+           'frequency_order', 'get_lexicon', 'get_sharded_lexicon',
+           'get_bigrams', 'get_templates', 'get_shape_index')
+
+from array import array
+from collections import OrderedDict
+from itertools import chain
+from weakref import WeakValueDictionary
+
+import trie
+from keypaths import KeyPaths, path_length
+
+_lexicons = WeakValueDictionary()
+_templates = WeakValueDictionary()
+
+# number of recently requested template stores kept alive
+retained_templates = 2
+_retained = OrderedDict()
+
+
+class Lexicon(object):
+    '''Relative frequency of every word of the unigram file `unigrams_fn`.
+    Words are lowercased and only alphabetic words are kept.
+    '''
+
+    def __init__(self, nograms_fn, unigrams_fn):
+        self.frequencies = frequencies = {}
+        with open(nograms_fn) as nograms:
+            total = float(nograms.read())
+
+        with open(unigrams_fn) as unigrams:
+            for line in unigrams:
+                w, c = line[:-1].split('\t', 1)
+                if w.isalpha():
+                    frequencies[w.lower()] = float(c) / total
+
+    def make_templates(self, key_centers):
+        return TemplateStore(self, key_centers)
+
+
+def frequency_order(pairs):
+    '''Sort a list of (frequency, word) pairs in place, most frequent first,
+    and return it as the (words, frequencies) pair of lists of
+    :meth:`TemplateStore.by_frequency`.
+    '''
+    pairs.sort(reverse=True)
+    return ([w for f, w in pairs], array('f', [f for f, w in pairs]))
+
+
+class TemplateStore(object):
+    '''Gesture templates of the words of a :class:`Lexicon` for a set of key
+    centers. :data:`words` is a :class:`~trie.Trie` mapping each word to the
+    index of its template in :data:`paths`, a :class:`~keypaths.KeyPaths`.
+
+    Words using a letter that has no key have no template: they are kept in
+    :data:`words`, for the predictions and corrections, and their frequency
+    in :data:`keyless`.
+    '''
+
+    def __init__(self, lexicon, key_centers):
+        self.lexicon = lexicon
+        self.key_centers = key_centers
+        self._by_frequency = {}
+        self.keyless = {}
+        self.words = words = trie.Trie()
+        self.paths = paths = KeyPaths()
+        orders = {}
+        for word, frequency in sorted(lexicon.frequencies.items()):
+            if self.add_template(words, paths, word, frequency) is not None:
+                orders.setdefault(word[0], []).append((frequency, word))
+        self._set_by_frequency(orders)
+
+    def word_path(self, word):
+        '''Return the (key path, path length) template of `word`.'''
+        path = tuple(map(self.key_centers.__getitem__, word))
+        return (path, path_length(path))
+
+    def add_template(self, words, paths, word, frequency, keyless=None):
+        # store the template of word in paths and its index in words, if
+        # all its letters have a key, and return the index. Otherwise its
+        # frequency goes to keyless, by default self.keyless.
+        key_centers = self.key_centers
+        try:
+            path = [key_centers[c] for c in word]
+        except KeyError:
+            words[word] = None
+            if keyless is None:
+                keyless = self.keyless
+            keyless[word] = frequency
+            return None
+        index = words[word] = paths.append(path, path_length(path),
+                                           frequency)
+        return index
+
+    def template(self, word):
+        '''Return the (:class:`~keypaths.KeyPaths`, index) of the template of
+        `word`, or None.
+        '''
+        index = self.words[word]
+        return None if index is None else (self.paths, index)
+
+    def __contains__(self, word):
+        return self.template(word) is not None or word in self.keyless
+
+    def frequency(self, word):
+        '''Return the corpus frequency of `word`, 0 if it isn't known.'''
+        entry = self.template(word)
+        if entry is None:
+            return self.keyless.get(word, 0.)
+        return entry[0].frequencies[entry[1]]
+
+    def by_frequency(self, letter):
+        '''Return the words starting with `letter`, most frequent first, as
+        a (words, frequencies) pair of lists. The orders are built with the
+        templates, see :meth:`_set_by_frequency`, or else on the first call
+        for each letter.
+        '''
+        entry = self._by_frequency.get(letter)
+        if entry is None:
+            template = self.template
+            pairs = []
+            for word in self.words.iter_prefix(letter):
+                entry = template(word)
+                if entry is not None:
+                    pairs.append((entry[0].frequencies[entry[1]], word))
+            entry = self._by_frequency[letter] = frequency_order(pairs)
+        return entry
+
+    def _set_by_frequency(self, orders):
+        # set the by_frequency entries from a dict of letter to a list of
+        # (frequency, word) of the words starting with it
+        for letter, pairs in orders.items():
+            self._by_frequency[letter] = frequency_order(pairs)
+
+    def frequency_lists(self):
+        '''Return the frequency orders and keyless words held in memory.'''
+        return (self._by_frequency, self.keyless)
+
+    def guess_words(self):
+        '''Return the words to rank when guessing the next word.'''
+        return self.words
+
+    def resident(self):
+        '''Return the (:class:`~trie.Trie`, :class:`~keypaths.KeyPaths`)
+        pairs held in memory.
+        '''
+        return [(self.words, self.paths)]
+
+
+class UserTrie(object):
+    '''Read-only :class:`~trie.Trie` look-alike over the `shared` trie of a
+    template store and the `learned` trie of a :class:`UserTemplates`.
+    '''
+
+    def __init__(self, shared, learned):
+        self.shared = shared
+        self.learned = learned
+
+    def __len__(self):
+        return len(self.shared) + len(self.learned)
+
+    def __iter__(self):
+        return chain(self.shared, self.learned)
+
+    def is_resident(self, c):
+        is_resident = getattr(self.shared, 'is_resident', None)
+        return is_resident is None or is_resident(c)
+
+    def iter_prefix(self, prefix):
+        return chain(self.shared.iter_prefix(prefix),
+                     self.learned.iter_prefix(prefix))
+
+    def nodes(self, prefix):
+        return self.shared.nodes(prefix) + self.learned.nodes(prefix)
+
+    def search_correction(self, word, maxCost):
+        return (list(self.shared.search_correction(word, maxCost)) +
+                list(self.learned.search_correction(word, maxCost)))
+
+    def search_prediction(self, word, maxCost):
+        return (list(self.shared.search_prediction(word, maxCost)) +
+                list(self.learned.search_prediction(word, maxCost)))
+
+
+class UserTemplates(TemplateStore):
+    '''Templates of the words learned by one :class:`~decoder.Decoder`, over
+    the shared :class:`TemplateStore` `store`. It is used like the store:
+    :data:`words` is a :class:`UserTrie` of the words of both, and the
+    templates of the learned words are in :data:`paths`, indexed by
+    :data:`learned`. Learned words have no corpus frequency, so they come
+    last in :meth:`by_frequency`.
+    '''
+
+    def __init__(self, store, words=()):
+        self.store = store
+        self.lexicon = store.lexicon
+        self.key_centers = store.key_centers
+        self._by_frequency = {}
+        self.keyless = {}
+        self.learned = trie.Trie()
+        self.paths = KeyPaths()
+        self.words = UserTrie(store.words, self.learned)
+        for word in words:
+            self.add_word(word)
+
+    def template(self, word):
+        entry = self.store.template(word)
+        if entry is None:
+            index = self.learned[word]
+            if index is not None:
+                return (self.paths, index)
+        return entry
+
+    def __contains__(self, word):
+        return word in self.store or self.learned[word] is not None or \
+            word in self.keyless
+
+    def frequency(self, word):
+        return self.store.frequency(word)
+
+    def by_frequency(self, letter):
+        entry = self.store.by_frequency(letter)
+        learned = self.learned
+        words = [w for w in learned.iter_prefix(letter)
+                 if learned[w] is not None]
+        if not words:
+            return entry
+        return (entry[0] + words, entry[1] + array('f', [0.]) * len(words))
+
+    def guess_words(self):
+        return chain(self.store.guess_words(), self.learned)
+
+    def resident(self):
+        return self.store.resident() + [(self.learned, self.paths)]
+
+    def frequency_lists(self):
+        return (self.store.frequency_lists(), self.keyless)
+
+    def add_word(self, word):
+        '''Learn `word`, and return True if it wasn't known yet.'''
+        if word in self:
+            return False
+        self.add_template(self.learned, self.paths, word, 0.)
+        return True
+
+
+def get_lexicon(nograms_fn, unigrams_fn):
+    '''Return the shared :class:`Lexicon` for these files, loading it if no
+    decoder uses it yet.
+    '''
+    key = (nograms_fn, unigrams_fn)
+    lexicon = _lexicons.get(key)
+    if lexicon is None:
+        lexicon = _lexicons[key] = Lexicon(nograms_fn, unigrams_fn)
+    return lexicon
+
+
+def get_sharded_lexicon(fn, max_shards=None):
+    '''Return the shared :class:`~shards.ShardedLexicon` of the file `fn`,
+    opening it if no decoder uses it yet.
+    '''
+    from shards import ShardedLexicon
+    lexicon = _lexicons.get(fn)
+    if lexicon is None:
+        lexicon = _lexicons[fn] = ShardedLexicon(fn, max_shards)
+    return lexicon
+
+
+def get_bigrams(fn):
+    '''Return the shared :class:`~bigrams.BigramModel` of the file `fn`,
+    opening it if no decoder uses it yet.
+    '''
+    from bigrams import BigramModel
+    key = ('bigrams', fn)
+    bigrams = _lexicons.get(key)
+    if bigrams is None:
+        bigrams = _lexicons[key] = BigramModel(fn)
+    return bigrams
+
+
+def get_shape_index(fn):
+    '''Return the shared :class:`~shapeindex.ShapeIndex` of the file `fn`,
+    reading it if no decoder uses it yet.
+    '''
+    from shapeindex import ShapeIndex
+    key = ('shapes', fn)
+    index = _lexicons.get(key)
+    if index is None:
+        index = _lexicons[key] = ShapeIndex(fn)
+    return index
+
+
+def get_templates(lexicon, key_centers):
+    '''Return the shared :class:`TemplateStore` of `lexicon` for the key
+    geometry `key_centers`, building it if no decoder uses it yet.
+    '''
+    key = (id(lexicon), tuple(sorted(key_centers.items())))
+    templates = _templates.get(key)
+    if templates is None or templates.lexicon is not lexicon:
+        templates = _templates[key] = lexicon.make_templates(dict(key_centers))
+    _retained.pop(key, None)
+    _retained[key] = templates
+    while len(_retained) > retained_templates:
+        _retained.popitem(last=False)
+    return templates
@@ -0,0 +1,279 @@
+#!/usr/bin/python
+'''
+Load generator
+==============
+
+Drive a :class:`~vkeyboard.VKeyboard` with synthetic touches to measure the
+UI thread under sustained fast input::
+
+    python loadgen.py --rate 240 --concurrent 3 --gestures 200 -o load.json
+
+The keyboard is docked in a window like in `main.py`. Without a display, run
+it under a virtual X server (`xvfb-run python loadgen.py ...`) or any Kivy
+window provider that renders offscreen.
+
+Each gesture swipes along the key centers of a word drawn from the
+`--vocabulary` most frequent words of the lexicon, weighted by their
+frequency, so the load covers the start keys and lexicon shards in the
+proportions of real text. Touch events are generated at `--rate` Hz over
+`--swipe-time` seconds. Events are injected at every frame, all those that
+are due at once, as a fast digitizer delivers them. With `--concurrent`
+above 1, that many swipes overlap, each with its own touch.
+
+The report holds the frame times, the touch-to-commit latency (from the
+touch up to the word being inserted in the text input) and the time spent in
+`on_touch_move`, `on_touch_up`, `refresh_active_keys_layer` and
+`update_candidates`, see :class:`~profiler.Profiler`.
+'''
+
+import argparse
+import json
+import os
+import random
+import sys
+from bisect import bisect_right
+from collections import deque
+from heapq import nlargest
+from time import time
+
+# keep the load generator options away from the Kivy command line parsing
+_argv = sys.argv[1:]
+del sys.argv[1:]
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+
+import kivy
+kivy.require('1.0.8')
+
+from kivy.app import App
+from kivy.base import EventLoop
+from kivy.clock import Clock
+from kivy.config import Config
+from kivy.core.window import Window
+from kivy.input.motionevent import MotionEvent
+from kivy.uix.floatlayout import FloatLayout
+from kivy.uix.textinput import TextInput
+
+from decoder import template_size
+from keypaths import sample_n
+from profiler import Profiler
+from replay import latency_summary, report
+from vkeyboard import VKeyboard
+
+ui_stages = ('on_touch_move', 'on_touch_up', 'refresh_active_keys_layer',
+             'update_candidates')
+
+
+class SyntheticTouch(MotionEvent):
+    '''Touch at normalized window coordinates (sx, sy).'''
+
+    def depack(self, args):
+        self.is_touch = True
+        self.sx, self.sy = args
+        self.profile = ['pos']
+        super(SyntheticTouch, self).depack(args)
+
+
+class Swipe(object):
+    '''Touch events of one gesture: a list of (time, sx, sy) from the touch
+    down to the touch up.
+    '''
+
+    def __init__(self, word, events):
+        self.word = word
+        self.events = events
+        self.index = 0
+        self.touch = None
+
+
+class LoadGeneratorApp(App):
+
+    def __init__(self, args, **kwargs):
+        super(LoadGeneratorApp, self).__init__(**kwargs)
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.frame_times = []
+        self.latencies = []
+        self.touch_ups = deque()
+        self.swipes = []
+        self.started = 0
+        self.committed = 0
+        self.touch_id = 0
+        self.last_frame = None
+
+    def _keyboard_close(self):
+        pass
+
+    def build(self):
+        Config.set('kivy', 'keyboard_mode', 'dock')
+        Window.set_vkeyboard_class(VKeyboard)
+        Window.configure_keyboards()
+
+        root = FloatLayout()
+        root.add_widget(TextInput())
+        Window.request_keyboard(self._keyboard_close, self)
+        Clock.schedule_once(self.start, 1.)
+        return root
+
+    def start(self, *largs):
+        keyboards = [w for w in Window.children if isinstance(w, VKeyboard)]
+        if not keyboards:
+            sys.exit('loadgen: no VKeyboard found in the window')
+        self.keyboard = keyboard = keyboards[0]
+        keyboard.async_decoding = not self.args.sync
+
+        # a swipe that never leaves its first key is a key press
+        decoder = keyboard.decoder
+        centers = decoder.key_centers
+        words = [w for w in self.args.words or decoder.words
+                 if len(set(w)) > 1 and all(c in centers for c in w)]
+        if self.args.words:
+            weights = [1.] * len(words)
+        else:
+            frequency = decoder.templates.frequency
+            words = nlargest(self.args.vocabulary, words, key=frequency)
+            weights = [frequency(w) for w in words]
+        if not words:
+            sys.exit('loadgen: no word to swipe')
+        self.words = words
+        self.cumulative = []
+        total = 0.
+        for weight in weights:
+            total += weight
+            self.cumulative.append(total)
+
+        # profile the UI stages, and time the commits of the gestures
+        self.profiler = Profiler()
+        self.profiler.attach(keyboard, ui_stages)
+        commit_gesture = keyboard._commit_gesture
+
+        def _commit_gesture(*largs):
+            commit_gesture(*largs)
+            if self.touch_ups:
+                self.latencies.append(time() - self.touch_ups.popleft())
+            self.committed += 1
+        keyboard._commit_gesture = _commit_gesture
+
+        self.start_time = time()
+        Clock.schedule_interval(self.step, 0)
+
+    def make_swipe(self, start):
+        # touch events along the key centers of a random word, in window
+        # coordinates normalized to the window size
+        keyboard = self.keyboard
+        cumulative = self.cumulative
+        word = self.words[min(
+            bisect_right(cumulative, self.random.random() * cumulative[-1]),
+            len(self.words) - 1)]
+        centers = keyboard.decoder.key_centers
+        sx = keyboard.width / template_size[0]
+        sy = keyboard.height / template_size[1]
+        path = [keyboard.to_window(centers[c][0] * sx, centers[c][1] * sy)
+                for c in word]
+        count = max(2, int(self.args.swipe_time * self.args.rate))
+        interval = 1. / self.args.rate
+        return Swipe(word, [
+            (start + i * interval, x / float(Window.width),
+             y / float(Window.height))
+            for i, (x, y) in enumerate(sample_n(path, count))])
+
+    def step(self, dt):
+        now = time()
+        if self.last_frame is not None:
+            self.frame_times.append(now - self.last_frame)
+        self.last_frame = now
+
+        # keep `concurrent` swipes running, staggered by half a swipe
+        args = self.args
+        while len(self.swipes) < args.concurrent and \
+                self.started < args.gestures:
+            start = now + len(self.swipes) * args.swipe_time * .5
+            self.swipes.append(self.make_swipe(start))
+            self.started += 1
+
+        for swipe in self.swipes[:]:
+            self.inject(swipe, now)
+            if swipe.index == len(swipe.events):
+                self.swipes.remove(swipe)
+
+        if self.committed >= args.gestures:
+            self.finish()
+            return False
+        if now - self.start_time > args.timeout:
+            print('loadgen: timeout, %d/%d gestures committed' %
+                  (self.committed, args.gestures))
+            self.finish()
+            return False
+
+    def inject(self, swipe, now):
+        events = swipe.events
+        while swipe.index < len(events) and events[swipe.index][0] <= now:
+            t, sx, sy = events[swipe.index]
+            swipe.index += 1
+            if swipe.touch is None:
+                self.touch_id += 1
+                swipe.touch = SyntheticTouch('loadgen', self.touch_id,
+                                             (sx, sy))
+                EventLoop.post_dispatch_input('begin', swipe.touch)
+            elif swipe.index == len(events):
+                swipe.touch.move((sx, sy))
+                self.touch_ups.append(time())
+                EventLoop.post_dispatch_input('end', swipe.touch)
+            else:
+                swipe.touch.move((sx, sy))
+                EventLoop.post_dispatch_input('update', swipe.touch)
+
+    def finish(self):
+        self.profiler.detach()
+        frames = latency_summary(self.frame_times)
+        frames['over_budget'] = len([t for t in self.frame_times
+                                     if t > 1. / 60]) / \
+            float(max(len(self.frame_times), 1))
+        results = {'rate': self.args.rate,
+                   'concurrent': self.args.concurrent,
+                   'gestures': self.committed,
+                   'duration': time() - self.start_time,
+                   'frames': frames,
+                   'touch_to_commit': latency_summary(self.latencies),
+                   'stages': self.profiler.stats()}
+        if self.args.output:
+            with open(self.args.output, 'w') as fd:
+                json.dump(results, fd, indent=1, sort_keys=True)
+        report('frame time', frames)
+        print('frames over 16.7 ms: %.3f' % frames['over_budget'])
+        report('touch to commit', results['touch_to_commit'])
+        for name in ui_stages:
+            stats = results['stages'].get(name)
+            if stats:
+                print('%s: %d calls, mean %.3f ms, max %.3f ms' % (
+                    name, stats['calls'], stats['mean'] * 1000,
+                    stats['max'] * 1000))
+        self.stop()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Drive the keyboard with synthetic swipes.')
+    parser.add_argument('--rate', type=float, default=240.,
+        help='touch events per second of each swipe')
+    parser.add_argument('--swipe-time', type=float, default=.4,
+        help='duration of a swipe, in seconds')
+    parser.add_argument('--concurrent', type=int, default=1,
+        help='number of overlapping swipes')
+    parser.add_argument('--gestures', type=int, default=100,
+        help='number of gestures to commit')
+    parser.add_argument('--words', nargs='*',
+        help='words to swipe, by default words of the lexicon')
+    parser.add_argument('--vocabulary', type=int, default=1000,
+        help='number of most frequent lexicon words to pick from')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sync', action='store_true',
+        help='decode on the UI thread, see VKeyboard.async_decoding')
+    parser.add_argument('--timeout', type=float, default=120.)
+    parser.add_argument('-o', '--output',
+        help='write the measurements to this JSON file')
+    args = parser.parse_args(argv)
+    LoadGeneratorApp(args).run()
+
+
+if __name__ == '__main__':
+    main(_argv)
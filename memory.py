@@ -0,0 +1,118 @@
+'''
+Memory
+======
+
+Estimates of the memory held by the data structures of the decoder, for
+:meth:`~vkeyboard.VKeyboard.memory_usage`.
+
+Every estimate is a dict with the `bytes` and the number of `objects` of a
+component, computed with :func:`sys.getsizeof` by walking the structure::
+
+    usage = decoder_usage(decoder)
+    print(usage['trie_nodes']['bytes'], usage['trie_nodes']['objects'])
+
+The sizes are those of the Python objects themselves: the allocator
+overhead isn't counted, and strings shared between components (the words of
+the trie and of the template lists) are counted in the first component that
+holds them. The lexicon stores are shared between the decoders using the
+same lexicon and layout, see :mod:`lexicon`, so they show in the report of
+each of them. Walking the trie takes a fraction of a second for a large
+lexicon.
+'''
+
+__all__ = ('deep_sizeof', 'trie_usage', 'decoder_usage', 'total_usage')
+
+from array import array
+from sys import getsizeof
+
+
+def _usage(size=0, objects=0):
+    return {'bytes': size, 'objects': objects}
+
+
+def deep_sizeof(obj, seen=None):
+    '''Return the (bytes, objects) of `obj` and of the containers, strings
+    and instance attributes it references, each object counted once in
+    `seen`, a set of object ids.
+    '''
+    if seen is None:
+        seen = set()
+    size = objects = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += getsizeof(obj)
+        objects += 1
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, (str, unicode, array, int, float)):
+            continue
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+    return size, objects
+
+
+def trie_usage(words, seen):
+    '''Return the usage of the nodes and of the word list of the
+    :class:`~trie.Trie` `words`.
+    '''
+    nodes = _usage()
+    stack = [words.trie]
+    while stack:
+        node = stack.pop()
+        nodes['bytes'] += getsizeof(node) + getsizeof(node.__dict__) + \
+            getsizeof(node.children)
+        nodes['objects'] += 1
+        stack.extend(node.children.values())
+    size, objects = deep_sizeof(words.words, seen)
+    return nodes, _usage(size, objects)
+
+
+def _add(usage, name, size, objects):
+    entry = usage.setdefault(name, _usage())
+    entry['bytes'] += size
+    entry['objects'] += objects
+
+
+def decoder_usage(decoder):
+    '''Return a dict of component name to the usage of the lexicon trie,
+    the key path templates, the frequency lists, the shape index, the user
+    n-gram model and the gesture cache of `decoder`.
+    '''
+    usage = {}
+    seen = set()
+    templates = decoder.templates
+    resident = templates.resident() if templates is not None else \
+        [(decoder.words, None)]
+    for words, paths in resident:
+        nodes, word_list = trie_usage(words, seen)
+        _add(usage, 'trie_nodes', nodes['bytes'], nodes['objects'])
+        _add(usage, 'trie_words', word_list['bytes'], word_list['objects'])
+        if paths is not None:
+            _add(usage, 'key_paths', paths.nbytes, len(paths))
+    if templates is not None:
+        _add(usage, 'frequency_lists',
+             *deep_sizeof(templates.frequency_lists(), seen))
+    if decoder.shape_index is not None:
+        index = decoder.shape_index
+        _add(usage, 'shape_index', *deep_sizeof(
+            (index.groups, index.centroids, index.members, index.clusters),
+            seen))
+    _add(usage, 'user_ngrams', *deep_sizeof(
+        (decoder.user_unigrams, decoder.user_bigrams), seen))
+    with decoder.gesture_cache.lock:
+        entries = list(decoder.gesture_cache.entries.items())
+    _add(usage, 'gesture_cache', *deep_sizeof(entries, seen))
+    return usage
+
+
+def total_usage(usage):
+    '''Return the sum of the usage of all the components of `usage`.'''
+    return _usage(sum(u['bytes'] for u in usage.values()),
+                  sum(u['objects'] for u in usage.values()))
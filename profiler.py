@@ -0,0 +1,143 @@
+'''
+Profiler
+========
+
+Opt-in instrumentation for the decoding paths of the
+:class:`~vkeyboard.VKeyboard`.
+
+A :class:`Profiler` replaces the instrumented methods of an object with
+timing wrappers stored on the instance itself, and removes them again on
+:meth:`Profiler.detach`. Nothing is wrapped while profiling is disabled, so
+the decoding paths run exactly as before and pay no overhead.
+
+For each stage the profiler records the number of calls, the total and
+maximum wall time, and optionally the number of candidates before and after
+the stage (for the pruning steps)::
+
+    profiler = Profiler()
+    profiler.attach(keyboard, ('candidate_matches', 'gesture_distance'))
+    ...
+    print(profiler.stats()['gesture_distance']['mean'])
+    profiler.dump('profile.json')
+    profiler.detach()
+'''
+
+__all__ = ('Profiler', 'StageStats')
+
+from time import time
+from json import dumps
+from threading import Lock
+
+
+class StageStats(object):
+    '''Accumulated measurements of a single decoding stage.'''
+
+    __slots__ = ('calls', 'total', 'max', 'items_in', 'items_out')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.items_in = 0
+        self.items_out = 0
+
+    def add(self, elapsed, items_in=None, items_out=None):
+        self.calls += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        if items_in is not None:
+            self.items_in += items_in
+        if items_out is not None:
+            self.items_out += items_out
+
+    def as_dict(self):
+        calls = self.calls or 1
+        return {'calls': self.calls,
+                'total': self.total,
+                'mean': self.total / calls,
+                'max': self.max,
+                'items_in': self.items_in,
+                'items_out': self.items_out,
+                'mean_items_in': self.items_in / float(calls),
+                'mean_items_out': self.items_out / float(calls)}
+
+
+class Profiler(object):
+    '''Collect per-stage wall time, call counts and candidate counts.
+
+    Stages are named after the methods they wrap. Times are inclusive: a
+    stage that calls another instrumented stage also accounts for its time.
+    '''
+
+    def __init__(self):
+        self.stages = {}
+        self._wrapped = []
+        self._lock = Lock()
+
+    def record(self, stage, elapsed, items_in=None, items_out=None):
+        '''Add a measurement for `stage`, in seconds. Stages can be recorded
+        from several decoding threads at once.
+        '''
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = StageStats()
+            stats.add(elapsed, items_in, items_out)
+
+    def wrap(self, obj, name, count_in=None, count_out=False):
+        '''Instrument the method `name` of `obj`.
+
+        :Parameters:
+            `count_in`: callable or None
+                Called before the method to get the number of candidates
+                entering the stage.
+            `count_out`: bool
+                If True, the length of the returned value is recorded as the
+                number of candidates leaving the stage.
+        '''
+        method = getattr(obj, name)
+        record = self.record
+
+        def wrapper(*largs, **kwargs):
+            items_in = count_in() if count_in is not None else None
+            start = time()
+            result = method(*largs, **kwargs)
+            elapsed = time() - start
+            items_out = len(result) if count_out else None
+            record(name, elapsed, items_in, items_out)
+            return result
+
+        setattr(obj, name, wrapper)
+        self._wrapped.append((obj, name))
+
+    def attach(self, obj, names):
+        '''Instrument each method of `obj` listed in `names`. An entry can
+        also be a (name, count_in, count_out) tuple, see :meth:`wrap`.
+        '''
+        for name in names:
+            if isinstance(name, tuple):
+                self.wrap(obj, *name)
+            else:
+                self.wrap(obj, name)
+
+    def detach(self):
+        '''Remove all the wrappers installed by this profiler.'''
+        for obj, name in self._wrapped:
+            obj.__dict__.pop(name, None)
+        self._wrapped = []
+
+    def reset(self):
+        self.stages = {}
+
+    def stats(self):
+        '''Return a dict of stage name to a dict of measurements.'''
+        with self._lock:
+            return dict((name, stats.as_dict())
+                        for name, stats in self.stages.items())
+
+    def dump(self, fn):
+        '''Write the current :meth:`stats` to `fn` as JSON.'''
+        with open(fn, 'w') as fd:
+            fd.write(dumps({'time': time(), 'stages': self.stats()},
+                           indent=2, sort_keys=True))
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+'''
+Replay
+======
+
+Feed the gestures of a :mod:`gesturelog` file through the
+:class:`~decoder.Decoder` without a display, and compare the results of two
+builds::
+
+    # with the first build
+    python replay.py run gestures.log -o before.json
+    # with the second build
+    python replay.py run gestures.log -o after.json
+    python replay.py compare before.json after.json
+
+The gestures of a layout are all decoded by the same decoder, loaded on the
+first gesture of that layout. It never learns the committed words, so the
+results don't depend on the session's user n-grams and runs are
+reproducible. Its gesture cache is cleared before every decoding, so the
+latencies are those of a full search.
+'''
+
+import argparse
+import json
+import sys
+from os.path import join
+from time import time
+
+from decoder import Decoder, template_size
+from gesturelog import read_gestures
+from layouts import read_layout, layout_hints, layout_lexicon
+
+default_margin_hint = (.05, .06, .05, .06)
+
+
+def load_decoder(layout_path, layout_id):
+    layout_fn = join(layout_path, layout_id + '.json')
+    layout = read_layout(layout_fn)
+    decoder = Decoder()
+    decoder.set_layout(layout_hints(layout, 'normal', default_margin_hint))
+    decoder.load_lexicon(layout_lexicon(layout, layout_fn))
+    return decoder
+
+
+def percentile(values, q):
+    if not values:
+        return 0.
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def latency_summary(latencies):
+    return {'count': len(latencies),
+            'mean': sum(latencies) / max(len(latencies), 1),
+            'p50': percentile(latencies, .5),
+            'p95': percentile(latencies, .95),
+            'max': max(latencies) if latencies else 0.}
+
+
+def run(args):
+    decoders = {}
+    results = []
+    latencies = []
+    hits = incomplete = top1_changed = 0
+    for index, record in enumerate(read_gestures(args.log)):
+        decoder = decoders.get(record.layout)
+        if decoder is None:
+            decoder = decoders[record.layout] = load_decoder(
+                args.layout_path, record.layout)
+        sx = template_size[0] / record.size[0]
+        sy = template_size[1] / record.size[1]
+        gesture = [(x * sx, y * sy) for x, y in record.points]
+        # repeated or similar gestures would hit the cache of the previous
+        # ones, every gesture is decoded from scratch
+        decoder.gesture_cache.clear()
+        start = time()
+        matches, complete = decoder.anytime_matches(
+            gesture, record.prev_word, args.time_budget)
+        latency = time() - start
+        ranking = [w for w, p in matches[:args.top]]
+        if ranking and ranking[0] == record.chosen.lower():
+            hits += 1
+        latencies.append(latency)
+        result = {'index': index, 'layout': record.layout,
+                  'chosen': record.chosen, 'latency': latency,
+                  'ranking': ranking}
+        if args.time_budget is not None:
+            # compare with the result of the full search
+            decoder.gesture_cache.clear()
+            full = decoder.anytime_matches(gesture, record.prev_word)[0]
+            result['complete'] = complete
+            result['top1_changed'] = ranking[:1] != [w for w, p in full[:1]]
+            incomplete += not complete
+            top1_changed += result['top1_changed']
+        results.append(result)
+    summary = latency_summary(latencies)
+    summary['top1'] = hits / float(max(len(results), 1))
+    if args.time_budget is not None:
+        summary['time_budget'] = args.time_budget
+        summary['incomplete'] = incomplete / float(max(len(results), 1))
+        summary['top1_changed_by_budget'] = \
+            top1_changed / float(max(len(results), 1))
+    with open(args.output, 'w') as fd:
+        json.dump({'log': args.log, 'summary': summary,
+                   'gestures': results}, fd, indent=1)
+    report('latency', summary)
+    print('top-1 agreement with chosen candidate: %.3f' % summary['top1'])
+    if args.time_budget is not None:
+        print('time budget %.1f ms: %.3f incomplete, top-1 changed for %.3f' %
+              (args.time_budget * 1000, summary['incomplete'],
+               summary['top1_changed_by_budget']))
+
+
+def compare(args):
+    with open(args.before) as fd:
+        before = json.load(fd)
+    with open(args.after) as fd:
+        after = json.load(fd)
+    pairs = list(zip(before['gestures'], after['gestures']))
+    changed_top1 = changed = 0
+    for a, b in pairs:
+        if a['ranking'] == b['ranking']:
+            continue
+        changed += 1
+        if a['ranking'][:1] != b['ranking'][:1]:
+            changed_top1 += 1
+        if args.verbose:
+            print('#%d chosen=%r\n  before: %s\n  after:  %s' % (
+                a['index'], a['chosen'],
+                ' '.join(a['ranking']), ' '.join(b['ranking'])))
+    report('before', before['summary'])
+    report('after', after['summary'])
+    speedup = before['summary']['mean'] / max(after['summary']['mean'], 1e-9)
+    print('mean latency ratio before/after: %.2fx' % speedup)
+    print('rankings changed: %d/%d, top-1 changed: %d' % (
+        changed, len(pairs), changed_top1))
+    print('top-1 agreement: %.3f -> %.3f' % (
+        before['summary']['top1'], after['summary']['top1']))
+
+
+def report(name, summary):
+    print('%s: %d gestures, mean %.2f ms, p50 %.2f ms, p95 %.2f ms, '
+          'max %.2f ms' % (name, summary['count'], summary['mean'] * 1000,
+                           summary['p50'] * 1000, summary['p95'] * 1000,
+                           summary['max'] * 1000))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Replay gesture logs through the decoder.')
+    subparsers = parser.add_subparsers()
+
+    parser_run = subparsers.add_parser('run', help='decode a gesture log')
+    parser_run.add_argument('log')
+    parser_run.add_argument('-o', '--output', default='replay.json')
+    parser_run.add_argument('--layout-path', default='.',
+        help='directory holding the layouts and lexicon files')
+    parser_run.add_argument('--top', type=int, default=6,
+        help='number of ranked candidates to keep per gesture')
+    parser_run.add_argument('--time-budget', type=float,
+        help='decode in anytime mode with this budget, in seconds, and '
+             'compare with the full search')
+    parser_run.set_defaults(func=run)
+
+    parser_compare = subparsers.add_parser('compare',
+        help='compare the results of two runs')
+    parser_compare.add_argument('before')
+    parser_compare.add_argument('after')
+    parser_compare.add_argument('-v', '--verbose', action='store_true',
+        help='print every gesture whose ranking changed')
+    parser_compare.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,383 @@
+#!/usr/bin/python
+'''
+Shape index
+===========
+
+Approximate nearest neighbour index of the gesture templates, selected with
+:data:`~decoder.Decoder.gesture_search` 'clusters'.
+
+The template scan scores every word that starts and ends near the start and
+end of the gesture, which is still thousands of words for common letter
+pairs. The shape index groups the words by (first letter, last letter) and
+clusters the templates of each group with k-means on their key paths
+resampled to :data:`points` points. A gesture is compared to the centroids
+of the groups its start and end allow, and only the words of the `probe`
+nearest clusters are scored.
+
+The index depends on the lexicon and the key geometry, so it is built
+offline for a layout, next to its layout file::
+
+    python shapeindex.py qwerty
+
+The build then decodes synthetic gestures with the index and with the
+template scan, and records the recall of each `probe`: the fraction of the
+top candidates of the template scan also found with the index. At runtime,
+:data:`~decoder.Decoder.cluster_recall` picks the smallest `probe` whose
+recall reaches it, see :meth:`ShapeIndex.probe_for`.
+
+File format, little-endian::
+
+    <4s magic> <B version> <B points> <I geometry> <I groups> <I clusters>
+    <B recalls>
+    <recalls * (<H probe> <f recall>)>
+    <groups * (<I first character> <I last character> <I clusters>)>
+    <clusters * (<I words> <points * 2 * f centroid>)>
+    words of the clusters in order: <H length> <UTF-8 word>
+
+The index is shared by the decoders of a layout and never modified: the
+words a decoder learns are scored next to the clusters, see
+:meth:`~decoder.Decoder.cluster_matches`.
+'''
+
+__all__ = ('ShapeIndex', 'build_shape_index', 'geometry_key')
+
+import argparse
+import random
+import sys
+from heapq import nsmallest
+from os.path import join
+from struct import Struct
+from time import time
+from zlib import crc32
+
+from keypaths import quantum
+
+MAGIC = b'VKSI'
+VERSION = 1
+
+_header = Struct('<4sBBIIIB')
+_recall = Struct('<Hf')
+_group = Struct('<III')
+_count = Struct('<I')
+_length = Struct('<H')
+
+# number of points of the centroids, taken among the points of the
+# normalized templates
+points = 8
+
+# probes whose recall is measured when building an index
+probes = (1, 2, 4, 8, 16, 32, 64)
+
+
+def geometry_key(key_centers):
+    '''Return the fingerprint of a key geometry stored in the index.'''
+    text = u' '.join(u'%s:%.1f,%.1f' % (c, x, y)
+                     for c, (x, y) in sorted(key_centers.items()))
+    return crc32(text.encode('utf-8')) & 0xffffffff
+
+
+def reduce_points(samples):
+    '''Return the :data:`points` points of the normalized `samples` the
+    centroids are made of.
+    '''
+    last = len(samples) - 1
+    return [samples[i * last // (points - 1)] for i in xrange(points)]
+
+
+def shape_distance(a, b):
+    '''Return the mean distance between the points of `a` and `b`.'''
+    return sum(((x1 - x2) ** 2 + (y1 - y2) ** 2) ** 0.5
+               for (x1, y1), (x2, y2) in zip(a, b)) / len(a)
+
+
+def kmeans(vectors, k, iterations, rnd):
+    '''Cluster the flat coordinate lists `vectors` into at most `k`
+    clusters, and return the (centroid, member indices) of the non empty
+    ones.
+    '''
+    centroids = [list(v) for v in rnd.sample(vectors, k)]
+    assignment = None
+    for iteration in xrange(iterations):
+        previous = assignment
+        assignment = []
+        for v in vectors:
+            best = best_d = None
+            for j, c in enumerate(centroids):
+                d = sum((a - b) ** 2 for a, b in zip(v, c))
+                if best_d is None or d < best_d:
+                    best, best_d = j, d
+            assignment.append(best)
+        if assignment == previous:
+            break
+        sums = [[0.] * len(vectors[0]) for c in centroids]
+        counts = [0] * len(centroids)
+        for v, j in zip(vectors, assignment):
+            counts[j] += 1
+            s = sums[j]
+            for i, a in enumerate(v):
+                s[i] += a
+        centroids = [[a / counts[j] for a in s] if counts[j] else centroids[j]
+                     for j, s in enumerate(sums)]
+    members = [[] for c in centroids]
+    for i, j in enumerate(assignment):
+        members[j].append(i)
+    return [(c, m) for c, m in zip(centroids, members) if m]
+
+
+class ShapeIndex(object):
+    '''Clusters of the word templates, read from the file `fn` written by
+    :meth:`save`, or empty.
+
+    :data:`groups` maps (first letter, last letter) to the indices of its
+    clusters in :data:`centroids`, lists of :data:`points` (x, y), and
+    :data:`members`, lists of words. :data:`recalls` holds the measured
+    (probe, recall) pairs, by increasing probe.
+    '''
+
+    def __init__(self, fn=None):
+        self.geometry = 0
+        self.groups = {}
+        self.centroids = []
+        self.members = []
+        self.clusters = {}
+        self.recalls = []
+        if fn is not None:
+            self.read(fn)
+
+    def read(self, fn):
+        with open(fn, 'rb') as fd:
+            data = fd.read()
+        magic, version, n, self.geometry, groups, clusters, recalls = \
+            _header.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION or n != points:
+            raise ValueError('%s is not a version %d shape index' %
+                             (fn, VERSION))
+        pos = _header.size
+        for i in xrange(recalls):
+            self.recalls.append(_recall.unpack_from(data, pos))
+            pos += _recall.size
+        group_counts = []
+        for i in xrange(groups):
+            first, last, count = _group.unpack_from(data, pos)
+            group_counts.append(((unichr(first), unichr(last)), count))
+            pos += _group.size
+        centroid = Struct('<%df' % (points * 2))
+        counts = []
+        for i in xrange(clusters):
+            counts.append(_count.unpack_from(data, pos)[0])
+            pos += _count.size
+            coords = centroid.unpack_from(data, pos)
+            pos += centroid.size
+            self.centroids.append(zip(coords[::2], coords[1::2]))
+        for count in counts:
+            words = []
+            for i in xrange(count):
+                length = _length.unpack_from(data, pos)[0]
+                pos += _length.size
+                words.append(data[pos:pos + length].decode('utf-8'))
+                pos += length
+            self._add_cluster(words)
+        cluster = 0
+        for key, count in group_counts:
+            self.groups[key] = range(cluster, cluster + count)
+            cluster += count
+
+    def save(self, fn):
+        '''Write the index to the file `fn`.'''
+        groups = sorted(self.groups.items())
+        centroid = Struct('<%df' % (points * 2))
+        with open(fn, 'wb') as fd:
+            fd.write(_header.pack(MAGIC, VERSION, points, self.geometry,
+                                  len(groups), len(self.centroids),
+                                  len(self.recalls)))
+            for probe, recall in self.recalls:
+                fd.write(_recall.pack(probe, recall))
+            order = []
+            for (first, last), clusters in groups:
+                fd.write(_group.pack(ord(first), ord(last), len(clusters)))
+                order.extend(clusters)
+            for j in order:
+                fd.write(_count.pack(len(self.members[j])))
+                fd.write(centroid.pack(*[c for point in self.centroids[j]
+                                         for c in point]))
+            for j in order:
+                for word in self.members[j]:
+                    encoded = word.encode('utf-8')
+                    fd.write(_length.pack(len(encoded)))
+                    fd.write(encoded)
+
+    def _add_cluster(self, words):
+        j = len(self.members)
+        self.members.append(words)
+        for word in words:
+            self.clusters[word] = j
+        return j
+
+    def add_group(self, key, clusters):
+        '''Add the group `key` from a list of (centroid, words) clusters.'''
+        group = self.groups.setdefault(key, [])
+        for centroid, words in clusters:
+            self.centroids.append(centroid)
+            group.append(self._add_cluster(words))
+
+    def probe_for(self, recall):
+        '''Return the smallest measured probe whose recall reaches `recall`,
+        or None, meaning every cluster, if none does.
+        '''
+        for probe, measured in self.recalls:
+            if measured >= recall:
+                return probe
+        return None
+
+    def matches(self, decoder, gesture, gest_length, probe=None):
+        '''Return the words of the `probe` clusters nearest to the normalized
+        `gesture`, among the groups whose first and last keys are
+        within the windows of `decoder`, that have a compatible path length.
+        '''
+        shape = reduce_points(gesture)
+        gx, gy = gesture[-1]
+        max_dx = decoder.key_width * decoder.end_window + quantum
+        max_dy = decoder.key_height * decoder.end_window + quantum
+        ends = [c for c, (kx, ky) in decoder.key_centers.items()
+                if abs(kx - gx) <= max_dx and abs(ky - gy) <= max_dy]
+        clusters = []
+        for first in decoder.start_letters(gesture[0]):
+            for last in ends:
+                clusters.extend(self.groups.get((first, last), ()))
+        if probe is not None and probe < len(clusters):
+            centroids = self.centroids
+            clusters = nsmallest(probe, clusters, key=lambda j:
+                                 shape_distance(shape, centroids[j]))
+
+        template = decoder.templates.template
+        min_ratio, max_ratio = decoder.min_length_ratio, \
+            decoder.max_length_ratio
+        words = []
+        for j in clusters:
+            for word in self.members[j]:
+                entry = template(word)
+                if entry is None:
+                    continue
+                length = entry[0].lengths[entry[1]]
+                if min_ratio*length <= gest_length <= max_ratio*length:
+                    words.append(word)
+        return words
+
+
+def build_shape_index(decoder, cluster_size=32, iterations=10, seed=0):
+    '''Return the :class:`ShapeIndex` of the templates of `decoder`,
+    clustering each group of words into clusters of about `cluster_size`
+    words.
+    '''
+    rnd = random.Random(seed)
+    index = ShapeIndex()
+    index.geometry = geometry_key(decoder.key_centers)
+    groups = {}
+    template = decoder.templates.template
+    for word in decoder.words:
+        entry = template(word)
+        if entry is not None:
+            groups.setdefault((word[0], word[-1]), []).append(
+                (word, reduce_points(entry[0].samples(entry[1]))))
+    for key in sorted(groups):
+        entries = groups[key]
+        k = (len(entries) + cluster_size - 1) // cluster_size
+        if k == 1:
+            shapes = [shape for word, shape in entries]
+            centroid = [(sum(x for x, y in p) / len(p),
+                         sum(y for x, y in p) / len(p))
+                        for p in zip(*shapes)]
+            index.add_group(key, [(centroid, [w for w, s in entries])])
+            continue
+        vectors = [[c for point in shape for c in point]
+                   for word, shape in entries]
+        index.add_group(key, [
+            (zip(centroid[::2], centroid[1::2]),
+             [entries[i][0] for i in members])
+            for centroid, members in kmeans(vectors, k, iterations, rnd)])
+    return index
+
+
+def measure_recall(decoder, gestures, top=5):
+    '''Decode `gestures` with the template scan and with the index of
+    `decoder` for each of :data:`probes`, and return the exhaustive mean
+    latency and a list of (probe, recall, top-1 agreement, mean latency).
+    '''
+    exhaustive = []
+    start = time()
+    for gesture, prev_word, word in gestures:
+        decoder.gesture_cache.clear()
+        exhaustive.append([w for w, p in
+                           decoder.anytime_matches(gesture, prev_word)[0][:top]])
+    latency = (time() - start) / len(gestures)
+    results = []
+    for probe in probes:
+        found = expected = agreed = 0
+        start = time()
+        for (gesture, prev_word, word), reference in zip(gestures, exhaustive):
+            decoder.gesture_cache.clear()
+            ranking = [w for w, p in decoder.cluster_matches(
+                gesture, prev_word, probe=probe)[:top]]
+            found += len(set(ranking).intersection(reference))
+            expected += len(reference)
+            if ranking[:1] == reference[:1]:
+                agreed += 1
+        results.append((probe, found / float(max(expected, 1)),
+                        agreed / float(len(gestures)),
+                        (time() - start) / len(gestures)))
+    return latency, results
+
+
+def main(argv):
+    from replay import load_decoder
+    from tune import recorded_gestures, synthetic_gestures
+
+    parser = argparse.ArgumentParser(
+        description='Build the shape index of the templates of a layout.')
+    parser.add_argument('layout', help='layout id')
+    parser.add_argument('--layout-path', default='.',
+        help='directory holding the layouts and lexicon files')
+    parser.add_argument('-o', '--output',
+        help='index file, by default <layout>.shapes in the layout path')
+    parser.add_argument('--cluster-size', type=int, default=32,
+        help='mean number of words per cluster')
+    parser.add_argument('--iterations', type=int, default=10,
+        help='k-means iterations')
+    parser.add_argument('--log', help='gesturelog file of recorded gestures '
+                        'to measure the recall on')
+    parser.add_argument('--synthetic', type=int, default=100,
+        help='number of synthetic gestures, when no log is given')
+    parser.add_argument('--noise', type=float, default=.2,
+        help='noise of the synthetic gestures, in key sizes')
+    parser.add_argument('--top', type=int, default=5,
+        help='number of top candidates the recall is measured on')
+    args = parser.parse_args(argv)
+
+    decoder = load_decoder(args.layout_path, args.layout)
+    start = time()
+    index = build_shape_index(decoder, args.cluster_size, args.iterations)
+    print('%d words in %d clusters of %d groups, built in %.1f s' % (
+        len(index.clusters), len(index.members), len(index.groups),
+        time() - start))
+
+    if args.log:
+        gestures = recorded_gestures(args.log, args.layout)
+    else:
+        gestures = synthetic_gestures(decoder, args.synthetic, args.noise)
+    if not gestures:
+        sys.exit('shapeindex: no gesture for layout %s' % args.layout)
+    decoder.shape_index = index
+    latency, results = measure_recall(decoder, gestures, args.top)
+    print('template scan: %.2f ms' % (latency * 1000))
+    for probe, recall, top1, probe_latency in results:
+        print('probe %3d: recall@%d %.3f, top-1 %.3f, %.2f ms' % (
+            probe, args.top, recall, top1, probe_latency * 1000))
+    index.recalls = [(probe, recall) for probe, recall, t, l in results]
+
+    fn = args.output or join(args.layout_path, args.layout + '.shapes')
+    index.save(fn)
+    print('written to %s' % fn)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
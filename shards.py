@@ -0,0 +1,358 @@
+#!/usr/bin/python
+'''
+Shards
+======
+
+Disk-backed lexicon for vocabularies too large to keep in memory.
+
+The lexicon is compiled once into a single file, sharded by the first
+character of the words::
+
+    python shards.py 0grams 1grams lexicon.shards
+
+At runtime the file is memory-mapped, so only the shards that are actually
+read are paged in by the OS. The gesture templates of a shard are built in a
+bounded cache of resident shards. By default the cache holds a shard per key
+of the layout, plus :data:`spare_shards` for the other characters, and the
+shards of the keys are built on a background thread as soon as the templates
+are created, so that the gestures don't wait for them. A shard that isn't
+resident is built the first time a gesture or prefix needs it. The most
+frequent words are always resident, for the guesses shown after a word is
+committed.
+
+File format, little-endian::
+
+    <4s magic> <B version> <I shards> <I frequent>
+    <shards * (<I first character> <Q offset> <I words>)>
+    <frequent * <I shard> <I index>>
+    shard data: <words * (<f frequency> <H length> <UTF-8 word>)>
+
+Words are lowercased and sorted within each shard. Unlike the in-memory
+:class:`~lexicon.Lexicon`, non alphabetic entries are kept. Words using a
+character that has no key in the layout don't get a gesture template, but
+they are predicted and corrected like the others.
+'''
+
+__all__ = ('ShardedLexicon', 'ShardedTemplateStore', 'ShardedTrie',
+           'build_shards')
+
+import mmap
+import sys
+from array import array
+from collections import OrderedDict
+from struct import Struct
+from threading import Lock, Thread
+
+import trie
+from keypaths import KeyPaths
+from lexicon import TemplateStore, frequency_order
+
+MAGIC = b'VKLX'
+VERSION = 1
+
+_header = Struct('<4sBII')
+_shard = Struct('<IQI')
+_frequent = Struct('<II')
+_record = Struct('<fH')
+
+# number of shards kept resident for the characters without a key, on top of
+# the shards of the keys, when the cache size isn't given
+spare_shards = 4
+
+
+def build_shards(nograms_fn, unigrams_fn, fn, frequent=2000):
+    '''Compile the n-gram files into the sharded lexicon file `fn`. The
+    `frequent` most frequent words are listed in the header.
+    '''
+    with open(nograms_fn) as nograms:
+        total = float(nograms.read())
+
+    frequencies = {}
+    with open(unigrams_fn) as unigrams:
+        for line in unigrams:
+            w, c = line.rstrip('\n').split('\t', 1)
+            w = w.decode('utf-8').lower()
+            if w:
+                frequencies[w] = frequencies.get(w, 0.) + float(c) / total
+
+    shards = {}
+    for word in sorted(frequencies):
+        shards.setdefault(word[0], []).append(word)
+    first_chars = sorted(shards)
+    top = sorted(frequencies, key=frequencies.get, reverse=True)[:frequent]
+    top_index = dict((w, i) for i, w in enumerate(top))
+    top_entries = [None] * len(top)
+
+    with open(fn, 'wb') as fd:
+        fd.write(_header.pack(MAGIC, VERSION, len(shards), len(top)))
+        offset = (_header.size + len(shards) * _shard.size +
+                  len(top) * _frequent.size)
+        data = []
+        for s, c in enumerate(first_chars):
+            fd.write(_shard.pack(ord(c), offset, len(shards[c])))
+            for i, word in enumerate(shards[c]):
+                encoded = word.encode('utf-8')
+                data.append(_record.pack(frequencies[word], len(encoded)))
+                data.append(encoded)
+                offset += _record.size + len(encoded)
+                if word in top_index:
+                    top_entries[top_index[word]] = (s, i)
+        for s, i in top_entries:
+            fd.write(_frequent.pack(s, i))
+        fd.write(b''.join(data))
+
+
+class ShardedLexicon(object):
+    '''Memory-mapped view of a file written by :func:`build_shards`.
+
+    :data:`shards` maps the first character of the words to the (offset,
+    number of words) of their shard, and :data:`frequent` lists the
+    (shard character, index) of the most frequent words. `max_shards` is the
+    number of shards the template stores keep resident, by default one per
+    key of their layout plus :data:`spare_shards`.
+    '''
+
+    def __init__(self, fn, max_shards=None):
+        self.max_shards = max_shards
+        self.fd = open(fn, 'rb')
+        self.data = data = mmap.mmap(self.fd.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+        magic, version, count, frequent = _header.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a version %d sharded lexicon' %
+                             (fn, VERSION))
+        self.shards = shards = OrderedDict()
+        pos = _header.size
+        for i in xrange(count):
+            c, offset, words = _shard.unpack_from(data, pos)
+            shards[unichr(c)] = (offset, words)
+            pos += _shard.size
+        chars = list(shards)
+        self.frequent = []
+        for i in xrange(frequent):
+            s, index = _frequent.unpack_from(data, pos)
+            self.frequent.append((chars[s], index))
+            pos += _frequent.size
+
+    def read_shard(self, c):
+        '''Return the list of (word, frequency) of the shard of words starting
+        with `c`, empty if there is none.
+        '''
+        if c not in self.shards:
+            return []
+        offset, words = self.shards[c]
+        data = self.data
+        unpack_from = _record.unpack_from
+        size = _record.size
+        entries = []
+        for i in xrange(words):
+            frequency, length = unpack_from(data, offset)
+            offset += size
+            entries.append((data[offset:offset + length].decode('utf-8'),
+                            frequency))
+            offset += length
+        return entries
+
+    def make_templates(self, key_centers):
+        return ShardedTemplateStore(self, key_centers)
+
+
+class ShardedTrie(object):
+    '''Read-mostly :class:`~trie.Trie` look-alike over the shards of a
+    :class:`ShardedLexicon`, mapping words to their gesture templates.
+
+    Shards are paged in on access and the least recently used one is dropped
+    when more than `max_shards` are resident. A shard is built outside of
+    :data:`lock`, so only the callers needing that shard wait for it. The
+    most frequent words are also kept in an always resident trie. Each of
+    these tries maps its words to their index in its own
+    :class:`~keypaths.KeyPaths`. A shard also holds the frequency of its
+    words without a template and its frequency order, so a dropped shard
+    releases all of them.
+
+    The edit distance searches only look in the shard of the first letter of
+    the searched word.
+    '''
+
+    def __init__(self, store, max_shards):
+        self.store = store
+        self.max_shards = max_shards
+        self.cache = OrderedDict()
+        self.lock = Lock()
+        # per character lock, held while its shard is built
+        self.loading = {}
+        self.frequent = trie.Trie()
+        self.frequent_paths = KeyPaths()
+
+    def shard(self, c):
+        '''Return the (trie, key paths, keyless words, frequency order) of
+        the shard of `c`, building it if it isn't resident, see
+        :meth:`ShardedTemplateStore.build_shard`.
+        '''
+        with self.lock:
+            shard = self.cache.pop(c, None)
+            if shard is not None:
+                self.cache[c] = shard
+                return shard
+            loading = self.loading.setdefault(c, Lock())
+        with loading:
+            # built meanwhile by another thread
+            with self.lock:
+                shard = self.cache.get(c)
+            if shard is None:
+                shard = self.store.build_shard(c)
+                with self.lock:
+                    self.cache[c] = shard
+                    while len(self.cache) > self.max_shards:
+                        self.cache.popitem(last=False)
+            return shard
+
+    def is_resident(self, c):
+        '''Return True if the shard of `c` is built, or if there is none.'''
+        with self.lock:
+            return c in self.cache or c not in self.store.lexicon.shards
+
+    def __len__(self):
+        return sum(words for offset, words
+                   in self.store.lexicon.shards.values())
+
+    def __getitem__(self, word):
+        value = self.template(word)
+        return None if value is None else value[1]
+
+    def template(self, word):
+        '''Return the (key paths, index) of the template of `word`, or
+        None.
+        '''
+        if not word:
+            return None
+        # the shards hold the frequent words too, a resident shard is looked
+        # up first, without the lock: only shard() updates the recency
+        shard = self.cache.get(word[0])
+        if shard is None:
+            index = self.frequent[word]
+            if index is not None:
+                return (self.frequent_paths, index)
+            shard = self.shard(word[0])
+        words, paths = shard[0], shard[1]
+        index = words[word]
+        return None if index is None else (paths, index)
+
+    def __iter__(self):
+        # the words are read from the file, without building the shards
+        lexicon = self.store.lexicon
+        for c in lexicon.shards:
+            for word, frequency in lexicon.read_shard(c):
+                yield word
+
+    def iter_prefix(self, prefix):
+        return self.shard(prefix[0])[0].iter_prefix(prefix)
+
+    def nodes(self, prefix):
+        return self.shard(prefix[0])[0].nodes(prefix)
+
+    def search_correction(self, word, maxCost):
+        return self.shard(word[0])[0].search_correction(word, maxCost)
+
+    def search_prediction(self, word, maxCost):
+        return self.shard(word[0])[0].search_prediction(word, maxCost)
+
+
+class ShardedTemplateStore(TemplateStore):
+    ''':class:`~lexicon.TemplateStore` whose :data:`words` is a
+    :class:`ShardedTrie`. The shards of the characters with a key are built
+    on a background thread, see :meth:`preload`. :data:`keyless` only holds
+    the frequent words without a template, the others are kept by their
+    shard.
+    '''
+
+    def __init__(self, lexicon, key_centers):
+        self.lexicon = lexicon
+        self.key_centers = key_centers
+        self.keyless = {}
+        keys = [c for c in lexicon.shards if c in key_centers]
+        max_shards = lexicon.max_shards
+        if max_shards is None:
+            max_shards = len(keys) + spare_shards
+        self.words = words = ShardedTrie(self, max_shards)
+        shards = {}
+        for c, index in lexicon.frequent:
+            if c not in shards:
+                shards[c] = lexicon.read_shard(c)
+            word, frequency = shards[c][index]
+            self.add_template(words.frequent, words.frequent_paths, word,
+                              frequency)
+        thread = Thread(target=self.preload, args=(keys[:max_shards], ),
+                        name='ShardPreload')
+        thread.daemon = True
+        thread.start()
+
+    def preload(self, chars):
+        '''Build the shards of `chars`, unless they are resident already.'''
+        for c in chars:
+            self.words.shard(c)
+
+    def build_shard(self, c):
+        '''Return the (trie, key paths, keyless words, frequency order) of
+        the words starting with `c`. The keyless words map the words without
+        a template to their frequency, the frequency order is the
+        :meth:`by_frequency` of `c`.
+        '''
+        words = trie.Trie()
+        paths = KeyPaths()
+        keyless = {}
+        pairs = []
+        for word, frequency in self.lexicon.read_shard(c):
+            if self.add_template(words, paths, word, frequency,
+                                 keyless) is not None:
+                pairs.append((frequency, word))
+        return (words, paths, keyless, frequency_order(pairs))
+
+    def template(self, word):
+        return self.words.template(word)
+
+    def _keyless(self, word):
+        # the keyless words of the shard of word
+        if word[:1] not in self.lexicon.shards:
+            return {}
+        return self.words.shard(word[0])[2]
+
+    def __contains__(self, word):
+        return self.template(word) is not None or word in self.keyless or \
+            word in self._keyless(word)
+
+    def frequency(self, word):
+        entry = self.template(word)
+        if entry is not None:
+            return entry[0].frequencies[entry[1]]
+        if word in self.keyless:
+            return self.keyless[word]
+        return self._keyless(word).get(word, 0.)
+
+    def by_frequency(self, letter):
+        if letter not in self.lexicon.shards:
+            return ([], array('f'))
+        return self.words.shard(letter)[3]
+
+    def guess_words(self):
+        return self.words.frequent
+
+    def _resident_shards(self):
+        words = self.words
+        with words.lock:
+            return list(words.cache.values())
+
+    def resident(self):
+        words = self.words
+        return [shard[:2] for shard in self._resident_shards()] + \
+            [(words.frequent, words.frequent_paths)]
+
+    def frequency_lists(self):
+        return [self.keyless] + [shard[2:] for shard
+                                 in self._resident_shards()]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        sys.exit('usage: %s <0grams> <1grams> <output>' % sys.argv[0])
+    build_shards(*sys.argv[1:])
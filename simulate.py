@@ -0,0 +1,285 @@
+#!/usr/bin/python
+'''
+Simulate
+========
+
+Offline evaluation of the decoder on synthetic gestures, spread over all
+the CPU cores::
+
+    python simulate.py --gestures 100000 -o simulation.json
+    python simulate.py --layouts qwerty --search beam --checkpoint beam.ckpt
+
+Each gesture swipes along the key path of a word drawn from the frequency
+distribution of the lexicon of the layout, with gaussian noise of `--noise`
+key sizes, and is decoded without context. The work of every layout is cut
+in chunks of `--chunk` gestures, each with its own seed, decoded in a pool
+of `--workers` processes. The decoders are loaded once, before the pool is
+started, and shared with the workers.
+
+The result of every finished chunk, its accuracy, rank and latency
+histograms, is appended to the `--checkpoint` file. Run again with the same
+options, the simulation skips the chunks found there, so an interrupted run
+resumes where it stopped. The histograms are merged per layout and overall
+into the `--output` JSON file.
+'''
+
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+from bisect import bisect_left, bisect_right
+from glob import glob
+from os.path import basename, exists, getsize, join, splitext
+from time import time
+
+from replay import load_decoder
+
+# upper edges of the latency histogram bins, in seconds, the last bin
+# counting the slower gestures
+latency_bins = (.001, .002, .004, .008, .016, .032, .064, .128, .256, .512)
+
+# state shared with the worker processes: the options and, per layout, the
+# decoder and the cumulative frequencies of its words
+_args = None
+_layouts = {}
+
+
+def load_layout(args, layout_id):
+    '''Return the (decoder, words, cumulative frequencies) of `layout_id`.'''
+    decoder = load_decoder(args.layout_path, layout_id)
+    decoder.gesture_search = args.search
+    if args.search == 'clusters':
+        decoder.load_shape_index(join(args.layout_path,
+                                      layout_id + '.shapes'))
+    words = []
+    cumulative = []
+    total = 0.
+    template = decoder.templates.template
+    for word in decoder.words:
+        entry = template(word)
+        # a gesture on a single key is a key press
+        if entry is None or len(set(word)) < 2:
+            continue
+        total += entry[0].frequencies[entry[1]]
+        words.append(word)
+        cumulative.append(total)
+    return decoder, words, cumulative
+
+
+def empty_result(top):
+    return {'gestures': 0, 'ranks': [0] * (top + 1),
+            'latency': {'counts': [0] * (len(latency_bins) + 1),
+                        'total': 0., 'max': 0.}}
+
+
+def merge(result, other):
+    '''Add the histograms of `other` to `result`.'''
+    result['gestures'] += other['gestures']
+    result['ranks'] = [a + b for a, b in zip(result['ranks'], other['ranks'])]
+    latency, other_latency = result['latency'], other['latency']
+    latency['counts'] = [a + b for a, b in zip(latency['counts'],
+                                               other_latency['counts'])]
+    latency['total'] += other_latency['total']
+    latency['max'] = max(latency['max'], other_latency['max'])
+    return result
+
+
+def run_chunk(task):
+    '''Decode the gestures of the chunk `task`, a (layout id, chunk index,
+    number of gestures) tuple, and return (layout id, chunk index, result).
+    '''
+    layout_id, chunk, count = task
+    args = _args
+    decoder, words, cumulative = _layouts[layout_id]
+    rnd = random.Random('%d/%s/%d' % (args.seed, layout_id, chunk))
+    sx = decoder.key_width * args.noise
+    sy = decoder.key_height * args.noise
+    total = cumulative[-1]
+    result = empty_result(args.top)
+    ranks = result['ranks']
+    latency = result['latency']
+    for i in xrange(count):
+        word = words[min(bisect_right(cumulative, rnd.random() * total),
+                         len(words) - 1)]
+        gesture = [(x + rnd.gauss(0, sx), y + rnd.gauss(0, sy))
+                   for x, y in decoder.word_sample_n(word, 40)]
+        decoder.gesture_cache.clear()
+        start = time()
+        ranking = [w for w, p in decoder.candidate_matches(gesture, '')
+                   [:args.top]]
+        elapsed = time() - start
+        ranks[ranking.index(word) if word in ranking else args.top] += 1
+        latency['counts'][bisect_left(latency_bins, elapsed)] += 1
+        latency['total'] += elapsed
+        latency['max'] = max(latency['max'], elapsed)
+    result['gestures'] = count
+    return layout_id, chunk, result
+
+
+def read_checkpoint(fn, config):
+    '''Return the dict of (layout id, chunk index) to result of the chunks
+    recorded in the checkpoint file `fn` by a run with the same `config`.
+    A last line truncated by an interrupted run is cut from the file, so the
+    next records start on a line of their own.
+    '''
+    done = {}
+    if not exists(fn):
+        return done
+    with open(fn, 'rb') as fd:
+        data = fd.read()
+    end = data.rfind(b'\n') + 1
+    if end < len(data):
+        with open(fn, 'r+b') as fd:
+            fd.truncate(end)
+    lines = data[:end].decode('utf-8').splitlines()
+    if not lines:
+        return done
+    if json.loads(lines[0]) != config:
+        sys.exit('simulate: %s was written with other options, remove it '
+                 'to start over' % fn)
+    for line in lines[1:]:
+        try:
+            layout_id, chunk, result = json.loads(line)
+        except ValueError:
+            # the last line of an interrupted run may be truncated
+            continue
+        done[(layout_id, chunk)] = result
+    return done
+
+
+def summarize(result, top):
+    '''Return the accuracy and latency figures of a merged `result`.'''
+    n = float(max(result['gestures'], 1))
+    ranks = result['ranks']
+    latency = result['latency']
+
+    def percentile(q):
+        # upper edge of the bin holding the q-quantile
+        position = q * result['gestures']
+        seen = 0
+        for edge, count in zip(latency_bins + (latency['max'], ),
+                               latency['counts']):
+            seen += count
+            if seen >= position:
+                return min(edge, latency['max'])
+        return latency['max']
+
+    return {'gestures': result['gestures'],
+            'top1': ranks[0] / n,
+            'top%d' % top: sum(ranks[:top]) / n,
+            'mean_rank': sum(i * c for i, c in enumerate(ranks[:top])) /
+                float(max(sum(ranks[:top]), 1)),
+            'mean': latency['total'] / n,
+            'p50': percentile(.5),
+            'p95': percentile(.95),
+            'max': latency['max']}
+
+
+def report(name, summary, top):
+    print('%s: %d gestures, top-1 %.3f, top-%d %.3f, mean %.2f ms, '
+          'p50 < %.1f ms, p95 < %.1f ms, max %.1f ms' % (
+              name, summary['gestures'], summary['top1'], top,
+              summary['top%d' % top], summary['mean'] * 1000,
+              summary['p50'] * 1000, summary['p95'] * 1000,
+              summary['max'] * 1000))
+
+
+def main(argv):
+    global _args
+    parser = argparse.ArgumentParser(
+        description='Evaluate the decoder on synthetic gestures.')
+    parser.add_argument('--layout-path', default='.',
+        help='directory holding the layouts and lexicon files')
+    parser.add_argument('--layouts', nargs='*',
+        help='layout ids, by default every layout of the layout path')
+    parser.add_argument('--gestures', type=int, default=10000,
+        help='number of gestures per layout')
+    parser.add_argument('--chunk', type=int, default=500,
+        help='number of gestures per task')
+    parser.add_argument('--workers', type=int,
+        default=multiprocessing.cpu_count())
+    parser.add_argument('--noise', type=float, default=.2,
+        help='noise of the gestures, in key sizes')
+    parser.add_argument('--search', choices=('templates', 'beam', 'clusters'),
+        default='templates', help='gesture search of the decoder')
+    parser.add_argument('--top', type=int, default=5,
+        help='number of ranks of the rank histogram')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--checkpoint', default='simulation.ckpt',
+        help='file recording the finished chunks')
+    parser.add_argument('-o', '--output', default='simulation.json')
+    args = parser.parse_args(argv)
+
+    layouts = args.layouts or sorted(
+        splitext(basename(fn))[0]
+        for fn in glob(join(args.layout_path, '*.json')))
+    config = {'layouts': layouts, 'gestures': args.gestures,
+              'chunk': args.chunk, 'noise': args.noise,
+              'search': args.search, 'top': args.top, 'seed': args.seed}
+    done = read_checkpoint(args.checkpoint, config)
+
+    tasks = []
+    for layout_id in layouts:
+        for chunk, first in enumerate(xrange(0, args.gestures, args.chunk)):
+            if (layout_id, chunk) not in done:
+                tasks.append((layout_id, chunk,
+                              min(args.chunk, args.gestures - first)))
+    print('%d chunks done, %d to run on %d workers' % (
+        len(done), len(tasks), args.workers))
+
+    if tasks:
+        _args = args
+        start = time()
+        for layout_id in set(task[0] for task in tasks):
+            _layouts[layout_id] = load_layout(args, layout_id)
+        print('layouts loaded in %.1f s' % (time() - start))
+
+        new = not exists(args.checkpoint) or getsize(args.checkpoint) == 0
+        with open(args.checkpoint, 'a') as fd:
+            if new:
+                fd.write(json.dumps(config) + '\n')
+            start = time()
+            pool = multiprocessing.Pool(args.workers)
+            try:
+                for i, (layout_id, chunk, result) in enumerate(
+                        pool.imap_unordered(run_chunk, tasks)):
+                    done[(layout_id, chunk)] = result
+                    fd.write(json.dumps([layout_id, chunk, result]) + '\n')
+                    fd.flush()
+                    elapsed = time() - start
+                    sys.stdout.write('\r%d/%d chunks, %.0f gestures/s' % (
+                        i + 1, len(tasks),
+                        (i + 1) * args.chunk / max(elapsed, 1e-9)))
+                    sys.stdout.flush()
+            except KeyboardInterrupt:
+                sys.exit('\nsimulate: interrupted, run the same command to '
+                         'resume')
+            finally:
+                # all the results are in, or a worker failed: stop the
+                # workers either way
+                pool.terminate()
+                pool.join()
+            print('')
+
+    merged = {}
+    total = empty_result(args.top)
+    for (layout_id, chunk), result in sorted(done.items()):
+        merge(merged.setdefault(layout_id, empty_result(args.top)), result)
+        merge(total, result)
+    summaries = dict((layout_id, summarize(result, args.top))
+                     for layout_id, result in merged.items())
+    with open(args.output, 'w') as fd:
+        json.dump({'config': config, 'latency_bins': latency_bins,
+                   'layouts': merged, 'summaries': summaries,
+                   'total': total,
+                   'summary': summarize(total, args.top)},
+                  fd, indent=1, sort_keys=True)
+    for layout_id in layouts:
+        if layout_id in summaries:
+            report(layout_id, summaries[layout_id], args.top)
+    report('all', summarize(total, args.top), args.top)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,84 @@
+'''
+Trail
+=====
+
+Rendering of the trail of a swipe on the :class:`~vkeyboard.VKeyboard`.
+
+A :class:`GestureTrail` keeps two views of a gesture: :data:`points`, every
+point of the touch at full resolution, which the decoder gets, and the
+drawn trail, only the last :data:`max_points` points kept in a ring buffer.
+The trail is split in a few lines, the older ones more transparent, so it
+fades out behind the finger. However long or slow the swipe, the lines hold
+at most :data:`max_points` vertices, so redrawing them costs the same every
+frame::
+
+    trail = GestureTrail(widget.canvas, touch.pos)
+    trail.add_point(x, y)
+    ...
+    trail.remove()
+    decode(trail.points)
+'''
+
+__all__ = ('GestureTrail', )
+
+from collections import deque
+
+from kivy.graphics import Color, InstructionGroup, Line
+
+
+class GestureTrail(object):
+    '''Fading trail of a swipe starting at `pos`, drawn on `canvas`.
+
+    :Parameters:
+        `color`: tuple
+            RGB color of the trail.
+        `width`: float
+            Width of the lines.
+        `max_points`: int
+            Number of recent points drawn.
+        `segments`: int
+            Number of lines the drawn points are split into, from the most
+            transparent to the opaque one ending at the last point.
+    '''
+
+    def __init__(self, canvas, pos, color=(0.5, 0.6, 1), width=2,
+                 max_points=64, segments=4):
+        self.canvas = canvas
+        self.points = [tuple(pos)]
+        self.recent = deque(self.points, max(int(max_points), 2))
+        self.group = InstructionGroup()
+        self.lines = []
+        for i in xrange(segments):
+            self.group.add(Color(color[0], color[1], color[2],
+                                 (i + 1.) / segments))
+            line = Line(points=[], width=width)
+            self.group.add(line)
+            self.lines.append(line)
+        canvas.add(self.group)
+        self.update()
+
+    @property
+    def max_points(self):
+        return self.recent.maxlen
+
+    def add_point(self, x, y):
+        self.points.append((x, y))
+        self.recent.append((x, y))
+        self.update()
+
+    def update(self):
+        '''Split the recent points between the lines. Consecutive lines
+        share a point, so the trail has no gap.
+        '''
+        recent = list(self.recent)
+        last = len(recent) - 1
+        count = len(self.lines)
+        for i, line in enumerate(self.lines):
+            start = i * last // count
+            end = (i + 1) * last // count
+            line.points = [c for point in recent[start:end + 1]
+                           for c in point] if end > start else []
+
+    def remove(self):
+        '''Remove the trail from its canvas.'''
+        self.canvas.remove(self.group)
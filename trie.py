@@ -31,6 +31,9 @@ class Trie:
         node.word = word
         node.value = value
     
+    def __len__(self):
+        return len(self.words)
+
     def __iter__(self):
         return iter(self.words)
         #S = []
@@ -41,6 +44,27 @@ class Trie:
         #        yield node.word
         #    S.extend(node.children.values())
     
+    def iter_prefix(self, prefix):
+        node = self.trie
+        for letter in prefix:
+            if letter not in node.children:
+                return
+            node = node.children[letter]
+        S = [node]
+        while len(S) > 0:
+            node = S.pop()
+            if node.word is not None:
+                yield node.word
+            S.extend(node.children.values())
+
+    def nodes(self, prefix):
+        node = self.trie
+        for letter in prefix:
+            if letter not in node.children:
+                return []
+            node = node.children[letter]
+        return [node]
+
     def search_correction(self, word, maxCost):
         currentRow = range( len(word) + 1 )
         results = []
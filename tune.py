@@ -0,0 +1,178 @@
+#!/usr/bin/python
+'''
+Tune
+====
+
+Sweep the pruning and scoring parameters of the gesture decoder, see
+:data:`~decoder.default_tuning`, over recorded or synthetic gestures, and
+report the latency/accuracy Pareto front::
+
+    # gestures of a gesturelog file
+    python tune.py qwerty --log gestures.log
+    # synthetic gestures: frequent words swiped along their key path, with
+    # gaussian noise of a fraction of a key
+    python tune.py qwerty --synthetic 200 --noise .2
+
+Accuracy is the top-1 agreement with the chosen (or synthesized) word,
+latency the mean decoding time. The chosen setting, the most accurate one
+within `--max-latency` if given, is written to the section of the layout in
+the `--config` file, which the :class:`~vkeyboard.VKeyboard` reads when it
+loads the layout, see :func:`~decoder.read_tuning`.
+'''
+
+import argparse
+import random
+import sys
+from itertools import product
+from os.path import join
+from time import time
+
+from decoder import default_tuning, template_size, write_tuning
+from gesturelog import read_gestures
+from replay import load_decoder
+
+default_config = 'decoder.ini'
+
+# values swept for each parameter
+default_grid = {'start_window': (.75, 1., 1.25),
+                'end_window': (.75, 1., 1.25),
+                'length_ratio': ((.8, 1.4), (.7, 1.6), (.9, 1.25)),
+                'distance_weight': (.25, .5, 1.)}
+
+
+def recorded_gestures(fn, layout_id):
+    '''Return the (gesture in layout units, previous word, chosen word) of
+    the gestures of the gesturelog file `fn` made on `layout_id`.
+    '''
+    gestures = []
+    for record in read_gestures(fn):
+        if record.layout != layout_id or not record.chosen:
+            continue
+        sx = template_size[0] / record.size[0]
+        sy = template_size[1] / record.size[1]
+        gestures.append(([(x * sx, y * sy) for x, y in record.points],
+                         record.prev_word, record.chosen.lower()))
+    return gestures
+
+
+def synthetic_gestures(decoder, count, noise, seed=0, vocabulary=2000):
+    '''Return `count` (gesture, previous word, word) of words drawn among
+    the `vocabulary` most frequent ones, swiped along their key path with
+    gaussian noise of `noise` key sizes.
+    '''
+    rnd = random.Random(seed)
+    templates = decoder.templates
+    words = []
+    for letter in sorted(decoder.key_centers):
+        words.extend(templates.by_frequency(letter)[0][:vocabulary // 26 + 1])
+    words = [w for w in words if len(w) > 1]
+    sx = decoder.key_width * noise
+    sy = decoder.key_height * noise
+    gestures = []
+    for i in xrange(count):
+        word = rnd.choice(words)
+        gesture = [(x + rnd.gauss(0, sx), y + rnd.gauss(0, sy))
+                   for x, y in decoder.word_sample_n(word, 40)]
+        gestures.append((gesture, '', word))
+    return gestures
+
+
+def evaluate(decoder, gestures, tuning):
+    '''Return the (mean latency, top-1 accuracy) of `decoder` with `tuning`
+    on `gestures`.
+    '''
+    decoder.set_tuning(tuning)
+    hits = 0
+    elapsed = 0.
+    for gesture, prev_word, word in gestures:
+        decoder.gesture_cache.clear()
+        start = time()
+        matches = decoder.candidate_matches(gesture, prev_word)
+        elapsed += time() - start
+        if matches and matches[0][0] == word:
+            hits += 1
+    count = float(max(len(gestures), 1))
+    return elapsed / count, hits / count
+
+
+def pareto_front(results):
+    '''Return the (latency, accuracy, tuning) results no other result beats
+    on both latency and accuracy, fastest first.
+    '''
+    front = []
+    for result in sorted(results, key=lambda r: (r[0], -r[1])):
+        if not front or result[1] > front[-1][1]:
+            front.append(result)
+    return front
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Tune the gesture decoder pruning and scoring.')
+    parser.add_argument('layout', help='layout id')
+    parser.add_argument('--layout-path', default='.',
+        help='directory holding the layouts and lexicon files')
+    parser.add_argument('--log', help='gesturelog file of recorded gestures')
+    parser.add_argument('--synthetic', type=int, default=100,
+        help='number of synthetic gestures, when no log is given')
+    parser.add_argument('--noise', type=float, default=.2,
+        help='noise of the synthetic gestures, in key sizes')
+    parser.add_argument('--search', choices=('templates', 'beam', 'clusters'),
+        default='templates', help='gesture search to tune')
+    parser.add_argument('--max-latency', type=float,
+        help='largest accepted mean latency of the chosen setting, in ms')
+    parser.add_argument('--config', default=default_config,
+        help='config file to write the chosen setting to')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+        help="report only, don't write the config")
+    args = parser.parse_args(argv)
+
+    decoder = load_decoder(args.layout_path, args.layout)
+    decoder.gesture_search = args.search
+    if args.search == 'clusters':
+        decoder.load_shape_index(join(args.layout_path, args.layout + '.shapes'))
+    if args.log:
+        gestures = recorded_gestures(args.log, args.layout)
+    else:
+        gestures = synthetic_gestures(decoder, args.synthetic, args.noise)
+    if not gestures:
+        sys.exit('tune: no gesture for layout %s' % args.layout)
+
+    # the first pass loads the lexicon shards the gestures need, keep it out
+    # of the timings
+    evaluate(decoder, gestures, default_tuning)
+    baseline = evaluate(decoder, gestures, default_tuning)
+    results = []
+    grid = default_grid
+    for start_window, end_window, (min_ratio, max_ratio), weight in product(
+            grid['start_window'], grid['end_window'], grid['length_ratio'],
+            grid['distance_weight']):
+        tuning = {'start_window': start_window, 'end_window': end_window,
+                  'min_length_ratio': min_ratio,
+                  'max_length_ratio': max_ratio, 'distance_weight': weight}
+        latency, accuracy = evaluate(decoder, gestures, tuning)
+        results.append((latency, accuracy, tuning))
+
+    print('%d gestures, %d settings' % (len(gestures), len(results)))
+    print('default: %.2f ms, top-1 %.3f' % (baseline[0] * 1000, baseline[1]))
+    print('pareto front:')
+    front = pareto_front(results)
+    for latency, accuracy, tuning in front:
+        print('  %7.2f ms  top-1 %.3f  %s' % (
+            latency * 1000, accuracy,
+            ' '.join('%s=%g' % item for item in sorted(tuning.items()))))
+
+    candidates = front
+    if args.max_latency is not None:
+        candidates = [r for r in front if r[0] * 1000 <= args.max_latency]
+        if not candidates:
+            sys.exit('tune: no setting within %.2f ms' % args.max_latency)
+    latency, accuracy, tuning = max(candidates, key=lambda r: (r[1], -r[0]))
+    print('chosen: %.2f ms, top-1 %.3f' % (latency * 1000, accuracy))
+    if not args.dry_run:
+        write_tuning(args.config, args.layout, tuning)
+        print('written to [%s] in %s' % (args.layout, args.config))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -87,6 +87,19 @@ Finally, complete the JSON::
         ...
     }
 
+A layout can also name the lexicon its words are decoded with, see
+:func:`~layouts.layout_lexicon`. Paths are relative to the layout file::
+
+    {
+        ...
+        "lexicon": {"nograms": "fr.0grams", "unigrams": "fr.1grams",
+                    "bigrams": "fr.2grams"}
+    }
+
+The lexicon is loaded when the layout is first used, and released when no
+keyboard uses it anymore and it isn't one of the few most recently used
+ones, see :mod:`lexicon`.
+
 
 Request Keyboard
 ----------------
@@ -121,7 +134,7 @@ from kivy.uix.label import Label
 from kivy.properties import ObjectProperty, NumericProperty, StringProperty, \
     BooleanProperty, DictProperty, OptionProperty, ListProperty
 from kivy.logger import Logger
-from kivy.graphics import Color, BorderImage, Canvas, Line
+from kivy.graphics import Color, BorderImage, Canvas
 from kivy.core.image import Image
 from kivy.resources import resource_find
 from kivy.clock import Clock
@@ -129,13 +142,22 @@ from kivy.uix.textinput import TextInput
 from kivy.uix.floatlayout import FloatLayout
 #from kivy.uix.settings import Settings
 
-from os.path import join, splitext, basename
+from bisect import bisect_right
+from functools import partial
+from os.path import join, splitext, basename, exists
 from os import listdir
-from json import loads
-
-from math import exp
-
-import trie
+from sys import getsizeof
+
+from backends import create_decoder, ShadowComparison, ShadowStats
+from decoder import Decoder, template_size, default_time_budget, \
+    default_cluster_recall, default_autocorrect_budget, \
+    default_autocorrect_confidence, default_autocorrect_margin, read_tuning
+from layouts import layout_hints, layout_lines, layout_lexicon, LayoutCache
+from gesturelog import GestureRecorder
+from memory import decoder_usage, deep_sizeof, total_usage
+from profiler import Profiler
+from trail import GestureTrail
+from worker import get_decode_worker, get_shadow_worker
 
 #default_layout_path = join(kivy_data_dir, 'keyboards')
 default_layout_path = '.'
@@ -191,13 +213,35 @@ class VKeyboard(Scatter):
     '''
 
     available_layouts = DictProperty({})
-    '''Dictionary of all available layouts. Keys are the layout ID, and the
+    '''Dictionary of the loaded layouts. Keys are the layout ID, and the
     value is the JSON (translated into a Python object).
 
+    Layouts found in :data:`layout_path` are only listed in
+    :attr:`layout_files` until they are first used, see :meth:`load_layout`.
+
     :data:`available_layouts` is a :class:`~kivy.properties.DictProperty` and
     defaults to {}.
     '''
 
+    layout_cache_path = StringProperty('')
+    '''Directory where the parsed layouts and their geometry are cached, see
+    :class:`~layouts.LayoutCache`. If empty, the `layouts` directory of the
+    user cache directory is used, see :func:`~layouts.user_cache_path`.
+
+    :data:`layout_cache_path` is a :class:`~kivy.properties.StringProperty`
+    and defaults to ''.
+    '''
+
+    decoder_config = StringProperty('decoder.ini')
+    '''Config file holding the pruning and scoring parameters of the
+    :data:`decoder` for each layout, one section per layout id, as written
+    by `tune.py`. Layouts without a section use
+    :data:`~decoder.default_tuning`.
+
+    :data:`decoder_config` is a :class:`~kivy.properties.StringProperty` and
+    defaults to `decoder.ini`.
+    '''
+
     docked = BooleanProperty(False)
     '''Indicate whether the VKeyboard is docked on the screen or not. If you
     change it, you must manually call :meth:`setup_mode` otherwise it will have
@@ -319,6 +363,138 @@ class VKeyboard(Scatter):
     defaults to [16, 16, 16, 16]
     '''
 
+    async_decoding = BooleanProperty(True)
+    '''If True, gestures, predictions and guesses are decoded on the
+    :class:`~worker.DecodeWorker` threads shared by all the keyboards and the
+    results are applied on the next frame, so the UI never waits for the
+    decoder. The gestures of a keyboard are decoded one after the other, each
+    once the input before it is applied, so that it is decoded with the word
+    of the previous gesture as context; the gestures of different keyboards
+    are decoded concurrently. Input received while a gesture is waiting or
+    being decoded is applied after its word, and makes any pending
+    suggestions stale: the keys, the Ctrl shortcuts and the key releases
+    dispatched as `on_key_up` all wait for it.
+
+    :data:`async_decoding` is a :class:`~kivy.properties.BooleanProperty` and
+    defaults to True.
+    '''
+
+    anytime_decoding = BooleanProperty(False)
+    '''If True, a gesture search stops scoring candidates once
+    :data:`decode_time_budget` is spent, and suggests the best words found so
+    far, most frequent words being scored first. See
+    :meth:`~decoder.Decoder.anytime_matches`.
+
+    :data:`anytime_decoding` is a :class:`~kivy.properties.BooleanProperty`
+    and defaults to False.
+    '''
+
+    decode_time_budget = NumericProperty(default_time_budget)
+    '''Time budget of a gesture search in anytime mode, in seconds.
+
+    :data:`decode_time_budget` is a :class:`~kivy.properties.NumericProperty`
+    and defaults to 0.016, one frame at 60 fps.
+    '''
+
+    gesture_search = OptionProperty('templates',
+                                    options=('templates', 'beam', 'clusters'))
+    '''Gesture search of the decoder: 'templates' compares the gesture to
+    the templates of the words that fit its start, end and length, 'beam'
+    walks the lexicon trie along the gesture, see :mod:`beam`, 'clusters'
+    compares it to the templates of the nearest clusters of the shape index
+    of the layout, the `.shapes` file next to the layout file, see
+    :mod:`shapeindex`. Without a shape index, 'clusters' falls back to
+    'templates'.
+
+    :data:`gesture_search` is an :class:`~kivy.properties.OptionProperty`
+    and defaults to 'templates'.
+    '''
+
+    cluster_recall = NumericProperty(default_cluster_recall)
+    '''Recall of the 'clusters' :data:`gesture_search`, relative to the
+    'templates' one, as measured when the shape index was built. Higher
+    values score more clusters.
+
+    :data:`cluster_recall` is a :class:`~kivy.properties.NumericProperty`
+    and defaults to 0.95.
+    '''
+
+    decoder_backend = StringProperty('')
+    '''Name of the decoder backend, see :mod:`backends`. If empty, it is
+    read from the `keyboard_decoder` token of the `[kivy]` section of the
+    configuration, 'default' if there is none. Changing it replaces the
+    :data:`decoder`, keeping the words learned so far.
+
+    :data:`decoder_backend` is a :class:`~kivy.properties.StringProperty`
+    and defaults to ''.
+    '''
+
+    shadow_backend = StringProperty('')
+    '''Name of a decoder backend run in the shadow of the :data:`decoder`:
+    every gesture is also decoded by it in the background, and its latency
+    and ranking are compared with the primary ones in :data:`shadow_stats`
+    and logged. Its results are never shown. The shadow decoding starts once
+    the primary result is delivered, on the low priority worker of
+    :func:`~worker.get_shadow_worker`, so that it doesn't compete with the
+    decodings the users wait for. Empty to disable.
+
+    :data:`shadow_backend` is a :class:`~kivy.properties.StringProperty`
+    and defaults to ''.
+    '''
+
+    trail_points = NumericProperty(64)
+    '''Number of recent points of a swipe drawn in its trail. The decoder
+    always gets all the points of the swipe, see :class:`~trail.GestureTrail`.
+
+    :data:`trail_points` is a :class:`~kivy.properties.NumericProperty` and
+    defaults to 64.
+    '''
+
+    autocorrect = BooleanProperty(False)
+    '''If True, a tapped word is replaced by its best correction when it is
+    committed with a space or a punctuation, if the correction is confident
+    enough, see :meth:`~decoder.Decoder.autocorrect`. The correction is
+    learned. A backspace or Ctrl+Z right after it restores the word as typed
+    and learns that word instead, so it is never corrected again.
+
+    :data:`autocorrect` is a :class:`~kivy.properties.BooleanProperty` and
+    defaults to False.
+    '''
+
+    autocorrect_budget = NumericProperty(default_autocorrect_budget)
+    '''Time budget of the autocorrection of a committed word, in seconds.
+    The correction runs on the UI thread, before the space or punctuation is
+    inserted; a search that doesn't finish in time leaves the word as typed.
+
+    :data:`autocorrect_budget` is a :class:`~kivy.properties.NumericProperty`
+    and defaults to 0.008.
+    '''
+
+    autocorrect_confidence = NumericProperty(default_autocorrect_confidence)
+    '''Share of the scores of all the corrections of a word its best
+    correction needs to replace it.
+
+    :data:`autocorrect_confidence` is a
+    :class:`~kivy.properties.NumericProperty` and defaults to 0.8.
+    '''
+
+    autocorrect_margin = NumericProperty(default_autocorrect_margin)
+    '''How many times the score of the typed word its best correction needs
+    to replace it, so that a rare but valid word is kept.
+
+    :data:`autocorrect_margin` is a :class:`~kivy.properties.NumericProperty`
+    and defaults to 100.
+    '''
+
+    user_id = StringProperty('')
+    '''Name of the user of this keyboard in the decoding latency metrics,
+    see :meth:`~worker.DecodeWorker.latency_stats`. When empty, the keyboard
+    is named `vkeyboard-<uid>`.
+
+    :data:`user_id` is a :class:`~kivy.properties.StringProperty` and
+    defaults to ''.
+    '''
+
     # XXX internal variables
     layout_mode = OptionProperty('normal', options=('normal', 'shift', 'capslock'))
     layout_geometry = DictProperty({})
@@ -343,6 +519,9 @@ class VKeyboard(Scatter):
             self._load_layouts)
         self._trigger_load_layout = Clock.create_trigger(
             self._load_layout)
+        self.layout_files = {}
+        self._layout_entries = {}
+        self._hints_mode = 'normal'
         self.bind(
             docked=self.setup_mode,
             have_shift=self._trigger_update_layout_mode,
@@ -350,13 +529,13 @@ class VKeyboard(Scatter):
             layout_path=self._trigger_load_layouts,
             layout=self._trigger_load_layout)
         super(VKeyboard, self).__init__(**kwargs)
+        self.layout_cache = LayoutCache(self.layout_cache_path)
         
-        # load all the layouts found in the layout_path directory
+        # list all the layouts found in the layout_path directory
         self._load_layouts()
 
         # ensure we have default layouts
-        available_layouts = self.available_layouts
-        if not available_layouts:
+        if not self.layout_files and not self.available_layouts:
             Logger.critical('VKeyboard: unable to load default layouts')
 
         # load the default layout from configuration
@@ -378,38 +557,40 @@ class VKeyboard(Scatter):
         self.refresh_keys_hint()
         self.refresh_keys()
         
-        self.key_width, self.key_height = self.layout_geometry['LINE_3'][1][1]
-        
-        layout = self.available_layouts[self.layout]
-        self.key_centers = {}
-        for r in xrange(1, layout['rows'] + 1):
-            row = layout['%s_%d' % (self.layout_mode, r)]
-            row_geom = self.layout_geometry['LINE_%d' % r]
-            for c, ((x, y), (w, h)) in zip(row, row_geom):
-                if c[0].isalpha():
-                    self.key_centers[c[0]] = (x + w * 0.5, y + h * 0.5)
-        
-        self.words = trie.Trie()
-        
-        with open('0grams') as nograms:
-            total = float(nograms.read())
-        
-        with open('1grams') as unigrams:
-            for line in unigrams:
-                w, c = line[:-1].split('\t', 1)
-                if w.isalpha():
-                    self.words[w.lower()] = self.val_dist(tuple(map(self.key_centers.__getitem__, w.lower()))) + (float(c) / total,)
+        self.profiler = None
+        self.recorder = None
+        self._memory_report = None
+        self._memory_request = None
+        self.decode_worker = get_decode_worker()
+        self.shadow_worker = get_shadow_worker()
+        self._suggestion_request = None
+        self._input_queue = []
+        self._autocorrection = None
+        if not self.decoder_backend:
+            self.decoder_backend = Config.getdefault(
+                'kivy', 'keyboard_decoder', 'default')
+        self.decoder = self._create_decoder(self.decoder_backend)
+        self.shadow_decoder = None
+        if self.shadow_backend:
+            self.shadow_decoder = self._create_decoder(self.shadow_backend)
+        self.shadow_stats = ShadowStats()
+        self._lexicon = None
+        self._shape_index_layout = None
+        self.reload_layout()
+        self.bind(size=self._clear_gesture_cache,
+                  anytime_decoding=self._update_decoder_options,
+                  decode_time_budget=self._update_decoder_options,
+                  gesture_search=self._update_decoder_options,
+                  cluster_recall=self._update_decoder_options,
+                  decoder_backend=self._switch_backend,
+                  shadow_backend=self._switch_shadow_backend)
+        self._update_decoder_options()
         
         self.labels = []
         
         #self.config = ConfigParser()
         #self.config.read('settings.ini')
         
-        self.user_nograms = 1
-        self.user_unigrams = {'the':1}
-        self.user_bigrams = {}
-        self.user_paths = {}
-        
         '''import random
         for word in random.sample(self.words.keys(), 10):
             print word
@@ -432,99 +613,277 @@ class VKeyboard(Scatter):
         print 1 - count / 10000.'''
     
     def reload_layout(self):
-        layout = self.available_layouts[self.layout]
-        self.key_centers = {}
-        for r in xrange(1, layout['rows'] + 1):
-            row = layout['%s_%d' % (self.layout_mode, r)]
-            row_geom = self.layout_geometry['LINE_%d' % r]
-            for c, ((x, y), (w, h)) in zip(row, row_geom):
-                if c[0].isalpha():
-                    self.key_centers[c[0]] = (x + w * 0.5, y + h * 0.5)
-    
-        words = trie.Trie()
-        for word in self.words:
-            words[word] = self.val_dist(tuple(map(self.key_centers.__getitem__, word))) + (self.words[word][-1],)
-        self.words = words
+        '''Update the gesture templates of the :data:`decoder` for the
+        current layout, loading the lexicon of the layout if it changed.
+        '''
+        lexicon = layout_lexicon(self.load_layout(),
+                                 self.layout_files.get(self.layout))
+        changed = lexicon != self._lexicon
+        self._lexicon = lexicon
+        for decoder in (self.decoder, self.shadow_decoder):
+            if decoder is not None:
+                self._setup_decoder(decoder, changed)
+        self._shape_index_layout = None
+        if self.gesture_search == 'clusters':
+            self._load_shape_index()
+        if self.profiler is not None:
+            self._attach_profiler()
     
+    def _setup_decoder(self, decoder, load_lexicon=True):
+        # set the layout, tuning and lexicon of the current layout
+        if load_lexicon:
+            # detach first, not to build templates of the previous lexicon
+            # for the new geometry
+            decoder.unload_words()
+        decoder.set_layout(self.layout_geometry)
+        decoder.set_tuning(read_tuning(self.decoder_config, self.layout))
+        if load_lexicon:
+            decoder.load_lexicon(self._lexicon)
+
+    def _create_decoder(self, name):
+        try:
+            return create_decoder(name)
+        except ValueError as e:
+            Logger.error('VKeyboard: %s, fallback on the default decoder' % e)
+            return Decoder()
+
+    def _switch_backend(self, *largs):
+        decoder = self._create_decoder(self.decoder_backend)
+        decoder.copy_user_model(self.decoder)
+        self._setup_decoder(decoder)
+        # requests already submitted finish with the previous decoder
+        self.decoder = decoder
+        self._shape_index_layout = None
+        self._update_decoder_options()
+        if self.profiler is not None:
+            self._attach_profiler()
+
+    def _switch_shadow_backend(self, *largs):
+        self.shadow_decoder = None
+        self.shadow_stats.reset()
+        if self.shadow_backend:
+            decoder = self._create_decoder(self.shadow_backend)
+            decoder.copy_user_model(self.decoder)
+            self._setup_decoder(decoder)
+            self.shadow_decoder = decoder
+            self._shape_index_layout = None
+            self._update_decoder_options()
+
+    def to_layout_units(self, points):
+        '''Map a list of (x, y) points in widget coordinates to the layout
+        units used by the gesture templates.
+        '''
+        sx = template_size[0] / self.width
+        sy = template_size[1] / self.height
+        return [(x * sx, y * sy) for x, y in points]
+
     def get_text_area(self):
         return self.get_parent_window().children[1].children[0]
     
-    def val_dist(self, path):
-        tot = 0.0
-        for i in xrange(1, len(path)):
-            tot += ((path[i][0]-path[i-1][0])**2 + (path[i][1]-path[i-1][1])**2)**0.5
-        return (path, tot)
-    
-    def get_ngram_probability(self, word, prev_word):
-        nogram = self.user_nograms
-        bigram = self.user_bigrams.get((prev_word, word), 0)
-        unigram1 = self.user_unigrams.get(prev_word, 0)
-        unigram2 = self.user_unigrams.get(word, 0)
-        p = 0.4 * (bigram + 1) / (unigram1 + len(self.user_unigrams)) + 0.1 * (unigram2 + 1) / (nogram + len(self.user_unigrams))
-        p = p + 0.5 * self.words[word][2]
-        return p
-        
     def candidate_matches(self, gesture):
-        candidates = []
-        #g0 = self.get_key_at_pos(*gesture[0])[0][2]
-        #g1 = self.get_key_at_pos(*gesture[-1])[0][2]
-        gest_length = self.val_dist(gesture)[1]
-        prev_word = self.get_previous_word()
-        for word in self.words:
-            #if word[0] != g0 or word[-1] != g1:
-            #    continue
-            path = self.words[word]
-            if abs(path[0][0][0] - gesture[0][0]) > self.key_width or abs(path[0][0][1] - gesture[0][1]) > self.key_height:
-                continue
-            if abs(path[0][-1][0] - gesture[-1][0]) > self.key_width or abs(path[0][-1][1] - gesture[-1][1]) > self.key_height:
-                continue
-            if not 0.8*path[1] <= gest_length <= 1.4*path[1]:
-                continue
-            p = exp(-self.gesture_distance(gesture, word)/2) * self.get_ngram_probability(word, prev_word)
-            candidates.append((word, p))
-        candidates.sort(key=lambda x: x[1], reverse=True)
-        return candidates
+        '''Return the (word, probability) candidates for a gesture, best
+        first. The gesture must be given in layout units, see
+        :meth:`to_layout_units`.
+        '''
+        return self.decoder.candidate_matches(gesture, self.get_previous_word())
 
     def candidate_predictions(self, word):
-        prev_word = self.get_previous_word()
-        candidates = [(w, 0.001**d * self.get_ngram_probability(w, prev_word)) for (w, d) in self.words.search_prediction(word, 2)]
-        candidates.sort(key=lambda x: x[1], reverse=True)
-        return candidates
+        return self.decoder.candidate_predictions(word, self.get_previous_word())
 
     def candidate_corrections(self, word):
-        prev_word = self.get_previous_word()
-        candidates = [(w, 0.001**d * self.get_ngram_probability(w, prev_word)) for (w, d) in self.words.search_correction(word, 2)]
-        candidates.sort(key=lambda x: x[1], reverse=True)
-        return candidates
+        return self.decoder.candidate_corrections(word, self.get_previous_word())
     
     def candidate_guesses(self):
-        prev_word = self.get_previous_word()
-        candidates = [(w, self.get_ngram_probability(w, prev_word)) for w in self.words]
-        candidates.sort(key=lambda x: x[1], reverse=True)
-        return candidates
-        
-    def word_sample_n(self, word, n):
-        path = self.words[word][0]
-        cum_length = [0.0]
-        for i in xrange(1, len(path)):
-            cum_length.append(cum_length[-1] + ((path[i][0]-path[i-1][0])**2 + (path[i][1]-path[i-1][1])**2)**0.5)
-        import bisect
-        points = []
-        for k in range(n):
-            L = min(k * cum_length[-1] / (n - 1), cum_length[-1])
-            i = bisect.bisect_left(cum_length[1:], L)
-            if i >= len(path) - 1:
-                i -= 1
-            p = 0 if cum_length[i+1] == cum_length[i] else (L - cum_length[i]) / (cum_length[i+1] - cum_length[i])
-            x, y = path[i][0] + p * (path[i+1][0] - path[i][0]), path[i][1] + p * (path[i+1][1] - path[i][1])
-            points.append((x, y))
-        return points
-    
-    def gesture_distance(self, gesture, word):
-        n = len(gesture)
-        template = self.word_sample_n(word, n)
-        return sum(((x1-x2)**2 + (y1-y2)**2)**0.5 for ((x1, y1), (x2, y2)) in zip(gesture, template)) / n
+        return self.decoder.candidate_guesses(self.get_previous_word())
 
+    def enable_profiling(self, dump_path=None, dump_interval=10.):
+        '''Start recording per-stage timings of the decoding paths in
+        :data:`profiler`, a :class:`~profiler.Profiler`. If `dump_path` is
+        set, the statistics are also written there as JSON every
+        `dump_interval` seconds.
+        '''
+        if self.profiler is None:
+            self.profiler = Profiler()
+            self._attach_profiler()
+        if dump_path is not None:
+            Clock.unschedule(self._dump_profile)
+            self._profile_path = dump_path
+            Clock.schedule_interval(self._dump_profile, dump_interval)
+        return self.profiler
+
+    def disable_profiling(self):
+        '''Remove the instrumentation installed by :meth:`enable_profiling`.
+        The collected statistics remain available in the returned profiler.
+        '''
+        profiler = self.profiler
+        if profiler is None:
+            return None
+        Clock.unschedule(self._dump_profile)
+        profiler.detach()
+        self.profiler = None
+        return profiler
+
+    def _attach_profiler(self):
+        profiler = self.profiler
+        profiler.detach()
+        decoder = self.decoder
+        words = decoder.words
+        profiler.attach(self, ('update_candidates', ))
+        # the lexicon is shared with the other keyboards, only the methods
+        # of this decoder are wrapped
+        profiler.attach(decoder, (
+            'candidate_matches', 'candidate_predictions',
+            'candidate_corrections', 'candidate_guesses',
+            ('prune_matches', lambda: len(words), True),
+            ('search_prediction', lambda: len(words), True),
+            ('search_correction', lambda: len(words), False),
+            'gesture_distance', 'normalize', 'get_ngram_probability',
+            ('rank_candidates', None, True)))
+
+    def _dump_profile(self, *largs):
+        self.profiler.dump(self._profile_path)
+
+    def memory_usage(self):
+        '''Return a dict of component name to the estimated `bytes` and
+        number of `objects` it holds: the decoder structures, see
+        :func:`~memory.decoder_usage`, the parsed layouts (`layouts`), the
+        label widgets (`labels`) and the textures they and the keys are drawn
+        with (`textures`, estimated from their size at 4 bytes per pixel).
+        '''
+        usage = decoder_usage(self.decoder)
+        usage.update(self._widget_usage())
+        return usage
+
+    def _widget_usage(self):
+        # the memory_usage entries of the layouts and widgets, to compute on
+        # the main thread
+        usage = {}
+        size, objects = deep_sizeof((self.layout_cache.entries,
+                                     self._layout_entries,
+                                     dict(self.available_layouts)))
+        usage['layouts'] = {'bytes': size, 'objects': objects}
+
+        labels = [w for w in self.children if isinstance(w, Label)]
+        usage['labels'] = {'objects': len(labels), 'bytes': sum(
+            getsizeof(l) + getsizeof(l.__dict__) for l in labels)}
+
+        textures = {}
+        for layer in (self.background_key_layer, self.active_keys_layer):
+            for instruction in layer.children:
+                texture = getattr(instruction, 'texture', None)
+                if texture is not None:
+                    textures[id(texture)] = texture
+        for l in labels:
+            if l.texture is not None:
+                textures[id(l.texture)] = l.texture
+        size = 0
+        for texture in textures.values():
+            pixels = texture.width * texture.height
+            # a mipmapped texture holds its reduced copies too
+            size += pixels * 4 * (4 / 3. if texture.mipmap else 1)
+        usage['textures'] = {'objects': len(textures), 'bytes': int(size)}
+        return usage
+
+    def enable_memory_logging(self, interval=60.):
+        '''Log the :meth:`memory_usage` of the keyboard through the
+        :class:`~kivy.logger.Logger` every `interval` seconds, with the growth
+        of each component since the previous report. The decoder structures
+        are walked on the :data:`decode_worker`, which takes a fraction of a
+        second for a large lexicon, and the report is logged on the main
+        thread once they are.
+        '''
+        self.disable_memory_logging()
+        self._memory_report = None
+        Clock.schedule_interval(self._log_memory, interval)
+
+    def disable_memory_logging(self):
+        Clock.unschedule(self._log_memory)
+        if self._memory_request is not None:
+            self._memory_request.cancel()
+            self._memory_request = None
+
+    def _log_memory(self, *largs):
+        # skip a report while the previous one is still computed
+        if self._memory_request is None:
+            self._memory_request = self.decode_worker.submit(
+                self._decoder_usage, (self.decoder, ),
+                self._on_decoder_usage, owner='memory')
+
+    def _decoder_usage(self, decoder, cancelled=None):
+        # runs on a worker thread
+        return decoder_usage(decoder)
+
+    def _on_decoder_usage(self, usage):
+        self._memory_request = None
+        if not usage:
+            # the walk failed, the error was logged by the worker
+            return
+        usage.update(self._widget_usage())
+        previous = self._memory_report
+        self._memory_report = dict(usage)
+        names = sorted(usage, key=lambda name: -usage[name]['bytes'])
+        usage['total'] = total_usage(usage)
+        if previous is not None:
+            previous['total'] = total_usage(previous)
+        for name in ['total'] + names:
+            entry = usage[name]
+            line = 'VKeyboard: memory %s %.2f MB in %d objects' % (
+                name, entry['bytes'] / 1e6, entry['objects'])
+            if previous is not None and name in previous:
+                line += ' (%+.2f MB)' % (
+                    (entry['bytes'] - previous[name]['bytes']) / 1e6)
+            Logger.info(line)
+
+    def _update_decoder_options(self, *largs):
+        for decoder in (self.decoder, self.shadow_decoder):
+            if decoder is not None:
+                decoder.anytime = self.anytime_decoding
+                decoder.time_budget = self.decode_time_budget
+                decoder.gesture_search = self.gesture_search
+                decoder.cluster_recall = self.cluster_recall
+        if self.gesture_search == 'clusters':
+            self._load_shape_index()
+
+    def _load_shape_index(self):
+        # the shape index of a layout is the .shapes file next to its layout
+        # file, only looked up once per layout
+        if self.layout == self._shape_index_layout:
+            return
+        self._shape_index_layout = self.layout
+        fn = self.layout_files.get(self.layout)
+        fn = None if fn is None else splitext(fn)[0] + '.shapes'
+        decoders = [d for d in (self.decoder, self.shadow_decoder)
+                    if d is not None]
+        if fn is None or not exists(fn):
+            for decoder in decoders:
+                decoder.unload_shape_index()
+            Logger.warning('VKeyboard: no shape index for layout <%s>, '
+                           'using the template scan' % self.layout)
+            return
+        for decoder in decoders:
+            try:
+                decoder.load_shape_index(fn)
+            except ValueError as e:
+                decoder.unload_shape_index()
+                Logger.warning('VKeyboard: %s, using the template scan' % e)
+
+    def _clear_gesture_cache(self, *largs):
+        for decoder in (self.decoder, self.shadow_decoder):
+            if decoder is not None:
+                decoder.gesture_cache.clear()
+
+    def start_recording(self, fn):
+        '''Append every decoded gesture to the :mod:`gesturelog` file `fn`,
+        for offline replay.
+        '''
+        self.stop_recording()
+        self.recorder = GestureRecorder(fn)
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        
     def on_disabled(self, intance, value):
         self.refresh_keys()
 
@@ -547,25 +906,29 @@ class VKeyboard(Scatter):
 
         value = self.layout
         available_layouts = self.available_layouts
+        layout_files = self.layout_files
 
         # it's a filename, try to load it directly
         if self.layout[-5:] == '.json':
-            if value not in available_layouts:
+            if value not in available_layouts and value not in layout_files:
                 fn = resource_find(self.layout)
                 self._load_layout_fn(fn, self.layout)
 
-        if not available_layouts:
+        if not available_layouts and not layout_files:
             return
-        if value not in available_layouts and value != 'qwerty':
+        if value not in available_layouts and value not in layout_files \
+                and value != 'qwerty':
             Logger.error(
                 'Vkeyboard: <%s> keyboard layout mentioned in '
                 'conf file was not found, fallback on qwerty' %
                 value)
             self.layout = 'qwerty'
         self.refresh(True)
+        self.reload_layout()
 
     def _load_layouts(self, *largs):
-        # first load available layouts from json files
+        # first list available layouts from json files, they are parsed on
+        # first use
         # XXX fix to be able to reload layout when path is changing
         value = self.layout_path
         for fn in listdir(value):
@@ -573,13 +936,38 @@ class VKeyboard(Scatter):
                     basename(splitext(fn)[0]))
 
     def _load_layout_fn(self, fn, name):
-        available_layouts = self.available_layouts
         if fn[-5:] != '.json':
             return
-        with open(fn, 'r') as fd:
-            json_content = fd.read()
-            layout = loads(json_content)
-        available_layouts[name] = layout
+        self.layout_files[name] = fn
+
+    def _layout_entry(self, name):
+        # compiled layout of the layout file, None for the layouts added
+        # directly to available_layouts
+        fn = self.layout_files.get(name)
+        if fn is None:
+            return None
+        key = (fn, tuple(self.margin_hint))
+        entry = self._layout_entries.get(key)
+        if entry is None:
+            entry = self._layout_entries[key] = self.layout_cache.get(
+                fn, self.margin_hint)
+        return entry
+
+    def load_layout(self, name=None):
+        '''Return the layout `name`, by default the current :data:`layout`.
+        A layout file is parsed, or read from the :data:`layout_cache_path`
+        cache, and added to :data:`available_layouts` on first use.
+        '''
+        if name is None:
+            name = self.layout
+        layout = self.available_layouts.get(name)
+        if layout is None:
+            entry = self._layout_entry(name)
+            if entry is None:
+                raise KeyError(name)
+            layout = self.available_layouts[name] = \
+                self.layout_cache.layout(entry)
+        return layout
 
     def setup_mode(self, *largs):
         '''Call this method when you want to readjust the keyboard according to
@@ -694,76 +1082,34 @@ class VKeyboard(Scatter):
                         border=self.key_border)
 
     def refresh_keys_hint(self):
-        layout = self.available_layouts[self.layout]
-        layout_cols = layout['cols']
-        layout_rows = layout['rows']
+        layout = self.load_layout()
         layout_geometry = self.layout_geometry
-        mtop, mright, mbottom, mleft = self.margin_hint
-
-        # get relative EFFICIENT surface of the layout without external margins
-        el_hint = 1. - mleft - mright
-        eh_hint = 1. - mtop - mbottom
-        ex_hint = 0 + mleft
-        ey_hint = 0 + mbottom
-
-        # get relative unit surface
-        uw_hint = (1. / layout_cols) * el_hint
-        uh_hint = (1. / layout_rows) * eh_hint
-        layout_geometry['U_HINT'] = (uw_hint, uh_hint)
-
-        # calculate individual key RELATIVE surface and pos (without key margin)
-        current_y_hint = ey_hint + eh_hint
-        for line_nb in range(1, layout_rows + 1):
-            current_y_hint -= uh_hint
-            # get line_name
-            line_name = '%s_%d' % (self.layout_mode, line_nb)
-            line_hint = 'LINE_HINT_%d' % line_nb
-            layout_geometry[line_hint] = []
-            current_x_hint = ex_hint
-            # go through the list of keys (tuples of 4)
-            for key in layout[line_name]:
-                # calculate relative pos, size
-                layout_geometry[line_hint].append([
-                    (current_x_hint, current_y_hint),
-                    (key[3] * uw_hint, uh_hint)])
-                current_x_hint += key[3] * uw_hint
-
+        entry = self._layout_entry(self.layout)
+        if entry is not None and self.layout_mode in entry['hints']:
+            hints = entry['hints'][self.layout_mode]
+        else:
+            hints = layout_hints(layout, self.layout_mode, self.margin_hint)
+        layout_geometry.update(hints)
+        self._hints_mode = self.layout_mode
         self.layout_geometry = layout_geometry
 
     def refresh_keys(self):
-        layout = self.available_layouts[self.layout]
-        layout_rows = layout['rows']
+        layout = self.load_layout()
         layout_geometry = self.layout_geometry
-        w, h = self.size
-        kmtop, kmright, kmbottom, kmleft = self.key_margin
-        uw_hint, uh_hint = layout_geometry['U_HINT']
-
-        for line_nb in range(1, layout_rows + 1):
-            llg = layout_geometry['LINE_%d' % line_nb] = []
-            llg_append = llg.append
-            for key in layout_geometry['LINE_HINT_%d' % line_nb]:
-                x_hint, y_hint = key[0]
-                w_hint, h_hint = key[1]
-                kx = x_hint * w
-                ky = y_hint * h
-                kw = w_hint * w
-                kh = h_hint * h
-
-                # now adjust, considering the key margin
-                kx = int(kx + kmleft)
-                ky = int(ky + kmbottom)
-                kw = int(kw - kmleft - kmright)
-                kh = int(kh - kmbottom - kmtop)
-
-                pos = (kx, ky)
-                size = (kw, kh)
-                llg_append((pos, size))
+        entry = self._layout_entry(self.layout)
+        if entry is not None and self._hints_mode in entry['hints']:
+            lines = self.layout_cache.lines(entry, self._hints_mode,
+                                            self.size, self.key_margin)
+        else:
+            lines = layout_lines(layout_geometry, layout['rows'], self.size,
+                                 self.key_margin)
+        layout_geometry.update(lines)
 
         self.layout_geometry = layout_geometry
         self.draw_keys()
 
     def draw_keys(self):
-        layout = self.available_layouts[self.layout]
+        layout = self.load_layout()
         layout_rows = layout['rows']
         layout_geometry = self.layout_geometry
         layout_mode = self.layout_mode
@@ -827,7 +1173,7 @@ class VKeyboard(Scatter):
         x_hint = x / w
         # focus on the surface without margins
         layout_geometry = self.layout_geometry
-        layout = self.available_layouts[self.layout]
+        layout = self.load_layout()
         layout_rows = layout['rows']
         mtop, mright, mbottom, mleft = self.margin_hint
 
@@ -843,15 +1189,11 @@ class VKeyboard(Scatter):
             line_nb = 1
 
         # get the key within the line
-        key_index = ''
-        current_key_index = 0
-        for key in layout_geometry['LINE_HINT_%d' % line_nb]:
-            if x_hint >= key[0][0] and x_hint < key[0][0] + key[1][0]:
-                key_index = current_key_index
-                break
-            else:
-                current_key_index += 1
-        if key_index == '':
+        line_edges = layout_geometry['LINE_EDGES_%d' % line_nb]
+        key_index = bisect_right(line_edges, x_hint)
+        if key_index == len(line_edges):
+            return None
+        if x_hint < layout_geometry['LINE_HINT_%d' % line_nb][key_index][0][0]:
             return None
 
         # get the full character
@@ -907,10 +1249,11 @@ class VKeyboard(Scatter):
         key_data, key = touch.ud[self.uid]['key']
         displayed_char, internal, special_char, size = key_data
 
-        # send info to the bus
+        # send info to the bus, after the input queued before
         b_keycode = special_char
         b_modifiers = self._get_modifiers()
-        self.dispatch('on_key_up', b_keycode, internal, b_modifiers)
+        self._queue(self.dispatch,
+                    ('on_key_up', b_keycode, internal, b_modifiers))
 
         if special_char == 'capslock':
             uid = -1
@@ -946,14 +1289,12 @@ class VKeyboard(Scatter):
             return
         
         if len(touch.ud['key'][0][2]) == 1 and touch.ud['key'][0][2].isalpha():
-            with self.canvas:
-                Color(0.5, 0.6, 1)
-                touch.ud['line'] = Line(points=[x, y], width=2)
+            touch.ud['trail'] = GestureTrail(
+                self.canvas, (x, y), max_points=self.trail_points)
         elif touch.ud['key'][0][2] == u'ctrl':
             touch.ud['ctrl'] = None
-            with self.canvas:
-                Color(0.5, 0.6, 1)
-                touch.ud['line'] = Line(points=[x, y], width=2)
+            touch.ud['trail'] = GestureTrail(
+                self.canvas, (x, y), max_points=self.trail_points)
         
         if not self.collide_margin(x, y):
             self.process_key_on(touch)
@@ -992,8 +1333,8 @@ class VKeyboard(Scatter):
         if touch.ud is None:
             return
         x, y = self.to_local(*touch.pos)
-        if 'line' in touch.ud:
-            touch.ud['line'].points += [x, y]
+        if 'trail' in touch.ud:
+            touch.ud['trail'].add_point(x, y)
         if 'key' in touch.ud and touch.ud['key'] != self.get_key_at_pos(x, y):
             touch.ud['key'] = None
 
@@ -1002,100 +1343,247 @@ class VKeyboard(Scatter):
             return
         x, y = self.to_local(*touch.pos)
         if 'key' in touch.ud and touch.ud['key'] == self.get_key_at_pos(x, y) and self.get_key_at_pos(x, y) is not None:
-            displayed_char, internal, special_char, size = touch.ud['key'][0]
-            b_keycode = special_char
-            b_modifiers = self._get_modifiers()
-            if special_char.startswith('sug'):
-                if internal is not None and internal != '':
-                    word = self.get_current_word()
-                    textarea = self.get_text_area()
-                    textarea.select_text(textarea.cursor_index() - len(word), textarea.cursor_index())
-                    textarea.delete_selection()
-            if internal is not None and len(internal) == 1 and not (len(special_char) == 1 and special_char.isalpha()):
-                prev_word = str(self.get_previous_word())
-                cur_word = str(self.get_current_word())
-                if cur_word != '':
-                    self.user_nograms += 1
-                    if cur_word not in self.words:
-                        self.words[cur_word.lower()] = self.val_dist(tuple(map(self.key_centers.__getitem__, cur_word.lower()))) + (0.0,)
-                    self.user_unigrams[cur_word] = self.user_unigrams.get(cur_word, 0) + 1
-                    if prev_word != '':
-                        self.user_bigrams[(prev_word, cur_word)] = self.user_bigrams.get((prev_word, cur_word), 0) + 1
-                    self.dispatch('on_key_down', b_keycode, internal, b_modifiers)
-                    matches = self.candidate_guesses()[:6]
-                    self.update_candidates(matches)
-                else:
-                    self.dispatch('on_key_down', b_keycode, internal, b_modifiers)
-            else:
-                self.dispatch('on_key_down', b_keycode, internal, b_modifiers)
-            if (len(special_char) == 1 and special_char.isalpha()) or special_char == 'backspace':
-                word = self.get_current_word()
-                if len(word) >= 4:
-                    matches = self.candidate_predictions(word)[:6]
-                else:
-                    matches = []
-                self.update_candidates(matches)
+            self._queue_input(self._commit_key, touch.ud['key'][0],
+                              self._get_modifiers())
         elif 'ctrl' in touch.ud and self.get_key_at_pos(x, y) is not None:
             displayed_char, internal, special_char, size = self.get_key_at_pos(x, y)[0]
-            k = special_char
-            if k == 'c':
-                textarea = self.get_text_area()
-                Clipboard.put(textarea.selection_text, 'STRING')
-                textarea.cancel_selection()
-            elif k == 'v':
-                textarea = self.get_text_area()
-                textarea.delete_selection()
-                textarea.insert_text(Clipboard.get('STRING'))
-            elif k == 'a':
-                textarea = self.get_text_area()
-                textarea.select_all()
-            elif k == 'x':
-                textarea = self.get_text_area()
-                Clipboard.put(textarea.selection_text, 'STRING')
-                textarea.delete_selection()
-            elif k == 'z':
-                textarea = self.get_text_area()
-                textarea.do_undo()
-            elif k == 'y':
-                textarea = self.get_text_area()
-                textarea.do_redo()
-            elif k == 'l':
-                available_layouts = self.available_layouts.keys()
-                self.layout = available_layouts[(available_layouts.index(self.layout) + 1) % len(self.available_layouts)]
-                self.reload_layout()
-            #elif k == 's':
-            #    window = self.get_parent_window()
-            #    textarea = self.get_text_area()
-            #    def _on_close(self):
-            #        window.children[0].remove_widget(settings)
-            #        textarea.focus = True
-            #    settings = Settings(on_close=_on_close)
-            #    settings.add_json_panel('VKeyboard Settings', self.config, 'settings.json')
-            #    window.children[1].add_widget(settings)
-            #    window.release_keyboard(self)
-                
-        elif 'line' in touch.ud:
-            gesture = touch.ud['line'].points
-            gesture = [(gesture[i], gesture[i+1]) for i in xrange(0, len(gesture), 2)]
-            matches = self.candidate_matches(gesture)[:6]
-            self.update_candidates(matches)
-            b_modifiers = self._get_modifiers()
-            if 'shift' in b_modifiers and 'capslock' not in b_modifiers:
-                matches = [(w[0].upper() + w[1:], p) for w, p in matches]
-            elif 'capslock' in b_modifiers and 'shift' not in b_modifiers:
-                matches = [(w.upper(), p) for w, p in matches]
-            if len(matches) > 0:
-                textarea = self.get_text_area()
-                textarea.delete_selection()
-                textarea.insert_text(matches[0][0])
+            self._queue_input(self._commit_shortcut, special_char)
+        elif 'trail' in touch.ud:
+            self._queue_gesture(touch.ud['trail'].points, self._get_modifiers())
         if touch.grab_current is self:
             self.process_key_up(touch)
-        if 'line' in touch.ud:
-            self.canvas.remove(touch.ud['line'])
+        if 'trail' in touch.ud:
+            touch.ud['trail'].remove()
         return super(VKeyboard, self).on_touch_up(touch)
     
+    def _submit(self, func, args, callback):
+        if not self.async_decoding:
+            callback(func(*args))
+            return None
+        return self.decode_worker.submit(
+            func, args, callback,
+            owner=self.user_id or 'vkeyboard-%d' % self.uid)
+
+    # The input queue holds [handler, args, pending] entries, applied in
+    # order. A gesture entry stays pending until its candidates are decoded,
+    # and holds back the input queued after it.
+
+    def _queue_input(self, handler, *largs):
+        # new input makes pending suggestions stale
+        self._cancel_suggestions()
+        self._queue(handler, largs)
+
+    def _queue(self, handler, largs):
+        self._input_queue.append([handler, largs, False])
+        self._process_input_queue()
+
+    def _queue_gesture(self, points, b_modifiers):
+        # the gesture is decoded once the input before it is applied, when
+        # its previous word is known
+        self._queue_input(self._decode_gesture, points, b_modifiers)
+
+    def _decode_gesture(self, points, b_modifiers):
+        # the pending entry of the gesture goes first in the queue, and holds
+        # back the input queued after it until its candidates are decoded
+        gesture = self.to_layout_units(points)
+        prev_word = self.get_previous_word()
+        entry = [self._commit_gesture, (points, prev_word, b_modifiers), True]
+        self._input_queue.insert(0, entry)
+        decode = self.decoder.candidate_matches
+        shadow = None
+        if self.shadow_decoder is not None:
+            comparison = ShadowComparison(self.shadow_stats,
+                                          self._report_shadow)
+            decode = comparison.timed('primary', decode)
+            shadow = (comparison.timed('shadow',
+                                       self.shadow_decoder.candidate_matches),
+                      (gesture, prev_word))
+        self._submit(decode, (gesture, prev_word),
+                     partial(self._on_gesture_decoded, entry, shadow))
+
+    def _report_shadow(self, comparison):
+        # called from a worker thread
+        rankings, times = comparison.rankings, comparison.times
+        log = Logger.info if rankings['primary'][:1] != \
+            rankings['shadow'][:1] else Logger.debug
+        log('VKeyboard: shadow %s %.1f ms %s, %s %.1f ms %s' % (
+            self.decoder_backend, times['primary'] * 1000,
+            ' '.join(rankings['primary']), self.shadow_backend,
+            times['shadow'] * 1000, ' '.join(rankings['shadow'])))
+
+    def _on_gesture_decoded(self, entry, shadow, matches):
+        entry[1] += (matches, )
+        entry[2] = False
+        self._process_input_queue()
+        if shadow is not None:
+            # the shadow decoding always runs on its worker, even when the
+            # primary one doesn't, and its result is dropped
+            func, args = shadow
+            self.shadow_worker.submit(func, args, lambda matches: None,
+                                      owner='shadow')
+
+    def _process_input_queue(self):
+        queue = self._input_queue
+        while queue and not queue[0][2]:
+            handler, largs, pending = queue.pop(0)
+            handler(*largs)
+
+    def _request_suggestions(self, func, *largs):
+        self._cancel_suggestions()
+        self._suggestion_request = self._submit(
+            func, largs, self._on_suggestions)
+
+    def _cancel_suggestions(self):
+        if self._suggestion_request is not None:
+            self._suggestion_request.cancel()
+            self._suggestion_request = None
+
+    def _on_suggestions(self, matches):
+        self._suggestion_request = None
+        self.update_candidates(matches[:6])
+
+    def _commit_key(self, key_data, b_modifiers):
+        displayed_char, internal, special_char, size = key_data
+        b_keycode = special_char
+        autocorrection, self._autocorrection = self._autocorrection, None
+        if special_char == 'backspace' and autocorrection is not None and \
+                self._revert_autocorrection(autocorrection):
+            self.update_candidates([])
+            return
+        if special_char.startswith('sug'):
+            if internal is not None and internal != '':
+                if self.recorder is not None:
+                    self.recorder.choose(internal)
+                word = self.get_current_word()
+                textarea = self.get_text_area()
+                textarea.select_text(textarea.cursor_index() - len(word), textarea.cursor_index())
+                textarea.delete_selection()
+        if internal is not None and len(internal) == 1 and not (len(special_char) == 1 and special_char.isalpha()):
+            prev_word = str(self.get_previous_word())
+            cur_word = str(self.get_current_word())
+            if cur_word != '':
+                if self.autocorrect:
+                    cur_word = self._autocorrect(cur_word, prev_word,
+                                                 internal)
+                self._learn(cur_word, prev_word)
+                self.dispatch('on_key_down', b_keycode, internal, b_modifiers)
+                self._request_suggestions(self.decoder.candidate_guesses,
+                                          self.get_previous_word())
+            else:
+                self.dispatch('on_key_down', b_keycode, internal, b_modifiers)
+        else:
+            self.dispatch('on_key_down', b_keycode, internal, b_modifiers)
+        if (len(special_char) == 1 and special_char.isalpha()) or special_char == 'backspace':
+            word = self.get_current_word()
+            if len(word) >= 4:
+                self._request_suggestions(self.decoder.candidate_predictions,
+                                          word, self.get_previous_word())
+            else:
+                self.update_candidates([])
+
+    def _commit_shortcut(self, k):
+        autocorrection, self._autocorrection = self._autocorrection, None
+        if k == 'z' and autocorrection is not None and \
+                self._revert_autocorrection(autocorrection):
+            return
+        if k == 'c':
+            textarea = self.get_text_area()
+            Clipboard.put(textarea.selection_text, 'STRING')
+            textarea.cancel_selection()
+        elif k == 'v':
+            textarea = self.get_text_area()
+            textarea.delete_selection()
+            textarea.insert_text(Clipboard.get('STRING'))
+        elif k == 'a':
+            textarea = self.get_text_area()
+            textarea.select_all()
+        elif k == 'x':
+            textarea = self.get_text_area()
+            Clipboard.put(textarea.selection_text, 'STRING')
+            textarea.delete_selection()
+        elif k == 'z':
+            textarea = self.get_text_area()
+            textarea.do_undo()
+        elif k == 'y':
+            textarea = self.get_text_area()
+            textarea.do_redo()
+        elif k == 'l':
+            available_layouts = sorted(set(self.layout_files).union(self.available_layouts))
+            self.layout = available_layouts[(available_layouts.index(self.layout) + 1) % len(available_layouts)]
+        #elif k == 's':
+        #    window = self.get_parent_window()
+        #    textarea = self.get_text_area()
+        #    def _on_close(self):
+        #        window.children[0].remove_widget(settings)
+        #        textarea.focus = True
+        #    settings = Settings(on_close=_on_close)
+        #    settings.add_json_panel('VKeyboard Settings', self.config, 'settings.json')
+        #    window.children[1].add_widget(settings)
+        #    window.release_keyboard(self)
+
+    def _learn(self, cur_word, prev_word):
+        self.decoder.learn(cur_word, prev_word)
+        if self.shadow_decoder is not None:
+            self.shadow_decoder.learn(cur_word, prev_word)
+
+    def _autocorrect(self, word, prev_word, separator):
+        # replace the word before the cursor by its correction, with the
+        # same capitalization, and return the committed word. The correction
+        # can be reverted until the next input, see _revert_autocorrection.
+        correction = self.decoder.autocorrect(
+            word, prev_word, self.autocorrect_budget,
+            self.autocorrect_confidence, self.autocorrect_margin)
+        if correction is None:
+            return word
+        if len(word) > 1 and word.isupper():
+            correction = correction.upper()
+        elif word[0].isupper():
+            correction = correction[0].upper() + correction[1:]
+        textarea = self.get_text_area()
+        i = textarea.cursor_index()
+        textarea.select_text(i - len(word), i)
+        textarea.delete_selection()
+        textarea.insert_text(correction)
+        correction = str(correction)
+        self._autocorrection = (word, correction, prev_word, separator)
+        return correction
+
+    def _revert_autocorrection(self, autocorrection):
+        # put back the word as typed in place of its correction and the
+        # separator that committed it, and learn it instead of the correction
+        word, correction, prev_word, separator = autocorrection
+        committed = correction + separator
+        textarea = self.get_text_area()
+        i = textarea.cursor_index()
+        if textarea.text[max(i - len(committed), 0):i] != committed:
+            return False
+        textarea.select_text(i - len(committed), i)
+        textarea.delete_selection()
+        textarea.insert_text(word)
+        for decoder in (self.decoder, self.shadow_decoder):
+            if decoder is not None:
+                decoder.forget(correction, prev_word)
+                decoder.learn(word, prev_word)
+        return True
+
+    def _commit_gesture(self, points, prev_word, b_modifiers, matches):
+        self._autocorrection = None
+        matches = matches[:6]
+        self.update_candidates(matches)
+        if self.recorder is not None:
+            self.recorder.add(points, self.layout, self.size, prev_word,
+                              matches[0][0] if matches else u'')
+        if 'shift' in b_modifiers and 'capslock' not in b_modifiers:
+            matches = [(w[0].upper() + w[1:], p) for w, p in matches]
+        elif 'capslock' in b_modifiers and 'shift' not in b_modifiers:
+            matches = [(w.upper(), p) for w, p in matches]
+        if len(matches) > 0:
+            textarea = self.get_text_area()
+            textarea.delete_selection()
+            textarea.insert_text(matches[0][0])
+
     def update_candidates(self, matches):
-        layout = self.available_layouts[self.layout]
+        layout = self.load_layout()
         i = -1
         for i, (w, p) in enumerate(matches):
             layout['normal_1'][i] = [unicode(w), unicode(w), u'sug%d' % i, 2.5]
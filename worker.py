@@ -0,0 +1,191 @@
+'''
+Worker
+======
+
+Run decoding requests off the UI thread.
+
+A :class:`DecodeWorker` executes the submitted requests on a pool of daemon
+threads, and posts each result back to the Kivy main thread with
+:meth:`~kivy.clock.Clock.schedule_once`. All the keyboards of the process
+share the pool returned by :func:`get_decode_worker`, so the gestures of
+several users swiping at once are decoded concurrently instead of queueing
+behind one another. Requests are started in submission order but may
+complete in any order; each keyboard submits its gestures one at a time, see
+:data:`~vkeyboard.VKeyboard.async_decoding`. A request can be cancelled at
+any time from the main thread with :meth:`DecodeRequest.cancel`: if it is
+still queued it is skipped, if it is running the decoder is asked to stop
+early, and in any case its callback is never called.
+
+The decoding function is called with the request's `cancelled` event as
+`cancelled` keyword argument, see :meth:`~decoder.Decoder.candidate_matches`.
+If it raises, the error is logged and the callback gets an empty list.
+
+Each request can name its owner, the user or keyboard it was submitted for.
+The worker keeps, per owner, the time requests waited in the queue and the
+time they took to decode, see :meth:`DecodeWorker.latency_stats`.
+
+The decoders are pure Python, so the threads interleave under the GIL rather
+than run truly in parallel: the pool keeps a long gesture decode from
+blocking the requests of other users, and overlaps the disk reads of the
+memory-mapped lexicon and bigrams.
+
+For the same reason, background work that nobody waits for goes to the
+worker returned by :func:`get_shadow_worker`, whose requests only start
+while the shared pool is idle, so that they don't slow down the decodings
+the users wait for.
+'''
+
+__all__ = ('DecodeWorker', 'DecodeRequest', 'get_decode_worker',
+           'get_shadow_worker')
+
+from functools import partial
+from threading import Thread, Event, Lock
+from time import sleep, time
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+from kivy.clock import Clock
+from kivy.logger import Logger
+
+from profiler import StageStats
+
+# number of threads of the shared worker
+default_workers = 4
+
+# how often a worker waiting for another one to be idle checks it, in seconds
+idle_poll = .005
+
+_shared_worker = None
+_shadow_worker = None
+
+
+class DecodeRequest(object):
+    '''A decoding function call submitted to a :class:`DecodeWorker`.'''
+
+    __slots__ = ('func', 'args', 'callback', 'cancelled', 'owner',
+                 'submitted')
+
+    def __init__(self, func, args, callback, owner=None):
+        self.func = func
+        self.args = args
+        self.callback = callback
+        self.owner = owner
+        self.submitted = time()
+        self.cancelled = Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class DecodeWorker(object):
+    '''Decode requests on `workers` background threads, started on the
+    first :meth:`submit`. With a single thread, requests complete in
+    submission order. If `after` is another worker, a request is only
+    started once `after` is :meth:`idle`.
+    '''
+
+    def __init__(self, workers=1, after=None):
+        self.queue = Queue()
+        self.workers = workers
+        self.after = after
+        self.threads = []
+        self.latencies = {}
+        self.running = 0
+        self.lock = Lock()
+
+    def submit(self, func, args, callback, owner=None):
+        '''Call `func(*args)` on a worker thread, then `callback(result)` on
+        the main thread. Returns the :class:`DecodeRequest`.
+        '''
+        if not self.threads:
+            for i in xrange(self.workers):
+                thread = Thread(target=self._run, name='DecodeWorker-%d' % i)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+        request = DecodeRequest(func, args, callback, owner)
+        self.queue.put(request)
+        return request
+
+    def idle(self):
+        '''Return True if no request is queued or running.'''
+        with self.lock:
+            return not self.running and self.queue.empty()
+
+    def latency_stats(self):
+        '''Return a dict of owner to the `wait` and `decode`
+        :meth:`~profiler.StageStats.as_dict` measurements of its requests.
+        '''
+        with self.lock:
+            return dict((owner, dict((name, stats.as_dict())
+                                     for name, stats in latency.items()))
+                        for owner, latency in self.latencies.items())
+
+    def _record(self, owner, wait, decode):
+        with self.lock:
+            latency = self.latencies.get(owner)
+            if latency is None:
+                latency = self.latencies[owner] = {
+                    'wait': StageStats(), 'decode': StageStats()}
+            latency['wait'].add(wait)
+            latency['decode'].add(decode)
+
+    def _run(self):
+        queue = self.queue
+        while True:
+            request = queue.get()
+            after = self.after
+            while after is not None and not after.idle() and \
+                    not request.cancelled.is_set():
+                sleep(idle_poll)
+            if request.cancelled.is_set():
+                continue
+            with self.lock:
+                self.running += 1
+            start = time()
+            # a failed decoding still delivers an empty result, the keyboard
+            # holds back the input queued after a gesture until it gets one
+            result = []
+            try:
+                result = request.func(*request.args,
+                                      cancelled=request.cancelled)
+            except Exception:
+                Logger.exception('DecodeWorker: decoding failed')
+            finally:
+                with self.lock:
+                    self.running -= 1
+                self._record(request.owner, start - request.submitted,
+                             time() - start)
+                if not request.cancelled.is_set():
+                    Clock.schedule_once(partial(self._deliver, request,
+                                                result))
+
+    def _deliver(self, request, result, *largs):
+        # runs on the main thread, where requests are cancelled, so a request
+        # cancelled after its result was posted is still dropped here
+        if not request.cancelled.is_set():
+            request.callback(result)
+
+
+def get_decode_worker(workers=default_workers):
+    '''Return the :class:`DecodeWorker` shared by all the keyboards of the
+    process, creating it with `workers` threads on the first call.
+    '''
+    global _shared_worker
+    if _shared_worker is None:
+        _shared_worker = DecodeWorker(workers)
+    return _shared_worker
+
+
+def get_shadow_worker():
+    '''Return the single thread :class:`DecodeWorker` shared by the shadow
+    decodings of all the keyboards, see
+    :data:`~vkeyboard.VKeyboard.shadow_backend`. Its requests only start
+    while the worker of :func:`get_decode_worker` is idle.
+    '''
+    global _shadow_worker
+    if _shadow_worker is None:
+        _shadow_worker = DecodeWorker(after=get_decode_worker())
+    return _shadow_worker